@@ -0,0 +1,297 @@
+#!/usr/bin/python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+# This Class is a poller module that run the python checks in python
+# interpreters that stay up (see runner.py), so each check do not pay
+# the interpreter start and its imports
+
+import os
+import sys
+import signal
+import time
+import shlex
+import select
+import subprocess
+import traceback
+import cStringIO
+from Queue import Empty
+
+from shinken.basemodule import BaseModule
+from shinken.launcher import set_non_blocking, read_all, get_messages, make_message
+from shinken.log import logger
+
+properties = {
+    'daemons': ['poller'],
+    'type': 'python_checks',
+    'external': False,
+    # To be a real worker module, you must set this
+    'worker_capable': True,
+    }
+
+
+# called by the plugin manager to get a poller
+def get_instance(mod_conf):
+    logger.info("[PythonChecks] Get a python checks poller module for plugin %s" % mod_conf.get_name())
+    instance = Python_checks_poller(mod_conf)
+    return instance
+
+
+class PythonRunner(object):
+    """A runner.py process, that run one check at a time"""
+
+    def __init__(self):
+        self.process = None
+        self.fd = None
+        self.buf = ''
+        self.check = None
+        self.nb_runs = 0
+
+    def start(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runner.py')
+        # It must import shinken and the checks like us
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        self.process = subprocess.Popen([sys.executable, path], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, close_fds=True, env=env)
+        self.fd = self.process.stdout.fileno()
+        set_non_blocking(self.fd)
+        self.buf = ''
+        self.nb_runs = 0
+
+    def is_started(self):
+        return self.process is not None
+
+    def run(self, chk, argv, env, max_output_length):
+        self.check = chk
+        self.process.stdin.write(make_message((chk.id, argv, env, max_output_length)))
+        self.process.stdin.flush()
+
+    # The result of the check, if it's complete. Raise IOError if
+    # the runner died
+    def read(self):
+        data = read_all(self.fd)
+        if data is None:
+            raise IOError('the python runner died')
+        res, self.buf = get_messages(self.buf + data)
+        if not res:
+            return None
+        self.check = None
+        self.nb_runs += 1
+        return res[0][1:]
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.kill()
+        except OSError:
+            pass
+        self.process.wait()
+        self.process = None
+        self.check = None
+
+
+class Python_checks_poller(BaseModule):
+
+    def __init__(self, mod_conf):
+        BaseModule.__init__(self, mod_conf)
+        # Number of checks we run at the same time
+        self.nb_runners = int(getattr(mod_conf, 'processes', '4'))
+        # We restart the runners after some checks, for the leaks of the checks
+        self.max_checks_by_runner = int(getattr(mod_conf, 'max_checks_by_runner', '1000'))
+        self.max_plugins_output_length = int(getattr(mod_conf, 'max_plugins_output_length', '8192'))
+
+    # Called by poller to say 'let's prepare yourself guy'
+    def init(self):
+        logger.info("[PythonChecks] Initialization of the python checks poller module")
+        self.i_am_dying = False
+        self.runners = [PythonRunner() for i in xrange(self.nb_runners)]
+
+    # Get new checks if less than nb_checks_max
+    # If no new checks got and no check in queue,
+    # sleep for 1 sec
+    # REF: doc/shinken-action-queues.png (3)
+    def get_new_checks(self):
+        try:
+            while(True):
+                msg = self.s.get(block=False)
+                if msg is not None:
+                    self.checks.append(msg.get_data())
+        except Empty, exp:
+            if len(self.checks) == 0:
+                time.sleep(1)
+
+    # Launch checks that are in status, if we got a free runner
+    # REF: doc/shinken-action-queues.png (4)
+    def launch_new_checks(self):
+        free = [r for r in self.runners if r.check is None]
+        for chk in self.checks:
+            if not free:
+                return
+            if chk.status != 'queue':
+                continue
+            chk.status = 'launched'
+            chk.check_time = time.time()
+            try:
+                argv = shlex.split(chk.command.encode('utf8', 'ignore'))
+            except ValueError, exp:
+                argv = []
+            if not argv:
+                chk.exit_status = 3
+                chk.get_outputs('Not a valid python check command: %s' % chk.command, self.max_plugins_output_length)
+                chk.status = 'done'
+                chk.execution_time = 0.0
+                continue
+            env = {}
+            for p in chk.env:
+                env[p] = chk.env[p].encode('utf8')
+
+            r = free.pop()
+            try:
+                if not r.is_started():
+                    r.start()
+                r.run(chk, argv, env, self.max_plugins_output_length)
+            except (OSError, IOError), exp:
+                r.stop()
+                chk.exit_status = 3
+                chk.get_outputs('Cannot run the python check: %s' % exp, self.max_plugins_output_length)
+                chk.status = 'done'
+                chk.execution_time = time.time() - chk.check_time
+
+    # Wait a bit for the runners, and get their results
+    def get_runners_results(self):
+        busy = dict((r.fd, r) for r in self.runners if r.check is not None)
+        if busy:
+            try:
+                ins, _, _ = select.select(busy.keys(), [], [], 0.1)
+            except select.error:
+                ins = []
+        else:
+            ins = []
+
+        for fd in ins:
+            r = busy[fd]
+            chk = r.check
+            try:
+                res = r.read()
+            except IOError, exp:
+                r.stop()
+                chk.exit_status = 3
+                chk.get_outputs('The python check killed its runner', self.max_plugins_output_length)
+                chk.status = 'done'
+                chk.execution_time = time.time() - chk.check_time
+                continue
+            if res is None:
+                continue
+            (exit_status, chk.stdoutdata, chk.stderrdata, chk.u_time, chk.s_time) = res
+            chk.set_exit_status(exit_status, self.max_plugins_output_length)
+            chk.execution_time = time.time() - chk.check_time
+            if r.nb_runs >= self.max_checks_by_runner:
+                r.stop()
+
+        # We cannot stop a python code, so we kill its runner
+        now = time.time()
+        for r in self.runners:
+            chk = r.check
+            if chk is not None and now - chk.check_time > chk.timeout:
+                r.stop()
+                chk.status = 'timeout'
+                chk.exit_status = 3
+                chk.execution_time = now - chk.check_time
+
+    # Check the status of checks
+    # if done, return message finished :)
+    # REF: doc/shinken-action-queues.png (5)
+    def manage_finished_checks(self):
+        self.get_runners_results()
+
+        to_del = []
+        for c in self.checks:
+            if c.status in ('done', 'timeout'):
+                to_del.append(c)
+                try:
+                    self.returns_queue.put(c)
+                except IOError, exp:
+                    logger.error("[PythonChecks] Exiting: %s" % exp)
+                    sys.exit(2)
+
+        # And delete finished checks
+        for chk in to_del:
+            self.checks.remove(chk)
+
+    def stop_runners(self):
+        for r in self.runners:
+            r.stop()
+
+    # Wrapper function for work in order to catch the exception
+    # to see the real work, look at do_work
+    def work(self, s, returns_queue, c):
+        try:
+            self.do_work(s, returns_queue, c)
+        # Catch any exception, try to print it and exit anyway
+        except Exception, exp:
+            output = cStringIO.StringIO()
+            traceback.print_exc(file=output)
+            logger.error("Worker '%d' exit with an unmanaged exception : %s" % (self.id, output.getvalue()))
+            output.close()
+            self.stop_runners()
+            # Ok I die now
+            raise
+
+    # id = id of the worker
+    # s = Global Queue Master->Slave
+    # m = Queue Slave->Master
+    # return_queue = queue managed by manager
+    # c = Control Queue for the worker
+    def do_work(self, s, returns_queue, c):
+        logger.info("[PythonChecks] Module started!")
+        ## restore default signal handler for the workers:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.set_proctitle(self.name)
+
+        self.checks = []
+        self.returns_queue = returns_queue
+        self.s = s
+        while True:
+            # If we are dying (big problem!) we do not
+            # take new jobs, we just finished the current one
+            if not self.i_am_dying:
+                # REF: doc/shinken-action-queues.png (3)
+                self.get_new_checks()
+                # REF: doc/shinken-action-queues.png (4)
+                self.launch_new_checks()
+            # REF: doc/shinken-action-queues.png (5)
+            self.manage_finished_checks()
+
+            # Now get order from master
+            try:
+                cmsg = c.get(block=False)
+                if cmsg.get_type() == 'Die':
+                    logger.info("[PythonChecks] Dad say we are dying...")
+                    break
+            except:
+                pass
+
+        self.stop_runners()
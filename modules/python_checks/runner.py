@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A python interpreter that stay up and run the python checks one after
+the other, so they do not pay the interpreter start and their imports
+each time.
+
+It's launched by the python_checks module, and read on stdin
+(id, argv, env, max_output_length) marshal messages (like the launcher),
+and give back (id, exit_status, stdout, stderr, u_time, s_time).
+
+argv[0] can be:
+ * a python script, run like with python argv[0] argv[1:]
+ * package.module:function, that is called with argv[1:]. It can
+   print the output and return the exit status, or return a
+   (exit_status, output) tuple
+"""
+
+import os
+import sys
+import traceback
+
+from shinken.launcher import get_messages, make_message
+
+
+class BoundedOutput(object):
+    """A sys.stdout that keep only the first max_length chars"""
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self.data = []
+        self.size = 0
+
+    def write(self, s):
+        if self.size >= self.max_length:
+            return
+        if isinstance(s, unicode):
+            s = s.encode('utf8', 'replace')
+        s = s[:self.max_length - self.size]
+        self.data.append(s)
+        self.size += len(s)
+
+    def writelines(self, lines):
+        for l in lines:
+            self.write(l)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self.data)
+
+
+class Runner(object):
+
+    def __init__(self):
+        # path -> (mtime, code)
+        self.scripts = {}
+
+    # The compiled script, compiled again only if it changed
+    def get_code(self, path):
+        mtime = os.stat(path).st_mtime
+        mtime_code = self.scripts.get(path)
+        if mtime_code is None or mtime_code[0] != mtime:
+            f = open(path)
+            try:
+                code = compile(f.read(), path, 'exec')
+            finally:
+                f.close()
+            self.scripts[path] = mtime_code = (mtime, code)
+        return mtime_code[1]
+
+    def get_function(self, entry_point):
+        mod_name, func_name = entry_point.split(':', 1)
+        mod = __import__(mod_name, {}, {}, [func_name])
+        return getattr(mod, func_name)
+
+    # Run a check, and give its exit status, stdout and stderr
+    def run(self, argv, env, max_output_length):
+        out = BoundedOutput(max_output_length)
+        err = BoundedOutput(max_output_length)
+        old_env = os.environ.copy()
+        old_argv = sys.argv
+        os.environ.update(env)
+        sys.stdout, sys.stderr = out, err
+        try:
+            try:
+                if ':' in argv[0] and not os.path.exists(argv[0]):
+                    res = self.get_function(argv[0])(argv[1:])
+                    if isinstance(res, tuple):
+                        exit_status, output = res
+                        out.write(output)
+                    else:
+                        exit_status = res
+                else:
+                    sys.argv = list(argv)
+                    g = {'__name__': '__main__', '__file__': argv[0], '__builtins__': __builtins__}
+                    exec self.get_code(argv[0]) in g
+                    exit_status = 0
+            except SystemExit, exp:
+                exit_status = exp.code
+            except Exception, exp:
+                out.write('UNKNOWN - %s: %s\n' % (exp.__class__.__name__, exp))
+                traceback.print_exc(file=err)
+                exit_status = 3
+        finally:
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+            sys.argv = old_argv
+            os.environ.clear()
+            os.environ.update(old_env)
+        # Like the python interpreter does with sys.exit()
+        if exit_status is None:
+            exit_status = 0
+        elif not isinstance(exit_status, (int, long)):
+            err.write(str(exit_status))
+            exit_status = 1
+        return (exit_status, out.getvalue(), err.getvalue())
+
+    def serve(self, inp, out):
+        buf = ''
+        while True:
+            data = os.read(inp, 65536)
+            # Our worker is gone
+            if not data:
+                return
+            msgs, buf = get_messages(buf + data)
+            for (id, argv, env, max_output_length) in msgs:
+                t0 = os.times()
+                exit_status, stdout, stderr = self.run(argv, env, max_output_length)
+                t1 = os.times()
+                res = (id, exit_status, stdout, stderr, t1[0] - t0[0], t1[1] - t0[1])
+                msg = make_message(res)
+                while msg:
+                    msg = msg[os.write(out, msg):]
+
+
+if __name__ == '__main__':
+    # The checks can write on the fds 1 and 2 (like their sub processes),
+    # so we talk with the worker on others
+    inp = os.dup(0)
+    out = os.dup(1)
+    null = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(null, fd)
+    # The checks must not import things from the module directory
+    del sys.path[0]
+    Runner().serve(inp, out)
@@ -23,6 +23,7 @@
 # along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
 import time
 import shlex
 import sys
@@ -37,6 +38,7 @@ except ImportError:
 
 from shinken.util import safe_print
 from shinken.log import logger
+from shinken.launcher import OutputBuffer, read_output, set_non_blocking
 
 __all__ = ('Action')
 
@@ -49,15 +51,18 @@ shellchars = ('!', '$', '^', '&', '*', '(', ')', '~', '[', ']',
                    '|', '{', '}', ';', '<', '>', '?', '`')
 
 
-# Try to read a fd in a non blocking mode
-def no_block_read(output):
-    fd = output.fileno()
-    fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-    fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-    try:
-        return output.read()
-    except:
-        return ''
+# A \| in an output is a pipe, not the perfdata separator
+unescaped_pipe = re.compile(r'(?<!\\)\|')
+
+
+# Split line on its pipes that are not escaped, and unescape them. We
+# look for escaped pipes only if there are some in the output (escaped)
+def split_pipes(line, escaped, maxsplit=0):
+    if not escaped:
+        if maxsplit:
+            return line.split('|', maxsplit)
+        return line.split('|')
+    return [elt.replace('\\|', '|') for elt in unescaped_pipe.split(line, maxsplit)]
 
 
 
@@ -77,6 +82,44 @@ class __Action(object):
         Action.id = max(Action.id, _id)
 
 
+    # The status is stored in the instance __dict__ like before (so
+    # pickle is the same for old daemons), but we tell our queue (the
+    # scheduler ActionQueue, if any) about each change so it can keep
+    # its status indexes up to date
+    def _get_status(self):
+        return self.__dict__.get('status', '')
+
+    def _set_status(self, status):
+        d = self.__dict__
+        queue = d.get('_queue', None)
+        if queue is not None:
+            queue.change_status(self, d.get('status', ''), status)
+        d['status'] = status
+
+    status = property(_get_status, _set_status)
+
+    # Same for t_to_go: the queue keeps its scheduled actions ordered by
+    # it, so it must know when someone reschedules one of them
+    def _get_t_to_go(self):
+        return self.__dict__.get('t_to_go', 0)
+
+    def _set_t_to_go(self, t_to_go):
+        d = self.__dict__
+        d['t_to_go'] = t_to_go
+        queue = d.get('_queue', None)
+        if queue is not None:
+            queue.change_t_to_go(self)
+
+    t_to_go = property(_get_t_to_go, _set_t_to_go)
+
+
+    # We do not want to pickle our queue with us
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_queue', None)
+        return state
+
+
     def set_type_active(self):
         "Dummy function, only useful for checks"
         pass
@@ -119,6 +162,7 @@ class __Action(object):
         # if the fcntl is available
         self.stdoutdata = ''
         self.stderrdata = ''
+        self.output_buffers = None
 
         return self.execute__()  ## OS specific part
 
@@ -126,34 +170,31 @@ class __Action(object):
         #print "Get only," , max_plugins_output_length, "bytes"
         # Squeeze all output after max_plugins_output_length
         out = out[:max_plugins_output_length]
-        # manage escaped pipes
-        out = out.replace('\|', '___PROTECT_PIPE___')
-        # Then cuts by lines
-        elts = out.split('\n')
-        # For perf data
-        elts_line1 = elts[0].split('|')
-        # First line before | is output, and strip it
-        self.output = elts_line1[0].strip().replace('___PROTECT_PIPE___', '|')
-        # Init perfdata as void
-        self.perf_data = ''
-        # After | is perfdata, and strip it
-        if len(elts_line1) > 1:
-            self.perf_data = elts_line1[1].strip().replace('___PROTECT_PIPE___', '|')
+        # Escaped pipes are rare, so we look for them only once
+        escaped = '\\|' in out
+        # First line before | is output, and after it's perfdata
+        line1, _, others = out.partition('\n')
+        elts_line1 = split_pipes(line1, escaped)
+        self.output = elts_line1[0].strip()
+        perf_data = [elts_line1[1].strip() if len(elts_line1) > 1 else '']
         # Now manage others lines. Before the | it's long_output
-        # And after it's all perf_data, \n join
+        # And after it's all perf_data, ' ' join
         long_output = []
-        in_perfdata = False
-        for line in elts[1:]:
-            # if already in perfdata, direct append
-            if in_perfdata:
-                self.perf_data += ' ' + line.strip().replace('___PROTECT_PIPE___', '|')
-            else:  # not already in? search for the | part :)
-                elts = line.split('|', 1)
+        if others:
+            lines = others.split('\n')
+            for i, line in enumerate(lines):
+                elts = split_pipes(line, escaped, 1)
                 # The first part will always be long_output
-                long_output.append(elts[0].strip().replace('___PROTECT_PIPE___', '|'))
+                long_output.append(elts[0].strip())
                 if len(elts) > 1:
-                    in_perfdata = True
-                    self.perf_data += ' ' + elts[1].strip().replace('___PROTECT_PIPE___', '|')
+                    perf_data.append(elts[1].strip())
+                    # All the next lines are perfdata
+                    for line in lines[i + 1:]:
+                        if escaped:
+                            line = line.replace('\\|', '|')
+                        perf_data.append(line.strip())
+                    break
+        self.perf_data = ' '.join(perf_data)
         # long_output is all non output and perfline, join with \n
         self.long_output = '\n'.join(long_output)
 
@@ -175,24 +216,10 @@ class __Action(object):
             # asynchronous mode, so we won't block the PIPE at 64K buffer
             # (deadlock...)
             if fcntl:
-                self.stdoutdata += no_block_read(self.process.stdout)
-                self.stderrdata += no_block_read(self.process.stderr)
-
+                self.read_outputs(max_plugins_output_length)
 
             if (now - self.check_time) > self.timeout:
-                self.kill__()
-                #print "Kill for timeout", self.process.pid,
-                #print self.command, now - self.check_time
-                self.status = 'timeout'
-                self.execution_time = now - self.check_time
-                self.exit_status = 3
-                # Do not keep a pointer to the process
-                del self.process
-                # Get the user and system time
-                _, _, n_child_utime, n_child_stime, _ = os.times()
-                self.u_time = n_child_utime - child_utime
-                self.s_time = n_child_stime - child_stime
-                return
+                self.set_timeout(now, child_utime, child_stime)
             return
 
         # Get standards outputs from the communicate function if we do
@@ -203,14 +230,53 @@ class __Action(object):
         else:
             # The command was to quick and finished even before we can
             # polled it first. So finish the read.
-            self.stdoutdata += no_block_read(self.process.stdout)
-            self.stderrdata += no_block_read(self.process.stderr)
+            self.read_outputs(max_plugins_output_length)
+
+        self.set_finished(max_plugins_output_length, child_utime, child_stime)
 
-        self.exit_status = self.process.returncode
+
+    # The process is still running but it's too late: kill it
+    def set_timeout(self, now, child_utime, child_stime):
+        self.kill__()
+        #print "Kill for timeout", self.process.pid,
+        #print self.command, now - self.check_time
+        self.status = 'timeout'
+        self.execution_time = now - self.check_time
+        self.exit_status = 3
+        # Do not keep a pointer to the process, nor its outputs
+        del self.process
+        del self.output_buffers
+        # Get the user and system time
+        _, _, n_child_utime, n_child_stime, _ = os.times()
+        self.u_time = n_child_utime - child_utime
+        self.s_time = n_child_stime - child_stime
+
+
+    # The process is done, and we got all its outputs: we can get
+    # the results
+    def set_finished(self, max_plugins_output_length, child_utime, child_stime):
+        exit_status = self.process.returncode
 
         # we should not keep the process now
         del self.process
 
+        if self.output_buffers is not None:
+            out, err = self.output_buffers
+            self.stdoutdata = out.getvalue()
+            self.stderrdata = err.getvalue()
+        del self.output_buffers
+
+        self.set_exit_status(exit_status, max_plugins_output_length)
+        self.execution_time = time.time() - self.check_time
+        # Also get the system and user times
+        _, _, n_child_utime, n_child_stime, _ = os.times()
+        self.u_time = n_child_utime - child_utime
+        self.s_time = n_child_stime - child_stime
+
+
+    # Get the output and the real exit status from what the process gave
+    def set_exit_status(self, exit_status, max_plugins_output_length):
+        self.exit_status = exit_status
         # if the exit status is abnormal, we add stderr to the output
         # TODO: Abnormal should be logged properly no?
         if self.exit_status not in valid_exit_status:
@@ -234,11 +300,79 @@ class __Action(object):
         del self.stderrdata
 
         self.status = 'done'
-        self.execution_time = time.time() - self.check_time
-        # Also get the system and user times
-        _, _, n_child_utime, n_child_stime, _ = os.times()
-        self.u_time = n_child_utime - child_utime
-        self.s_time = n_child_stime - child_stime
+
+
+    # Give the command to a launcher process (see launcher.py) instead
+    # of forking ourself
+    def execute_in_launcher(self, launcher, max_plugins_output_length=8192):
+        self.status = 'launched'
+        self.check_time = time.time()
+        self.wait_time = 0.0001
+        self.last_poll = self.check_time
+
+        # Same rules than execute__ for the shell
+        cmd = self.command.encode('utf8', 'ignore')
+        if sys.version_info < (2, 7) or self.got_shell_characters():
+            argv = ['/bin/sh', '-c', cmd]
+        else:
+            try:
+                argv = shlex.split(cmd)
+            except Exception, exp:
+                self.output = 'Not a valid shell command: ' + exp.__str__()
+                self.exit_status = 3
+                self.status = 'done'
+                self.execution_time = time.time() - self.check_time
+                return
+        env = {}
+        for p in self.env:
+            env[p] = self.env[p].encode('utf8')
+        launcher.launch(self, argv, env, self.timeout, max_plugins_output_length)
+
+
+    # The launcher got back the result of our command
+    def set_launcher_result(self, res, max_plugins_output_length):
+        (status, exit_status, self.stdoutdata, self.stderrdata,
+         self.execution_time, self.u_time, self.s_time) = res
+        if status == 'timeout':
+            self.status = 'timeout'
+            self.exit_status = 3
+            del self.stdoutdata
+            del self.stderrdata
+            return
+        self.set_exit_status(exit_status, max_plugins_output_length)
+
+
+    # The pipes of our process, if we got one, for the workers that
+    # wait for them with select
+    def get_output_fds(self):
+        process = getattr(self, 'process', None)
+        if process is None:
+            return []
+        return [process.stdout.fileno(), process.stderr.fileno()]
+
+
+    # The buffers for the stdout and stderr of our process. We create
+    # them at the first read, when we know how much we keep
+    def get_output_buffers(self, max_plugins_output_length):
+        if self.output_buffers is None:
+            self.output_buffers = (OutputBuffer(max_plugins_output_length),
+                                   OutputBuffer(max_plugins_output_length))
+        return self.output_buffers
+
+
+    # Read what is available on one of our outputs. Return False when
+    # the process closed it
+    def read_output_fd(self, fd, max_plugins_output_length):
+        out, err = self.get_output_buffers(max_plugins_output_length)
+        if fd == self.process.stdout.fileno():
+            return read_output(fd, out)
+        return read_output(fd, err)
+
+
+    # Read what is available on all our outputs
+    def read_outputs(self, max_plugins_output_length):
+        for fd in self.get_output_fds():
+            self.read_output_fd(fd, max_plugins_output_length)
 
 
     def copy_shell__(self, new_i):
@@ -305,6 +439,10 @@ if os.name != 'nt':
                     cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                     close_fds=True, shell=force_shell, env=self.local_env,
                     preexec_fn=os.setsid)
+                # We read the outputs when they are ready, without blocking
+                if fcntl:
+                    set_non_blocking(self.process.stdout.fileno())
+                    set_non_blocking(self.process.stderr.fileno())
             except OSError, exp:
                 logger.error("Fail launching command: %s %s %s"
                              % (self.command, exp, force_shell))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+from heapq import heappush, heappop, heapify
+
+
+class ActionQueue(dict):
+    """The scheduler checks and actions queue.
+
+    It's a classic id -> action dict, but it also keeps secondary
+    indexes of its actions:
+    * by status (scheduled, inpoller, waitconsume, zombie, ...);
+    * by (status, tag, module_type), where tag is the poller_tag for
+      checks or the reactionner_tag for actions.
+
+    Actions tell their queue when their status change (see
+    Action.status), so the indexes are always up to date and looking
+    for all 'zombie' or all 'scheduled' checks of a poller tag costs
+    only the number of matching elements, not the whole queue size.
+
+    The 'scheduled' (and not internal) actions are also in a heap by
+    (tag, module_type), ordered by t_to_go. So when a poller asks for
+    checks, we only pop the ones that are due, without looking at the
+    others. Heap entries are (t_to_go, id) and are lazily invalidated:
+    if the action is gone, no more scheduled or was rescheduled (a new
+    entry is then pushed), the entry is just dropped when we meet it.
+    """
+
+    def __init__(self, tag_prop='poller_tag'):
+        dict.__init__(self)
+        # The property used for the tag index: poller_tag for checks
+        # and reactionner_tag for notifications and event handlers
+        self.tag_prop = tag_prop
+        # status -> {id: action}
+        self.by_status = {}
+        # (status, tag, module_type) -> {id: action}
+        self.by_tag = {}
+        # id -> (tag, module_type), so we can clean the by_tag index even
+        # if someone changed the tag of an action we got
+        self.tag_keys = {}
+        # (tag, module_type) -> heap of (t_to_go, id) of scheduled actions
+        self.heaps = {}
+
+    def __setitem__(self, i, a):
+        if i in self:
+            self.__delitem__(i)
+        dict.__setitem__(self, i, a)
+        key = (getattr(a, self.tag_prop, 'None'), getattr(a, 'module_type', 'fork'))
+        self.tag_keys[i] = key
+        self._index(i, a, a.status, key)
+        a.__dict__['_queue'] = self
+        if a.status == 'scheduled':
+            self._push(i, a)
+
+    def __delitem__(self, i):
+        a = dict.__getitem__(self, i)
+        dict.__delitem__(self, i)
+        self._unindex(i, a.status, self.tag_keys.pop(i))
+        a.__dict__['_queue'] = None
+
+    def pop(self, i, *default):
+        if i not in self:
+            return dict.pop(self, i, *default)
+        a = dict.__getitem__(self, i)
+        self.__delitem__(i)
+        return a
+
+    def clear(self):
+        for a in self.itervalues():
+            a.__dict__['_queue'] = None
+        dict.clear(self)
+        self.by_status.clear()
+        self.by_tag.clear()
+        self.tag_keys.clear()
+        self.heaps.clear()
+
+    def _index(self, i, a, status, key):
+        self.by_status.setdefault(status, {})[i] = a
+        self.by_tag.setdefault((status,) + key, {})[i] = a
+
+    def _unindex(self, i, status, key):
+        elts = self.by_status.get(status)
+        if elts is not None:
+            elts.pop(i, None)
+            # Do not keep void entries, they will be created back if need
+            if not elts:
+                del self.by_status[status]
+        full_key = (status,) + key
+        elts = self.by_tag.get(full_key)
+        if elts is not None:
+            elts.pop(i, None)
+            if not elts:
+                del self.by_tag[full_key]
+
+    # Called by the action itself when its status is changing
+    def change_status(self, a, old_status, new_status):
+        i = a.id
+        if old_status == new_status or dict.get(self, i) is not a:
+            return
+        key = self.tag_keys[i]
+        self._unindex(i, old_status, key)
+        self._index(i, a, new_status, key)
+        if new_status == 'scheduled':
+            self._push(i, a)
+
+    # Called by the action itself when its t_to_go is changing. The
+    # old heap entry will be dropped because its time is no more valid
+    def change_t_to_go(self, a):
+        i = a.id
+        if a.status == 'scheduled' and dict.get(self, i) is a:
+            self._push(i, a)
+
+    def _push(self, i, a):
+        # Internal checks (business rules) are managed by the scheduler
+        # itself, never by pollers
+        if getattr(a, 'internal', False):
+            return
+        key = self.tag_keys[i]
+        heap = self.heaps.get(key)
+        if heap is None:
+            heap = self.heaps[key] = []
+        heappush(heap, (a.t_to_go, i))
+        # Too much dead entries? rebuild the heap from the index
+        if len(heap) > 1024 and len(heap) > 4 * len(self.by_tag.get(('scheduled',) + key, ())):
+            self._rebuild_heap(key)
+
+    def _rebuild_heap(self, key):
+        elts = self.by_tag.get(('scheduled',) + key, {})
+        heap = [(a.t_to_go, i) for (i, a) in elts.iteritems()
+                if not getattr(a, 'internal', False)]
+        heapify(heap)
+        if heap:
+            self.heaps[key] = heap
+        else:
+            self.heaps.pop(key, None)
+
+    # Drop all dead entries of the heaps. The heaps are always valid,
+    # but after a big queue cleaning we can give back the memory
+    def clean_heaps(self):
+        for key in self.heaps.keys():
+            self._rebuild_heap(key)
+
+    # Pop and give the scheduled actions of these tags and module_types
+    # that can be launched at now. Only the due ones are looked at.
+    # The caller must change the status of all of them (if it puts one
+    # back to 'scheduled', it will be pushed again in the heap)
+    # If max_count >= 0, we do not give more than max_count actions
+    def pop_launchable(self, tags, module_types, now, max_count=-1):
+        res = []
+        seen = set()
+        module_types = set(module_types)
+        for tag in set(tags):
+            for module_type in module_types:
+                heap = self.heaps.get((tag, module_type))
+                while heap and len(res) != max_count:
+                    t_to_go, i = heap[0]
+                    a = dict.get(self, i)
+                    # Dead entry: deleted, launched or rescheduled action
+                    if a is None or a.status != 'scheduled' or a.t_to_go != t_to_go or i in seen:
+                        heappop(heap)
+                        continue
+                    if not a.is_launchable(now):
+                        break
+                    heappop(heap)
+                    seen.add(i)
+                    res.append(a)
+        return res
+
+    # Estimate the number of actions of these tags and module_types that
+    # are due at now. We only walk the heap branches that are due, so it
+    # costs the number of due entries. Dead entries are counted too, so
+    # it's an upper bound.
+    def count_launchable(self, tags, module_types, now):
+        nb = 0
+        module_types = set(module_types)
+        for tag in set(tags):
+            for module_type in module_types:
+                heap = self.heaps.get((tag, module_type))
+                if not heap:
+                    continue
+                to_look = [0]
+                while to_look:
+                    pos = to_look.pop()
+                    if heap[pos][0] > now:
+                        continue
+                    nb += 1
+                    for child in (2 * pos + 1, 2 * pos + 2):
+                        if child < len(heap):
+                            to_look.append(child)
+        return nb
+
+    # Give a list (so a copy, the caller can change status or delete
+    # elements while looping) of the actions with this status
+    def get_by_status(self, status):
+        return self.by_status.get(status, {}).values()
+
+    # Same but only for actions that got one of the tags and one of
+    # the module_types
+    def get_by_tags(self, status, tags, module_types):
+        res = []
+        module_types = set(module_types)
+        for tag in set(tags):
+            for module_type in module_types:
+                elts = self.by_tag.get((status, tag, module_type))
+                if elts:
+                    res.extend(elts.values())
+        return res
+
+    # Number of actions with this status
+    def len_by_status(self, status):
+        return len(self.by_status.get(status, ()))
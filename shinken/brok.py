@@ -44,13 +44,25 @@ class Brok:
     def __str__(self):
         return str(self.__dict__) + '\n'
 
-    # We unserialize the data, and if some prop were
-    # add after the serialize pass, we integer them in the data
+    # We unserialize the data only when someone really need them: a lot
+    # of broks are given to modules that do not look at all types. Until
+    # then the pickled data are in raw_data. If some prop were add after
+    # the serialize pass, we integer them in the data
     def prepare(self):
         # Maybe the brok is a old daemon one or was already prepared
         # if so, the data is already ok
         if hasattr(self, 'prepared') and not self.prepared:
-            self.data = cPickle.loads(self.data)
-            if hasattr(self, 'instance_id'):
-                self.data['instance_id'] = self.instance_id
+            self.raw_data = self.data
+            del self.data
         self.prepared = True
+
+    # Only called when the attribute is not here, so when the data
+    # were not unserialized for now
+    def __getattr__(self, name):
+        if name != 'data' or 'raw_data' not in self.__dict__:
+            raise AttributeError(name)
+        data = cPickle.loads(self.__dict__.pop('raw_data'))
+        if 'instance_id' in self.__dict__:
+            data['instance_id'] = self.instance_id
+        self.data = data
+        return data
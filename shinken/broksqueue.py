@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+
+
+class BroksQueue(object):
+    """The broks the broker still have to manage.
+
+    Each source (a scheduler, a poller, the arbiters, ourself...) got its
+    own deque, and gives its broks already in order (the schedulers give
+    them with their sequence number). So we never need to sort all the
+    broks: we just pop the sources in turn, and each stream stays in order.
+
+    It can be used like the list it replaces for the retention (extend,
+    iteration and len).
+    """
+
+    def __init__(self):
+        # source -> deque of broks
+        self.queues = {}
+        # sources that still got broks, the first one is the next to pop
+        self.sources = deque()
+        self.nb = 0
+        # broks added since the last get_new() call
+        self.new = []
+
+    def __len__(self):
+        return self.nb
+
+    def __iter__(self):
+        for source in self.sources:
+            for b in self.queues[source]:
+                yield b
+
+    # Add broks (already in order) of a source
+    def extend(self, broks, source=None):
+        if not broks:
+            return
+        q = self.queues.get(source)
+        if q is None:
+            q = self.queues[source] = deque()
+            self.sources.append(source)
+        q.extend(broks)
+        self.new.extend(broks)
+        self.nb += len(broks)
+
+    def append(self, b, source=None):
+        self.extend([b], source)
+
+    # The next brok to manage, from the sources in turn, so a big
+    # source do not delay the others
+    def popleft(self):
+        while self.sources:
+            source = self.sources[0]
+            q = self.queues[source]
+            if q:
+                self.sources.rotate(-1)
+                self.nb -= 1
+                return q.popleft()
+            self.sources.popleft()
+            del self.queues[source]
+        raise IndexError('pop from an empty broks queue')
+
+    # The broks added since the last call, like for the external modules
+    def get_new(self):
+        res = self.new
+        self.new = []
+        return res
+
+    def clear(self):
+        self.queues.clear()
+        self.sources.clear()
+        self.nb = 0
+        self.new = []
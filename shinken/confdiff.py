@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+# When the arbiter reloads its configuration, it does not need to send
+# a whole new configuration to the schedulers if only hosts, services,
+# commands or timeperiods changed: it sends them only the diff of their
+# configuration, and they apply it in place, without a restart.
+#
+# In a diff, the changed objects are given by value, but their links to
+# the others objects of the scheduler are given by reference (type, key),
+# so the scheduler links them to its own objects.
+
+import cPickle
+from cStringIO import StringIO
+
+from shinken.objects.item import Item
+
+# The types a diff can change, in the order they are applied: the hosts
+# need the commands and the timeperiods, and the services need the hosts
+diff_types = (('timeperiod', 'timeperiods'), ('command', 'commands'),
+              ('host', 'hosts'), ('service', 'services'))
+
+# The types of the objects a scheduler configuration has, by the name of
+# their list. They can be given by reference
+ref_types = {'timeperiod': 'timeperiods', 'command': 'commands',
+             'host': 'hosts', 'service': 'services',
+             'contact': 'contacts', 'contactgroup': 'contactgroups',
+             'hostgroup': 'hostgroups', 'servicegroup': 'servicegroups',
+             'notificationway': 'notificationways', 'checkmodulation': 'checkmodulations',
+             'macromodulation': 'macromodulations', 'trigger': 'triggers'}
+
+# These parameters of the main file can change without a whole new
+# configuration: they only say where the objects are defined
+diff_params = ('cfg_file', 'cfg_dir')
+
+
+# The key of an object in its list: the name, or the host name and
+# description for the services
+def get_key(obj):
+    if obj.__class__.my_type == 'service':
+        return (obj.host_name, obj.service_description)
+    return obj.get_name()
+
+
+# Give a comparable value of v, with the objects replaced by their type
+# and key, so we can compare the links of two configurations
+def flatten(v):
+    if isinstance(v, Item):
+        return (v.__class__.my_type, get_key(v))
+    if isinstance(v, (list, tuple)):
+        return tuple([flatten(e) for e in v])
+    if isinstance(v, (set, frozenset)):
+        res = [flatten(e) for e in v]
+        res.sort()
+        return tuple(res)
+    if isinstance(v, dict):
+        res = [(k, flatten(e)) for (k, e) in v.iteritems()]
+        res.sort()
+        return tuple(res)
+    # Like the business rules nodes or the command calls
+    if hasattr(v, '__dict__'):
+        return (v.__class__.__name__, flatten(v.__dict__))
+    return v
+
+
+# What we compare of an object between two configurations. The hash
+# is done before the linking, so for the hosts and services we need
+# their links too. The order of the links lists comes from the ids, that
+# change between the loads, so it is not compared
+def get_signature(obj):
+    linked = getattr(obj.__class__, 'linked_properties', None)
+    if linked is None:
+        return obj.hash
+    res = []
+    for prop in linked:
+        v = getattr(obj, prop, None)
+        if isinstance(v, list):
+            v = set(flatten(v))
+        res.append(flatten(v))
+    return tuple(res)
+
+
+# The state of an object, like pickle takes it
+def get_state(obj):
+    if hasattr(obj, '__getstate__'):
+        return obj.__getstate__()
+    return obj.__dict__
+
+
+# Look if the new configuration can be sent to the schedulers as diffs of
+# the old one. Give the reason why not, or None if it can
+def get_conf_incompatibility(old_conf, new_conf):
+    old_params = dict([(k, v) for (k, v) in old_conf.params.iteritems() if k not in diff_params])
+    new_params = dict([(k, v) for (k, v) in new_conf.params.iteritems() if k not in diff_params])
+    if old_params != new_params:
+        return 'the main configuration parameters changed'
+
+    diff_props = [prop for (t, prop) in diff_types]
+    for (cls, clss, prop) in old_conf.__class__.types_creations.values():
+        if prop in diff_props:
+            continue
+        old_hashes = [o.hash for o in getattr(old_conf, prop)]
+        old_hashes.sort()
+        new_hashes = [o.hash for o in getattr(new_conf, prop)]
+        new_hashes.sort()
+        if old_hashes != new_hashes:
+            return 'the %s changed' % prop
+
+    # The hosts must stay in the same configurations (so the same schedulers)
+    for r in old_conf.realms:
+        new_r = new_conf.realms.find_by_name(r.get_name())
+        if new_r is None or sorted(r.confs.keys()) != sorted(new_r.confs.keys()):
+            return 'the configurations of the realm %s changed' % r.get_name()
+        for (cfg_id, cfg) in r.confs.iteritems():
+            new_hosts = new_r.confs[cfg_id].hosts
+            for h in cfg.hosts:
+                hname = h.get_name()
+                if new_hosts.find_by_name(hname) is None and new_conf.hosts.find_by_name(hname) is not None:
+                    return 'the host %s moved to another configuration' % hname
+    return None
+
+
+# Give the diff of the scheduler configuration old_cfg to new_cfg: the
+# (type, key, object) of the new or changed objects, and the (type, key)
+# of the deleted ones
+def get_conf_diff(old_cfg, new_cfg):
+    changed = []
+    deleted = []
+    for (t, prop) in diff_types:
+        old_objs = {}
+        for o in getattr(old_cfg, prop):
+            old_objs[get_key(o)] = o
+        for o in getattr(new_cfg, prop):
+            k = get_key(o)
+            old = old_objs.pop(k, None)
+            if old is None or get_signature(old) != get_signature(o):
+                changed.append((t, k, o))
+        for k in old_objs:
+            deleted.append((t, k))
+    return (changed, deleted)
+
+
+# Serialize a diff for the scheduler of the configuration cfg. We give
+# the types, keys and classes of the changed objects first, so the
+# scheduler can create the new ones before it loads the links to them
+def dumps_conf_diff(diff, cfg):
+    (changed, deleted) = diff
+
+    def persistent_id(obj):
+        if not isinstance(obj, Item):
+            return None
+        t = obj.__class__.my_type
+        if t not in ref_types:
+            return None
+        # The hosts and services of the others configurations are not
+        # known by the scheduler, they are given by value, like in
+        # the whole configuration
+        if t in ('host', 'service') and getattr(cfg, ref_types[t]).items.get(obj.id) is not obj:
+            return None
+        return (t, get_key(obj))
+
+    header = cPickle.dumps(([(t, k, o.__class__) for (t, k, o) in changed], deleted),
+                           cPickle.HIGHEST_PROTOCOL)
+    f = StringIO()
+    p = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+    p.persistent_id = persistent_id
+    p.dump([get_state(o) for (t, k, o) in changed])
+    return (header, f.getvalue())
+
+
+# Load a diff of dumps_conf_diff on the configuration conf of a scheduler.
+# Give the [type, key, object, state, is_new] of the changed objects (the new
+# ones are created but empty) and the (type, key, object) of the deleted ones.
+# Nothing is changed in conf, so if it fails (like a link to an object we do
+# not have), conf is still good
+def loads_conf_diff(raw, conf):
+    (raw_header, raw_states) = raw
+    (header, deleted) = cPickle.loads(raw_header)
+
+    index = {}
+
+    def get_index(t):
+        if t not in index:
+            d = index[t] = {}
+            for o in getattr(conf, ref_types[t]):
+                d[get_key(o)] = o
+        return index[t]
+
+    entries = []
+    for (t, k, cls) in header:
+        obj = get_index(t).get(k)
+        is_new = obj is None
+        if is_new:
+            obj = cls.__new__(cls)
+            get_index(t)[k] = obj
+        entries.append([t, k, obj, None, is_new])
+
+    def persistent_load(pid):
+        (t, k) = pid
+        return get_index(t)[k]
+
+    u = cPickle.Unpickler(StringIO(raw_states))
+    u.persistent_load = persistent_load
+    states = u.load()
+    for (entry, state) in zip(entries, states):
+        entry[3] = state
+
+    deleted = [(t, k, get_index(t)[k]) for (t, k) in deleted if k in get_index(t)]
+    return (entries, deleted)
+
+
+# Set the state of a diff in an object. The objects already running keep
+# their running properties, but the ones that are links of the configuration
+def set_diff_state(obj, state, is_new):
+    if is_new:
+        if hasattr(obj, '__setstate__'):
+            obj.__setstate__(state)
+        else:
+            obj.__dict__.update(state)
+        return
+
+    cls = obj.__class__
+    linked = getattr(cls, 'linked_properties', None)
+    if linked is None:
+        props = [prop for prop in state if prop != 'id']
+    else:
+        props = [prop for prop in cls.properties if prop in state and prop != 'id']
+        props.extend([prop for prop in linked if prop in state])
+    for prop in props:
+        setattr(obj, prop, state[prop])
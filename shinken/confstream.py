@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+""" The serialization of the configurations the arbiter sends to the
+schedulers.
+
+A whole cPickle string of a configuration is big, and must be done (and
+kept by the arbiter) in one piece. Here the configuration is cut in chunks,
+each one is a zlib compressed cPickle, and they can be done and loaded one
+after the other:
+ * the first one gives the classes of all the objects of the configuration
+   lists (hosts, services, commands...), so they can be created empty;
+ * then the states of these objects, by tables of the same class: an object
+   is only the list of its values, the names of the values (the schema)
+   are given once by class. In a chunk, the equal strings are pickled once;
+ * then the configuration itself, with its lists.
+
+The links between the objects are given by their number in the stream. The
+others objects (like the escalations) are given by value in the chunk that
+first links them, and then by their number too.
+"""
+
+import time
+import zlib
+import cPickle
+from itertools import izip
+from cStringIO import StringIO
+
+from shinken.objects.item import Item
+from shinken.log import logger
+
+# Number of objects in a chunk
+CHUNK_OBJECTS = 500
+COMPRESS_LEVEL = 2
+
+
+# The value of a property an object of a table does not have
+class Missing(object):
+    pass
+
+_missing = Missing()
+MISSING_REF = -1
+
+
+# The state of an object, like pickle takes it
+def get_state(obj):
+    if hasattr(obj, '__getstate__'):
+        return obj.__getstate__()
+    return obj.__dict__
+
+
+def set_state(obj, state):
+    if hasattr(obj, '__setstate__'):
+        obj.__setstate__(state)
+    else:
+        obj.__dict__.update(state)
+
+
+class ConfStreamWriter(object):
+    """Give the chunks of a configuration with chunks(). The stats of the
+    serialization are in the attributes after it.
+
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        # All the objects of the stream, and their number by id()
+        self.objs = []
+        self.refs = {id(_missing): MISSING_REF}
+        # Objects we linked but we did not give the state
+        self.to_send = []
+        self.schemas = {}
+        self.strings = {}
+        self.nb_objects = 0
+        self.size = 0
+        self.raw_size = 0
+        self.nb_chunks = 0
+        self.encode_time = 0.0
+
+    # Called by the pickler for the objects and the sets
+    def get_ref(self, obj):
+        ref = self.refs.get(id(obj))
+        if ref is not None or not isinstance(obj, Item):
+            return ref
+        # Not one of the tables objects, it's sent by value after, but
+        # the loader must create it now
+        ref = len(self.objs)
+        self.objs.append(obj)
+        self.refs[id(obj)] = ref
+        self.to_send.append(ref)
+        return (ref, obj.__class__)
+
+    def add(self, obj):
+        if id(obj) in self.refs:
+            return
+        self.refs[id(obj)] = len(self.objs)
+        self.objs.append(obj)
+
+    def dumps(self, value):
+        f = StringIO()
+        p = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+        p.inst_persistent_id = self.get_ref
+        p.dump(value)
+        raw = f.getvalue()
+        data = zlib.compress(raw, COMPRESS_LEVEL)
+        self.raw_size += len(raw)
+        self.size += len(data)
+        self.nb_chunks += 1
+        return data
+
+    # The rows of the objects refs, by groups of the same class
+    def get_rows(self, refs):
+        groups = []
+        strings = self.strings
+        for ref in refs:
+            obj = self.objs[ref]
+            cls = obj.__class__
+            if not groups or groups[-1][0] is not cls or groups[-1][1] + len(groups[-1][3]) != ref:
+                groups.append((cls, ref, [], []))
+            new_keys = groups[-1][2]
+            schema = self.schemas.setdefault(cls, [])
+            state = get_state(obj)
+            row = [state.get(k, _missing) for k in schema]
+            # Maybe we have values the others did not have
+            if len(state) != len(row) - row.count(_missing):
+                known = set(schema)
+                for k in state:
+                    if k not in known:
+                        schema.append(k)
+                        new_keys.append(k)
+                        row.append(state[k])
+            # So the equal strings are pickled once
+            for (i, v) in enumerate(row):
+                if type(v) is str or type(v) is unicode:
+                    row[i] = strings.setdefault(v, v)
+            groups[-1][3].append(row)
+        self.nb_objects += len(refs)
+        return groups
+
+    def chunks(self):
+        t0 = time.time()
+        conf = self.conf
+        props = [k for (k, v) in conf.__dict__.iteritems() if hasattr(v, 'items') and hasattr(v, 'inner_class')]
+        props.sort()
+        for prop in props:
+            for obj in getattr(conf, prop):
+                self.add(obj)
+
+        # The classes of the tables objects, in runs
+        header = []
+        for obj in self.objs:
+            if header and header[-1][0] is obj.__class__:
+                header[-1][1] += 1
+            else:
+                header.append([obj.__class__, 1])
+        nb_tables_objs = len(self.objs)
+        self.encode_time += time.time() - t0
+        yield self.dumps(('header', header))
+
+        for i in xrange(0, nb_tables_objs, CHUNK_OBJECTS):
+            t0 = time.time()
+            data = self.dumps(('rows', self.get_rows(range(i, min(i + CHUNK_OBJECTS, nb_tables_objs)))))
+            self.encode_time += time.time() - t0
+            yield data
+
+        t0 = time.time()
+        data = self.dumps(('conf', conf.__class__, conf.__dict__))
+        self.encode_time += time.time() - t0
+        yield data
+
+        # And the others objects we found
+        while self.to_send:
+            t0 = time.time()
+            refs = self.to_send[:CHUNK_OBJECTS]
+            del self.to_send[:CHUNK_OBJECTS]
+            data = self.dumps(('rows', self.get_rows(refs)))
+            self.encode_time += time.time() - t0
+            yield data
+
+
+class ConfStreamLoader(object):
+    """Load the chunks of a ConfStreamWriter, one after the other, with
+    feed(). The configuration is given by get_conf() after the last one.
+
+    """
+
+    def __init__(self):
+        self.objs = []
+        self.schemas = {}
+        self.conf = None
+        self.size = 0
+        self.nb_chunks = 0
+        self.decode_time = 0.0
+
+    def get_obj(self, ref):
+        if ref == MISSING_REF:
+            return _missing
+        if isinstance(ref, tuple):
+            (ref, cls) = ref
+            if ref != len(self.objs):
+                raise ValueError('Bad configuration stream, object %d is not the next one' % ref)
+            self.objs.append(cls.__new__(cls))
+        return self.objs[ref]
+
+    def feed(self, data):
+        t0 = time.time()
+        self.size += len(data)
+        self.nb_chunks += 1
+        u = cPickle.Unpickler(StringIO(zlib.decompress(data)))
+        u.persistent_load = self.get_obj
+        value = u.load()
+        kind = value[0]
+        if kind == 'header':
+            for (cls, nb) in value[1]:
+                new = cls.__new__
+                self.objs.extend([new(cls) for i in xrange(nb)])
+        elif kind == 'rows':
+            for (cls, start, new_keys, rows) in value[1]:
+                schema = self.schemas.setdefault(cls, [])
+                schema.extend(new_keys)
+                objs = self.objs
+                for (i, row) in enumerate(rows):
+                    state = dict([(k, v) for (k, v) in izip(schema, row) if v is not _missing])
+                    set_state(objs[start + i], state)
+        elif kind == 'conf':
+            (cls, state) = value[1:]
+            self.conf = cls.__new__(cls)
+            self.conf.__dict__.update(state)
+        self.decode_time += time.time() - t0
+
+    def get_conf(self):
+        if self.conf is None:
+            raise ValueError('Truncated configuration stream')
+        return self.conf
+
+
+# The chunks of the configuration, with the stats of the writer
+def dumps_conf(conf):
+    w = ConfStreamWriter(conf)
+    return (list(w.chunks()), w)
+
+
+# Load a configuration from its chunks. They are removed from the list
+# while they are loaded, so the memory is given back. It can be the
+# cPickle string of the old arbiters too
+def loads_conf(chunks):
+    if isinstance(chunks, str):
+        return cPickle.loads(chunks)
+    l = ConfStreamLoader()
+    chunks.reverse()
+    while chunks:
+        l.feed(chunks.pop())
+    conf = l.get_conf()
+    logger.info("Configuration loaded from %d chunks (%d bytes) in %.2fs" % (l.nb_chunks, l.size, l.decode_time))
+    return conf
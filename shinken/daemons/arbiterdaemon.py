@@ -26,6 +26,7 @@
 import sys
 import os
 import time
+import signal
 import traceback
 from Queue import Empty
 import socket
@@ -173,6 +174,9 @@ class Arbiter(Daemon):
         self.interface = IForArbiter(self)
         self.conf = Config()
 
+        # Set by SIGHUP, we reload our configuration in the main loop
+        self.need_config_reload = False
+
 
     # Use for adding things like broks
     def add(self, b):
@@ -244,13 +248,13 @@ class Arbiter(Daemon):
         return daemon_type + 's'
 
 
-    def load_config_file(self):
-        logger.info("Loading configuration")
+    # Read the configuration files, and create the arbiters and the modules
+    # objects, because we need them to know who we are and to ask the
+    # modules for objects. Give the raw objects
+    def read_config_objects(self):
         # REF: doc/shinken-conf-dispatching.png (1)
-        buf = self.conf.read_config(self.config_files)
-        raw_objects = self.conf.read_config_buf(buf)
-
-        logger.debug("Opening local log file")
+        buf = self.conf.run_phase('read_config', self.config_files)
+        raw_objects = self.conf.run_phase('read_config_buf', buf)
 
         # First we need to get arbiters and modules
         # so we can ask them for objects
@@ -258,47 +262,36 @@ class Arbiter(Daemon):
         self.conf.create_objects_for_type(raw_objects, 'module')
 
         self.conf.early_arbiter_linking()
+        return raw_objects
+
 
-        # Search which Arbiterlink I am
+    # Search which Arbiterlink I am in the configuration. Say False
+    # if I am not in it
+    def find_me(self):
+        me = None
         for arb in self.conf.arbiters:
             if arb.is_me(self.arb_name):
                 arb.need_conf = False
-                self.me = arb
-                self.is_master = not self.me.spare
-                if self.is_master:
-                    logger.info("I am the master Arbiter: %s" % arb.get_name())
-                else:
-                    logger.info("I am a spare Arbiter: %s" % arb.get_name())
-
-                # Set myself as alive ;)
-                self.me.alive = True
+                me = arb
             else:  # not me
                 arb.need_conf = True
+        if me is None:
+            return False
 
-        if not self.me:
-            sys.exit("Error: I cannot find my own Arbiter object, I bail out. \
-                     To solve it, please change the host_name parameter in \
-                     the object Arbiter in the file shinken-specific.cfg. \
-                     With the value %s \
-                     Thanks." % socket.gethostname())
-
-        logger.info("My own modules: " + ','.join([m.get_name() for m in self.me.modules]))
-
-        self.modulesdir = getattr(self.conf, 'modulesdir', '')
+        self.me = me
+        self.is_master = not self.me.spare
+        if self.is_master:
+            logger.info("I am the master Arbiter: %s" % me.get_name())
+        else:
+            logger.info("I am a spare Arbiter: %s" % me.get_name())
+        # Set myself as alive ;)
+        self.me.alive = True
+        return True
 
-        # Ok it's time to load the module manager now!
-        self.load_modules_manager()
-        # we request the instances without them being *started*
-        # (for those that are concerned ("external" modules):
-        # we will *start* these instances after we have been daemonized (if requested)
-        self.modules_manager.set_modules(self.me.modules)
-        self.do_load_modules()
 
-        # Call modules that manage this read configuration pass
-        self.hook_point('read_configuration')
-
-        # Now we ask for configuration modules if they
-        # got items for us
+    # Now we ask for configuration modules if they
+    # got items for us
+    def get_objects_from_modules(self, raw_objects):
         for inst in self.modules_manager.instances:
             if 'configuration' in inst.phases:
                 try:
@@ -323,66 +316,52 @@ class Arbiter(Daemon):
                             raw_objects[k].append(x)
                         logger.debug("Added %i objects to %s from module %s" % (len(r[prop]), k, inst.get_name()))
 
-        ### Resume standard operations ###
-        self.conf.create_objects(raw_objects)
-
-        # Maybe conf is already invalid
-        if not self.conf.conf_is_correct:
-            sys.exit("***> One or more problems was encountered while processing the config files...")
-
-        # Change Nagios2 names to Nagios3 ones
-        self.conf.old_properties_names_to_new()
-
-        # Manage all post-conf modules
-        self.hook_point('early_configuration')
-
-        # Ok here maybe we should stop because we are in a pure migration run
-        if self.migrate:
-            print "Migration MODE. Early exiting from configuration relinking phase"
-            return
 
+    # All the phases from the created objects to the configurations
+    # for the schedulers
+    def link_config(self):
         # Load all file triggers
-        self.conf.load_triggers()
+        self.conf.run_phase('load_triggers')
 
         # Create Template links
-        self.conf.linkify_templates()
+        self.conf.run_phase('linkify_templates')
 
         # All inheritances
-        self.conf.apply_inheritance()
+        self.conf.run_phase('apply_inheritance')
 
         # Explode between types
-        self.conf.explode()
+        self.conf.run_phase('explode')
 
         # Create Name reversed list for searching list
-        self.conf.create_reversed_list()
+        self.conf.run_phase('create_reversed_list')
 
         # Cleaning Twins objects
-        self.conf.remove_twins()
+        self.conf.run_phase('remove_twins')
 
         # Implicit inheritance for services
-        self.conf.apply_implicit_inheritance()
+        self.conf.run_phase('apply_implicit_inheritance')
 
         # Fill default values
-        self.conf.fill_default()
+        self.conf.run_phase('fill_default')
 
         # Remove templates from config
-        self.conf.remove_templates()
+        self.conf.run_phase('remove_templates')
 
         # We compute simple item hash
-        self.conf.compute_hash()
+        self.conf.run_phase('compute_hash')
 
         # We removed templates, and so we must recompute the
         # search lists
-        self.conf.create_reversed_list()
+        self.conf.run_phase('create_reversed_list')
 
         # Pythonize values
-        self.conf.pythonize()
+        self.conf.run_phase('pythonize')
 
         # Linkify objects to each other
-        self.conf.linkify()
+        self.conf.run_phase('linkify')
 
         # applying dependencies
-        self.conf.apply_dependencies()
+        self.conf.run_phase('apply_dependencies')
 
         # Hacking some global parameters inherited from Nagios to create
         # on the fly some Broker modules like for status.dat parameters
@@ -400,9 +379,9 @@ class Arbiter(Daemon):
         self.conf.propagate_timezone_option()
 
         # Look for business rules, and create the dep tree
-        self.conf.create_business_rules()
+        self.conf.run_phase('create_business_rules')
         # And link them
-        self.conf.create_business_rules_dependencies()
+        self.conf.run_phase('create_business_rules_dependencies')
 
 
         # Warn about useless parameters in Shinken
@@ -413,7 +392,7 @@ class Arbiter(Daemon):
         self.hook_point('late_configuration')
 
         # Correct conf?
-        self.conf.is_correct()
+        self.conf.run_phase('is_correct')
 
         # If the conf is not correct, we must get out now
         # if not self.conf.conf_is_correct:
@@ -421,7 +400,58 @@ class Arbiter(Daemon):
 
         # REF: doc/shinken-conf-dispatching.png (2)
         logger.info("Cutting the hosts and services into parts")
-        self.confs = self.conf.cut_into_parts()
+        self.conf.run_phase('cut_into_parts')
+
+
+    def load_config_file(self):
+        logger.info("Loading configuration")
+        raw_objects = self.read_config_objects()
+
+        logger.debug("Opening local log file")
+
+        if not self.find_me():
+            sys.exit("Error: I cannot find my own Arbiter object, I bail out. \
+                     To solve it, please change the host_name parameter in \
+                     the object Arbiter in the file shinken-specific.cfg. \
+                     With the value %s \
+                     Thanks." % socket.gethostname())
+
+        logger.info("My own modules: " + ','.join([m.get_name() for m in self.me.modules]))
+
+        self.modulesdir = getattr(self.conf, 'modulesdir', '')
+
+        # Ok it's time to load the module manager now!
+        self.load_modules_manager()
+        # we request the instances without them being *started*
+        # (for those that are concerned ("external" modules):
+        # we will *start* these instances after we have been daemonized (if requested)
+        self.modules_manager.set_modules(self.me.modules)
+        self.do_load_modules()
+
+        # Call modules that manage this read configuration pass
+        self.hook_point('read_configuration')
+
+        self.get_objects_from_modules(raw_objects)
+
+        ### Resume standard operations ###
+        self.conf.run_phase('create_objects', raw_objects)
+
+        # Maybe conf is already invalid
+        if not self.conf.conf_is_correct:
+            sys.exit("***> One or more problems was encountered while processing the config files...")
+
+        # Change Nagios2 names to Nagios3 ones
+        self.conf.old_properties_names_to_new()
+
+        # Manage all post-conf modules
+        self.hook_point('early_configuration')
+
+        # Ok here maybe we should stop because we are in a pure migration run
+        if self.migrate:
+            print "Migration MODE. Early exiting from configuration relinking phase"
+            return
+
+        self.link_config()
 
         # The conf can be incorrect here if the cut into parts see errors like
         # a realm with hosts and not schedulers for it
@@ -436,6 +466,9 @@ class Arbiter(Daemon):
         # Clean objects of temporary/unnecessary attributes for live work:
         self.conf.clean()
 
+        # Say where the loading time goes
+        self.conf.log_phases_times()
+
         # Exit if we are just here for config checking
         if self.verify_only:
             sys.exit(0)
@@ -479,6 +512,80 @@ class Arbiter(Daemon):
         logger.info("Configuration Loaded")
 
 
+    # Load the configuration files again, and send to the schedulers only
+    # the diffs of their configurations if we can. If the new configuration
+    # is not correct, we keep the old one
+    def reload_config(self):
+        logger.info("Reloading the configuration")
+        t0 = time.time()
+        old_conf = self.conf
+        old_me = self.me
+        # The modules hooks work on our conf
+        self.conf = Config()
+        try:
+            raw_objects = self.read_config_objects()
+            if not self.find_me():
+                raise Exception("I cannot find my own Arbiter object in the new configuration")
+            self.hook_point('read_configuration')
+            self.get_objects_from_modules(raw_objects)
+            self.conf.run_phase('create_objects', raw_objects)
+            if self.conf.conf_is_correct:
+                self.conf.old_properties_names_to_new()
+                self.hook_point('early_configuration')
+                self.link_config()
+        except Exception, exp:
+            logger.error("The new configuration raised an exception %s, I keep the old one" % exp)
+            logger.error("Back trace of this error: %s" % traceback.format_exc())
+            self.conf = old_conf
+            self.me = old_me
+            return
+        new_conf = self.conf
+        self.conf = old_conf
+
+        if not new_conf.conf_is_correct:
+            new_conf.show_errors()
+            logger.error("The new configuration is incorrect, I keep the old one")
+            self.me = old_me
+            return
+
+        new_conf.clean()
+        new_conf.log_phases_times()
+        new_conf.prepare_for_sending()
+
+        if self.dispatcher.push_conf_diffs(new_conf):
+            # Our links did not change
+            self.me = old_me
+            self.conf = self.dispatcher.conf
+        else:
+            self.conf = new_conf
+            self.dispatcher = Dispatcher(self.conf, self.me)
+
+        # The external commands are for the new objects
+        e = ExternalCommandManager(self.conf, 'dispatcher')
+        e.load_arbiter(self)
+        e.load_dispatcher(self.dispatcher)
+        e.fifo = self.external_command.fifo
+        e.cmd_fragments = self.external_command.cmd_fragments
+        e.pipe_path = self.external_command.pipe_path
+        self.external_command = e
+        logger.info("Configuration reloaded in %.2fs" % (time.time() - t0))
+
+
+    # SIGHUP asks us to reload our configuration
+    def manage_signal(self, sig, frame):
+        if sig == signal.SIGHUP:
+            logger.info("I received a SIGHUP, I will reload my configuration")
+            self.need_config_reload = True
+        else:
+            super(Arbiter, self).manage_signal(sig, frame)
+
+
+    def set_exit_handler(self):
+        super(Arbiter, self).set_exit_handler()
+        if os.name != "nt":
+            signal.signal(signal.SIGHUP, self.manage_signal)
+
+
     def launch_analyse(self):
         try:
             import json
@@ -676,8 +783,7 @@ class Arbiter(Daemon):
     def push_external_commands_to_schedulers(self):
         # Now get all external commands and put them into the
         # good schedulers
-        for ext_cmd in self.external_commands:
-            self.external_command.resolve_command(ext_cmd)
+        self.external_command.resolve_commands(self.external_commands)
 
         # Now for all alive schedulers, send the commands
         for sched in self.conf.schedulers:
@@ -722,6 +828,7 @@ class Arbiter(Daemon):
         # the commands to schedulers
         e = ExternalCommandManager(self.conf, 'dispatcher')
         e.load_arbiter(self)
+        e.load_dispatcher(self.dispatcher)
         self.external_command = e
 
         logger.debug("Run baby, run...")
@@ -799,6 +906,11 @@ class Arbiter(Daemon):
                 self.dump_memory()
                 self.need_dump_memory = False
 
+            # If asked to reload the configuration, go
+            if self.need_config_reload:
+                self.need_config_reload = False
+                self.reload_config()
+
 
     def get_daemons(self, daemon_type):
         """ Returns the daemons list defined in our conf for the given type """
@@ -24,24 +24,30 @@
 # along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import sys
 import time
 import traceback
-import cPickle
-import base64
-import zlib
 import threading
 from multiprocessing import active_children
 from Queue import Empty
 
-from shinken.satellite import BaseSatellite
+import pycurl
+
+from shinken.satellite import BaseSatellite, IForArbiter as IArb
 from shinken.property import PathProp, IntegerProp
-from shinken.util import sort_by_ids
+from shinken.broksqueue import BroksQueue
 from shinken.log import logger
 from shinken.external_command import ExternalCommand
 from shinken.http_client import HTTPClient, HTTPExceptions
 
 
+class IForArbiter(IArb):
+    """ Interface for Arbiter, with also our stats: how long and how big
+    were the last broks fetches from each scheduler, poller and reactionner """
+
+    def get_broks_fetch_stats(self):
+        return self.app.get_broks_fetch_stats()
+
+
 # Our main APP class
 class Broker(BaseSatellite):
 
@@ -55,6 +61,7 @@ class Broker(BaseSatellite):
     def __init__(self, config_file, is_daemon, do_replace, debug, debug_file, profile=''):
 
         super(Broker, self).__init__('broker', config_file, is_daemon, do_replace, debug, debug_file)
+        self.interface = IForArbiter(self)
 
         # Our arbiters
         self.arbiters = {}
@@ -71,7 +78,7 @@ class Broker(BaseSatellite):
         self.external_commands = []
 
         # All broks to manage
-        self.broks = []  # broks to manage
+        self.broks = BroksQueue()  # broks to manage, by source
         # broks raised this turn and that needs to be put in self.broks
         self.broks_internal_raised = []
         # broks raised by the arbiters, we need a lock so the push can be in parallel
@@ -79,7 +86,24 @@ class Broker(BaseSatellite):
         self.arbiter_broks = []
         self.arbiter_broks_lock = threading.RLock()
 
+        # We get the broks of the schedulers by pages, and we stop asking
+        # new pages when we already have enough broks to manage
+        self.broks_page_size = 10000
+        self.max_broks_pages = 5
+        # When we have nothing to do, schedulers can keep our get_broks
+        # call up to this time while they got no new broks
+        self.broks_wait_time = 1.0
+        # The running get_broks calls, by curl handle. They are all
+        # done in parallel, and we do not wait more than broks_fetch_timeout
+        # for them in a turn
+        self.broks_fetch_timeout = 5.0
+        self.broks_multi = pycurl.CurlMulti()
+        self.broks_fetches = {}
+
         self.timeout = 1.0
+        # While managing broks, we look if the arbiter speak to us
+        # every this time
+        self.arbiter_poll_interval = 0.1
 
 
     # Schedulers have some queues. We can simplify the call by adding
@@ -194,6 +218,7 @@ class Broker(BaseSatellite):
             if new_run_id != running_id:
                 logger.debug("[%s] New running id for the %s %s: %s (was %s)" % (self.name, type, links[id]['name'], new_run_id, running_id))
                 links[id]['broks'].clear()
+                links[id]['broks_cursor'] = 0
                 # we must ask for a new full broks if
                 # it's a scheduler
                 if type == 'scheduler':
@@ -229,19 +254,19 @@ class Broker(BaseSatellite):
                 self.modules_manager.set_to_restart(mod)
 
 
-    # Add broks (a tab) to different queues for
+    # Add broks (a tab, in order) of a source to different queues for
     # internal and external modules
-    def add_broks_to_queue(self, broks):
+    def add_broks_to_queue(self, broks, source=None):
         # Ok now put in queue broks to be managed by
         # internal modules
-        self.broks.extend(broks)
+        self.broks.extend(broks, source)
 
 
     # Each turn we get all broks from
     # self.broks_internal_raised and we put them in
     # self.broks
     def interger_internal_broks(self):
-        self.add_broks_to_queue(self.broks_internal_raised)
+        self.add_broks_to_queue(self.broks_internal_raised, 'internal')
         self.broks_internal_raised = []
 
 
@@ -250,7 +275,7 @@ class Broker(BaseSatellite):
     # we must protect this with he list lock
     def interger_arbiter_broks(self):
         with self.arbiter_broks_lock:
-            self.add_broks_to_queue(self.arbiter_broks)
+            self.add_broks_to_queue(self.arbiter_broks, 'arbiter')
             self.arbiter_broks = []
 
 
@@ -269,64 +294,169 @@ class Broker(BaseSatellite):
                     full_queue = False
 
 
-    # We get new broks from schedulers
+    # We get new broks from schedulers, pollers and reactionners. All of
+    # them are asked in parallel, with a CurlMulti, so a slow one do not stall
+    # the others. If we got nothing to do, schedulers can keep our call up to
+    # wait_time until they got new broks, so we got them as soon as possible
+    # without polling. We return as soon as one of them give us broks, the
+    # other calls are still running, and we will look at them at the next turn.
+    # There is no more ping before: the call itself tell us if they are alive
     # REF: doc/broker-modules.png (2)
-    def get_new_broks(self, type='scheduler'):
-        # Get the good links tab for looping..
-        links = self.get_links_from_type(type)
-        if links is None:
-            logger.debug('Type unknown for connection! %s' % type)
-            return
+    def get_new_broks(self, types=('scheduler', 'poller', 'reactionner'), wait_time=0):
+        for type in types:
+            # Get the good links tab for looping..
+            links = self.get_links_from_type(type)
+            if links is None:
+                logger.debug('Type unknown for connection! %s' % type)
+                continue
+            for (id, link) in links.items():
+                con = link.get('con', None)
+                if con is None:  # None = not initialized
+                    self.pynag_con_init(id, type=type)
+                    continue
+                # Still waiting for the previous call
+                if con.con in self.broks_fetches:
+                    continue
+                self.start_broks_fetch(type, link, wait_time)
+
+        # Our HTTP lock is released meanwhile, so the arbiter can still talk to us
+        if self.http_daemon:
+            self.http_daemon.lock.release()
+        try:
+            self.run_broks_fetches(wait_time)
+        finally:
+            if self.http_daemon:
+                self.http_daemon.lock.acquire()
+
+
+    # Ask the broks of a link. The schedulers give us them page by page: we
+    # give it the sequence of the last brok we got, so it can forget all of them
+    def start_broks_fetch(self, type, link, wait_time=0):
+        con = link['con']
+        args = {'bname': self.name}
+        if type == 'scheduler':
+            args['since_id'] = link['broks_cursor']
+            args['max_count'] = self.broks_page_size
+            if wait_time > 0:
+                args['wait_time'] = wait_time
+        else:
+            wait_time = 0
+        decoder = con.prepare_get_objects('get_broks', args, wait='long')
+        self.broks_fetches[con.con] = {'type': type, 'link': link, 'con': con, 'decoder': decoder,
+                                       'wait': wait_time > 0, 't0': time.time()}
+        self.broks_multi.add_handle(con.con)
+
+
+    # Run the fetches until all the ones that do not wait are done (or
+    # broks_fetch_timeout). The waiting ones are given at most wait_time,
+    # or until one of them got broks
+    def run_broks_fetches(self, wait_time):
+        begin = time.time()
+        end = begin + wait_time
+        while self.broks_fetches:
+            while True:
+                ret, _ = self.broks_multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            got_broks = False
+            # Waiting calls of a previous turn that got nothing
+            to_restart = []
+            while True:
+                nb_queued, ok_list, err_list = self.broks_multi.info_read()
+                for c in ok_list:
+                    f = self.broks_fetches[c]
+                    if self.end_broks_fetch(c):
+                        got_broks = True
+                    elif f['wait'] and f['t0'] < begin and f['link'].get('con', None) is f['con']:
+                        to_restart.append(f)
+                for (c, errno, errstr) in err_list:
+                    self.end_broks_fetch(c, errstr)
+                if nb_queued == 0:
+                    break
+            # They can wait for this turn too
+            remaining = end - time.time()
+            if remaining > 0 and not got_broks:
+                for f in to_restart:
+                    self.start_broks_fetch(f['type'], f['link'], remaining)
+
+            # Calls that do not wait should be quick, we wait for them, but
+            # not more than broks_fetch_timeout: they will continue at the
+            # next turn (the link data timeout is still here for the dead ones)
+            now = time.time()
+            if [f for f in self.broks_fetches.values() if not f['wait']] and now < begin + self.broks_fetch_timeout:
+                timeout = begin + self.broks_fetch_timeout - now
+            else:
+                timeout = end - now
+                if got_broks or timeout <= 0:
+                    return
+            if self.broks_fetches:
+                self.broks_multi.select(min(timeout, 1.0))
+
+
+    # A fetch is done. We give its broks to our queues, and if it's a full
+    # page of a scheduler, we ask the next one (if we are not already with
+    # too much broks to manage). Return True if we got broks
+    def end_broks_fetch(self, c, errstr=None):
+        f = self.broks_fetches.pop(c)
+        self.broks_multi.remove_handle(c)
+        type = f['type']
+        link = f['link']
+        con = f['con']
+        # The link was reset meanwhile, we do not want it anymore
+        if link.get('con', None) is not con:
+            return False
+        try:
+            tmp_broks = con.get_objects_result(f['decoder'], errstr)
+        except HTTPExceptions, exp:
+            logger.warning("Connection problem to the %s %s: %s" % (type, link['name'], str(exp)))
+            link['con'] = None
+            return False
+
+        # Stats of the link, so we can see which one is slow
+        link['fetch_time'] = time.time() - f['t0']
+        link['fetch_size'] = c.getinfo(pycurl.SIZE_DOWNLOAD)
+        link['fetch_nb_broks'] = len(tmp_broks)
+        logger.debug("%s Broks get in %s from the %s %s" % (len(tmp_broks), link['fetch_time'], type, link['name']))
+        if not tmp_broks:
+            return False
+        # They are given with their sequence (or id), so we keep them in order
+        broks = [tmp_broks[i] for i in sorted(tmp_broks)]
+        for b in broks:
+            b.instance_id = link['instance_id']
+        # Ok, we can add theses broks to our queues
+        self.add_broks_to_queue(broks, (type, link['name']))
+
+        if type == 'scheduler':
+            # we will acknowledge them with our next call
+            link['broks_cursor'] = max(tmp_broks)
+            max_broks = self.broks_page_size * self.max_broks_pages
+            if len(tmp_broks) == self.broks_page_size and len(self.broks) < max_broks:
+                self.start_broks_fetch(type, link)
+        return True
+
+
+    # Forget the running fetches, like when the links change
+    def cancel_broks_fetches(self):
+        for c in self.broks_fetches:
+            self.broks_multi.remove_handle(c)
+        self.broks_fetches.clear()
 
-        # We check for new check in each schedulers and put
-        # the result in new_checks
-        for sched_id in links:
-            try:
-                con = links[sched_id]['con']
-                if con is not None:  # None = not initialized
-                    t0 = time.time()
-                    # Before ask a call that can be long, do a simple ping to be sure it is alive
-                    con.get('ping')
-                    tmp_broks = con.get('get_broks', {'bname':self.name}, wait='long')
-                    try:
-                        _t = base64.b64decode(tmp_broks)
-                        _t = zlib.decompress(_t)
-                        tmp_broks = cPickle.loads(_t)
-                    except (TypeError, zlib.error, cPickle.PickleError), exp:
-                        logger.error('Cannot load broks data from %s : %s' % (links[sched_id]['name'], exp))
-                        links[sched_id]['con'] = None
-                        continue
-                    logger.debug("%s Broks get in %s" % (len(tmp_broks), time.time() - t0))
-                    for b in tmp_broks.values():
-                        b.instance_id = links[sched_id]['instance_id']
-
-                    # Ok, we can add theses broks to our queues
-                    self.add_broks_to_queue(tmp_broks.values())
-
-                else:  # no con? make the connection
-                    self.pynag_con_init(sched_id, type=type)
-            # Ok, con is not known, so we create it
-            except KeyError, exp:
-                logger.debug("Key error for get_broks : %s" % str(exp))
-                self.pynag_con_init(sched_id, type=type)
-            except HTTPExceptions, exp:
-                logger.warning("Connection problem to the %s %s: %s" % (type, links[sched_id]['name'], str(exp)))
-                links[sched_id]['con'] = None
-            # scheduler must not #be initialized
-            except AttributeError, exp:
-                logger.warning("The %s %s should not be initialized: %s" % (type, links[sched_id]['name'], str(exp)))
-            # scheduler must not have checks
-            #  What the F**k? We do not know what happened,
-            # so.. bye bye :)
-            except Exception, x:
-                logger.error(str(x))
-                logger.error(traceback.format_exc())
-                sys.exit(1)
+
+    # Duration, size and number of broks of the last fetch of each link
+    def get_broks_fetch_stats(self):
+        res = {}
+        for type in ('scheduler', 'poller', 'reactionner'):
+            for link in self.get_links_from_type(type).values():
+                if 'fetch_time' in link:
+                    res.setdefault(type, {})[link['name']] = {'time': link['fetch_time'],
+                                                              'size': link['fetch_size'],
+                                                              'nb_broks': link['fetch_nb_broks']}
+        return res
 
 
     # Helper function for module, will give our broks
     def get_retention_data(self):
-        return self.broks
+        return list(self.broks)
 
 
     # Get back our broks from a retention module
@@ -346,6 +476,8 @@ class Broker(BaseSatellite):
         conf = self.new_conf
         self.new_conf = None
         self.cur_conf = conf
+        # The links will change, the running calls are useless
+        self.cancel_broks_fetches()
         # Got our name from the globals
         g_conf = conf['global']
         if 'broker_name' in g_conf:
@@ -376,9 +508,11 @@ class Broker(BaseSatellite):
             if already_got:
                 broks = self.schedulers[sched_id]['broks']
                 running_id = self.schedulers[sched_id]['running_id']
+                broks_cursor = self.schedulers[sched_id]['broks_cursor']
             else:
                 broks = {}
                 running_id = 0
+                broks_cursor = 0
             s = conf['schedulers'][sched_id]
             self.schedulers[sched_id] = s
 
@@ -392,6 +526,7 @@ class Broker(BaseSatellite):
             self.schedulers[sched_id]['broks'] = broks
             self.schedulers[sched_id]['instance_id'] = s['instance_id']
             self.schedulers[sched_id]['running_id'] = running_id
+            self.schedulers[sched_id]['broks_cursor'] = broks_cursor
             self.schedulers[sched_id]['active'] = s['active']
             self.schedulers[sched_id]['last_connection'] = 0
 
@@ -519,10 +654,10 @@ class Broker(BaseSatellite):
     # all our mess we did, and close modules too
     def clean_previous_run(self):
         # Clean all lists
+        self.cancel_broks_fetches()
         self.schedulers.clear()
         self.pollers.clear()
         self.reactionners.clear()
-        self.broks = self.broks[:]
         self.broks_internal_raised = self.broks_internal_raised[:]
         with self.arbiter_broks_lock:
             self.arbiter_broks = self.arbiter_broks[:]
@@ -574,14 +709,20 @@ class Broker(BaseSatellite):
         # Also reap broks sent from the arbiters
         self.interger_arbiter_broks()
         
-        # And from schedulers
-        self.get_new_broks(type='scheduler')
-        # And for other satellites
-        self.get_new_broks(type='poller')
-        self.get_new_broks(type='reactionner')
-
-        # Sort the brok list by id
-        self.broks.sort(sort_by_ids)
+        # And from schedulers and other satellites. If we do not have broks
+        # to manage, we do not sleep but wait for the schedulers ones (it
+        # counts in our sleep time)
+        wait_time = 0
+        if len(self.broks) == 0:
+            wait_time = self.broks_wait_time
+        t0 = time.time()
+        self.get_new_broks(wait_time=wait_time)
+        if wait_time:
+            if len(self.broks) != 0:
+                # We got some, no need to sleep, we will wait at the next turn
+                self.timeout = 0
+            else:
+                self.timeout -= time.time() - t0
 
         # and for external queues
         # REF: doc/broker-modules.png (3)
@@ -589,7 +730,7 @@ class Broker(BaseSatellite):
         t0 = time.time()
         # We are sending broks as a big list, more efficient than one by one
         queues = self.modules_manager.get_external_to_queues()
-        to_send = [b for b in self.broks if getattr(b, 'need_send_to_ext', True)]
+        to_send = [b for b in self.broks.get_new() if getattr(b, 'need_send_to_ext', True)]
 
         for q in queues:
             q.put(to_send)
@@ -599,54 +740,50 @@ class Broker(BaseSatellite):
             b.need_send_to_ext = False
         logger.debug("Time to send %s broks (%d secs)" % (len(to_send), time.time() - t0))
 
-        # We must had new broks at the end of the list, so we reverse the list
-        self.broks.reverse()
-
-        start = time.time()
-        while len(self.broks) != 0:
-            now = time.time()
-            # Do not 'manage' more than 1s, we must get new broks
-            # every 1s
-            if now - start > 1:
-                break
-
-            b = self.broks.pop()
-            # Ok, we can get the brok, and doing something with it
-            # REF: doc/broker-modules.png (4-5)
-            # We un serialize the brok before consume it
-            b.prepare()
-            self.manage_brok(b)
-
-            nb_broks = len(self.broks)
-
-            # Ok we manage brok, but we still want to listen to arbiter
-            self.watch_for_new_conf(0.0)
-
-            # if we got new broks here from arbiter, we should break the loop
-            # because such broks will not be managed by the
-            # external modules before this loop (we pop them!)
-            if len(self.broks) != nb_broks:
-                break
+        self.manage_broks()
 
         # Maybe external modules raised 'objects'
         # we should get them
         self.get_objects_from_from_queues()
 
         # Maybe we do not have something to do, so we wait a little
+        # (but not if the schedulers already kept us waiting for broks,
+        # older ones will answer directly, so we still wait for them)
         # TODO: redone the diff management....
         if len(self.broks) == 0:
             while self.timeout > 0:
                 begin = time.time()
-                self.watch_for_new_conf(1.0)
+                self.watch_for_new_conf(self.timeout)
                 end = time.time()
                 self.timeout = self.timeout - (end - begin)
-            self.timeout = 1.0
+        self.timeout = 1.0
 
             # print "get new broks watch new conf 1: end", len(self.broks)
 
         # Say to modules it's a new tick :)
         self.hook_point('tick')
 
+    # Give our broks to the internal modules, the sources in turn, but do
+    # not 'manage' more than max_time, we must get new broks. We still
+    # listen to the arbiter every arbiter_poll_interval
+    def manage_broks(self, max_time=1.0):
+        start = last_poll = time.time()
+        while len(self.broks) != 0:
+            now = time.time()
+            if now - start > max_time:
+                break
+            if now - last_poll > self.arbiter_poll_interval:
+                self.watch_for_new_conf(0.0)
+                last_poll = now
+
+            b = self.broks.popleft()
+            # Ok, we can get the brok, and doing something with it
+            # REF: doc/broker-modules.png (4-5)
+            # We un serialize the brok before consume it
+            b.prepare()
+            self.manage_brok(b)
+
+
     #  Main function, will loop forever
     def main(self):
         try:
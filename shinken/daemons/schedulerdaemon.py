@@ -26,18 +26,31 @@
 import os
 import time
 import traceback
-import cPickle
-import zlib
-import base64
 
 from shinken.scheduler import Scheduler
 from shinken.macroresolver import MacroResolver
+from shinken.confstream import loads_conf
 from shinken.external_command import ExternalCommandManager
 from shinken.daemon import Daemon
 from shinken.property import PathProp, IntegerProp
 from shinken.log import logger
 from shinken.satellite import BaseSatellite, IForArbiter as IArb, Interface
 
+
+# The GET arguments are given as strings, with the repr() of the
+# python values given by the HTTPClient. Get back the real values.
+def _get_bool_arg(v):
+    if isinstance(v, basestring):
+        return v == 'True'
+    return v
+
+
+def _get_list_arg(v):
+    if isinstance(v, basestring):
+        return [e.strip().strip('\'"') for e in v.strip('[]').split(',') if e.strip()]
+    return v
+
+
 # Interface for Workers
 
 class IChecks(Interface):
@@ -49,17 +62,23 @@ They connect here and see if they are still OK with our running_id, if not, they
         return self.running_id
 
     # poller or reactionner ask us actions
+    # max_actions is the number of actions it can take (its free
+    # workers slots), -1 for "all you've got" (older satellites)
     def get_checks(self, do_checks=False, do_actions=False, poller_tags=['None'], \
                        reactionner_tags=['None'], worker_name='none', \
-                       module_types=['fork']):
+                       module_types=['fork'], max_actions=-1):
         #print "We ask us checks"
-        res = self.app.get_to_run_checks(do_checks, do_actions, poller_tags, reactionner_tags, worker_name, module_types)
+        do_checks = _get_bool_arg(do_checks)
+        do_actions = _get_bool_arg(do_actions)
+        poller_tags = _get_list_arg(poller_tags)
+        reactionner_tags = _get_list_arg(reactionner_tags)
+        module_types = _get_list_arg(module_types)
+        max_actions = int(max_actions)
+        res = self.app.get_to_run_checks(do_checks, do_actions, poller_tags, reactionner_tags, worker_name, module_types, max_actions)
         #print "Sending %d checks" % len(res)
         self.app.nb_checks_send += len(res)
-
-        return base64.b64encode(zlib.compress(cPickle.dumps(res), 2))
-        #return zlib.compress(cPickle.dumps(res), 2)
-    get_checks.encode = 'raw'
+        return res
+    get_checks.encode = 'pickle'
     
 
     # poller or reactionner are putting us results
@@ -82,22 +101,29 @@ class IBroks(Interface):
     """ Interface for Brokers:
 They connect here and get all broks (data for brokers). Data must be ORDERED! (initial status BEFORE update...) """
 
-    # A broker ask us broks
-    def get_broks(self, bname):
+    # A broker ask us broks. New brokers give the sequence of the last
+    # brok they got (so we can forget them) and the max number of broks
+    # they want, older ones give nothing and get all of them. If we got
+    # nothing new, they can wait up to wait_time seconds for the next ones,
+    # so they do not need to ping and ask us in loop
+    def get_broks(self, bname, since_id=-1, max_count=-1, wait_time=0):
         # Maybe it was not registered as it should, if so,
         # do it for it
         if not bname in self.app.brokers:
             self.fill_initial_broks(bname)
 
-        # Now get the broks for this specific broker
-        res = self.app.get_broks(bname)
+        # The HTTP lock is released while waiting
+        self.app.wait_for_broks(bname, int(since_id), float(wait_time))
+
+        # Now get the broks for this specific broker, with the frames
+        # already done for the broks shared by all brokers
+        res = self.app.get_broks_frames(bname, int(since_id), int(max_count))
         # got only one global counter for broks
-        self.app.nb_broks_send += len(res)
+        self.app.nb_broks_send += len(res.value)
         # we do not more have a full broks in queue
         self.app.brokers[bname]['has_full_broks'] = False
-        return base64.b64encode(zlib.compress(cPickle.dumps(res), 2))
-        #return zlib.compress(cPickle.dumps(res), 2)
-    get_broks.encode = 'raw'
+        return res
+    get_broks.encode = 'pickle'
     
 
     # A broker is a new one, if we do not have
@@ -131,6 +157,18 @@ class IForArbiter(IArb):
     put_conf.method = 'POST'
 
 
+    # The arbiter reloaded its configuration, and sends us the diff of
+    # ours. We apply it in the scheduler loop, if it is still for our
+    # configuration
+    def put_conf_diff(self, diff):
+        if self.app.what_i_managed().get(diff['cfg_id']) != diff['push_flavor']:
+            logger.warning("Configuration diff for a configuration I do not have, I skip it")
+            return False
+        self.app.sched.conf_diffs.append(diff['diff'])
+        return True
+    put_conf_diff.method = 'POST'
+
+
     # Call by arbiter if it thinks we are running but we must not (like
     # if I was a spare that take a conf but the master returns, I must die
     # and wait for a new conf)
@@ -202,55 +240,53 @@ class Shinken(BaseSatellite):
             s.compensate_system_time_change(difference)
 
         # Now all checks and actions
-        for c in self.sched.checks.values():
-            # Already launch checks should not be touch
-            if c.status == 'scheduled':
-                t_to_go = c.t_to_go
-                ref = c.ref
-                new_t = max(0, t_to_go + difference)
-                if ref.check_period is not None:
-                    # But it's no so simple, we must match the timeperiod
-                    new_t = ref.check_period.get_next_valid_time_from_t(new_t)
-                # But maybe no there is no more new value! Not good :(
-                # Say as error, with error output
-                if new_t is None:
-                    c.state = 'waitconsume'
-                    c.exit_status = 2
-                    c.output = '(Error: there is no available check time after time change!)'
-                    c.check_time = time.time()
-                    c.execution_time = 0
-                else:
-                    c.t_to_go = new_t
-                    ref.next_chk = new_t
+        # Already launch checks should not be touch
+        for c in self.sched.checks.get_by_status('scheduled'):
+            t_to_go = c.t_to_go
+            ref = c.ref
+            new_t = max(0, t_to_go + difference)
+            if ref.check_period is not None:
+                # But it's no so simple, we must match the timeperiod
+                new_t = ref.check_period.get_next_valid_time_from_t(new_t)
+            # But maybe no there is no more new value! Not good :(
+            # Say as error, with error output
+            if new_t is None:
+                c.state = 'waitconsume'
+                c.exit_status = 2
+                c.output = '(Error: there is no available check time after time change!)'
+                c.check_time = time.time()
+                c.execution_time = 0
+            else:
+                c.t_to_go = new_t
+                ref.next_chk = new_t
 
         # Now all checks and actions
-        for c in self.sched.actions.values():
-            # Already launch checks should not be touch
-            if c.status == 'scheduled':
-                t_to_go = c.t_to_go
-
-                #  Event handler do not have ref
-                ref = getattr(c, 'ref', None)
-                new_t = max(0, t_to_go + difference)
-
-                # Notification should be check with notification_period
-                if c.is_a == 'notification':
-                    if ref.notification_period:
-                        # But it's no so simple, we must match the timeperiod
-                        new_t = ref.notification_period.get_next_valid_time_from_t(new_t)
-                    # And got a creation_time variable too
-                    c.creation_time = c.creation_time + difference
-
-                # But maybe no there is no more new value! Not good :(
-                # Say as error, with error output
-                if new_t is None:
-                    c.state = 'waitconsume'
-                    c.exit_status = 2
-                    c.output = '(Error: there is no available check time after time change!)'
-                    c.check_time = time.time()
-                    c.execution_time = 0
-                else:
-                    c.t_to_go = new_t
+        # Already launch checks should not be touch
+        for c in self.sched.actions.get_by_status('scheduled'):
+            t_to_go = c.t_to_go
+
+            #  Event handler do not have ref
+            ref = getattr(c, 'ref', None)
+            new_t = max(0, t_to_go + difference)
+
+            # Notification should be check with notification_period
+            if c.is_a == 'notification':
+                if ref.notification_period:
+                    # But it's no so simple, we must match the timeperiod
+                    new_t = ref.notification_period.get_next_valid_time_from_t(new_t)
+                # And got a creation_time variable too
+                c.creation_time = c.creation_time + difference
+
+            # But maybe no there is no more new value! Not good :(
+            # Say as error, with error output
+            if new_t is None:
+                c.state = 'waitconsume'
+                c.exit_status = 2
+                c.output = '(Error: there is no available check time after time change!)'
+                c.check_time = time.time()
+                c.execution_time = 0
+            else:
+                c.t_to_go = new_t
 
     def manage_signal(self, sig, frame):
         logger.warning("Received a SIGNAL %s" % sig)
@@ -287,7 +323,8 @@ class Shinken(BaseSatellite):
         skip_initial_broks = pk['skip_initial_broks']
 
         t0 = time.time()
-        conf = cPickle.loads(conf_raw)
+        # The chunks of the arbiter stream, or a whole pickle of the old ones
+        conf = loads_conf(conf_raw)
         logger.debug("Conf received at %d. Unserialized in %d secs" % (t0, time.time() - t0))
 
         self.new_conf = None
@@ -357,6 +394,7 @@ class Shinken(BaseSatellite):
         # Create and connect it
         self.ibroks = IBroks(self.sched)
         self.http_daemon.register(self.ibroks)
+        self.sched.set_broks_lock(self.http_daemon.lock)
 
         logger.info("Loading configuration.")
         self.conf.explode_global_conf()
@@ -149,7 +149,8 @@ class Daterange:
 
     # @memoized
     def get_month_by_id(cls, id):
-        id = id % 12
+        # months are 1..12, so december is not 0
+        id = (id - 1) % 12 + 1
         for key in Daterange.months:
             if id == Daterange.months[key]:
                 return key
@@ -384,7 +385,33 @@ class Daterange:
             # I'm not find any valid time
             return None
 
-
+    # Give the (start, end) intervals of the timeranges of the valid
+    # days between t_start and t_end. start is the first valid second,
+    # end the first invalid one after it
+    def get_valid_intervals(self, t_start, t_end):
+        res = []
+        day = get_day(t_start)
+        while day < t_end:
+            lt = time.localtime(day)
+            (year, mon, mday) = (lt.tm_year, lt.tm_mon, lt.tm_mday)
+            # mktime manage the end of the months (and the DST days)
+            next_day = int(get_start_of_day(year, mon, mday + 1))
+            if self.is_time_day_valid(day):
+                for tr in self.timeranges:
+                    # The end of the timerange is still valid (up to its 59s)
+                    if tr.hstart*3600 + tr.mstart*60 > tr.hend*3600 + tr.mend*60:
+                        continue
+                    start = int(time.mktime((year, mon, mday, tr.hstart, tr.mstart, 0, 0, 0, -1)))
+                    if tr.hend*3600 + tr.mend*60 >= 86400:
+                        end = next_day
+                    else:
+                        end = int(time.mktime((year, mon, mday, tr.hend, tr.mend, 1, 0, 0, -1)))
+                    start = max(start, t_start)
+                    end = min(end, next_day, t_end)
+                    if start < end:
+                        res.append((start, end))
+            day = next_day
+        return res
 
 
 """ TODO: Add some comment about this class for the doc"""
@@ -446,34 +473,32 @@ class MonthWeekDayDaterange(Daterange):
     def get_start_and_end_time(self, ref=None):
         now = time.localtime(ref)
 
-        if self.syear == 0:
-            self.syear = now.tm_year
+        syear = self.syear or now.tm_year
         month_id = Daterange.get_month_id(self.smon)
-        day_start = find_day_by_weekday_offset(self.syear, self.smon, self.swday, self.swday_offset)
-        start_time = get_start_of_day(self.syear, month_id, day_start)
+        day_start = find_day_by_weekday_offset(syear, self.smon, self.swday, self.swday_offset)
+        start_time = get_start_of_day(syear, month_id, day_start)
 
-        if self.eyear == 0:
-            self.eyear = now.tm_year
+        eyear = self.eyear or now.tm_year
         month_end_id = Daterange.get_month_id(self.emon)
-        day_end = find_day_by_weekday_offset(self.eyear, self.emon, self.ewday, self.ewday_offset)
-        end_time = get_end_of_day(self.eyear, month_end_id, day_end)
+        day_end = find_day_by_weekday_offset(eyear, self.emon, self.ewday, self.ewday_offset)
+        end_time = get_end_of_day(eyear, month_end_id, day_end)
 
         now_epoch = time.mktime(now)
         if start_time > end_time:  # the period is between years
             if now_epoch > end_time:  # check for next year
-                day_end = find_day_by_weekday_offset(self.eyear + 1, self.emon, self.ewday, self.ewday_offset)
-                end_time = get_end_of_day(self.eyear + 1, month_end_id, day_end)
+                day_end = find_day_by_weekday_offset(eyear + 1, self.emon, self.ewday, self.ewday_offset)
+                end_time = get_end_of_day(eyear + 1, month_end_id, day_end)
             else:
                 # it s just that the start was the last year
-                day_start = find_day_by_weekday_offset(self.syear - 1, self.smon, self.swday, self.swday_offset)
-                start_time = get_start_of_day(self.syear - 1, month_id, day_start)
+                day_start = find_day_by_weekday_offset(syear - 1, self.smon, self.swday, self.swday_offset)
+                start_time = get_start_of_day(syear - 1, month_id, day_start)
         else:
             if now_epoch > end_time:
                 # just have to check for next year if necessary
-                day_start = find_day_by_weekday_offset(self.syear + 1, self.smon, self.swday, self.swday_offset)
-                start_time = get_start_of_day(self.syear + 1, month_id, day_start)
-                day_end = find_day_by_weekday_offset(self.eyear + 1, self.emon, self.ewday, self.ewday_offset)
-                end_time = get_end_of_day(self.eyear + 1, month_end_id, day_end)
+                day_start = find_day_by_weekday_offset(syear + 1, self.smon, self.swday, self.swday_offset)
+                start_time = get_start_of_day(syear + 1, month_id, day_start)
+                day_end = find_day_by_weekday_offset(eyear + 1, self.emon, self.ewday, self.ewday_offset)
+                end_time = get_end_of_day(eyear + 1, month_end_id, day_end)
 
         return (start_time, end_time)
 
@@ -482,35 +507,33 @@ class MonthWeekDayDaterange(Daterange):
 class MonthDateDaterange(Daterange):
     def get_start_and_end_time(self, ref=None):
         now = time.localtime(ref)
-        if self.syear == 0:
-            self.syear = now.tm_year
+        syear = self.syear or now.tm_year
         month_start_id = Daterange.get_month_id(self.smon)
-        day_start = find_day_by_offset(self.syear, self.smon, self.smday)
-        start_time = get_start_of_day(self.syear, month_start_id, day_start)
+        day_start = find_day_by_offset(syear, self.smon, self.smday)
+        start_time = get_start_of_day(syear, month_start_id, day_start)
 
-        if self.eyear == 0:
-            self.eyear = now.tm_year
+        eyear = self.eyear or now.tm_year
         month_end_id = Daterange.get_month_id(self.emon)
-        day_end = find_day_by_offset(self.eyear, self.emon, self.emday)
-        end_time = get_end_of_day(self.eyear, month_end_id, day_end)
+        day_end = find_day_by_offset(eyear, self.emon, self.emday)
+        end_time = get_end_of_day(eyear, month_end_id, day_end)
 
         now_epoch = time.mktime(now)
         if start_time > end_time:  # the period is between years
             if now_epoch > end_time:
                 # check for next year
-                day_end = find_day_by_offset(self.eyear + 1, self.emon, self.emday)
-                end_time = get_end_of_day(self.eyear + 1, month_end_id, day_end)
+                day_end = find_day_by_offset(eyear + 1, self.emon, self.emday)
+                end_time = get_end_of_day(eyear + 1, month_end_id, day_end)
             else:
                 # it s just that start was the last year
-                day_start = find_day_by_offset(self.syear-1, self.smon, self.emday)
-                start_time = get_start_of_day(self.syear-1, month_start_id, day_start)
+                day_start = find_day_by_offset(syear-1, self.smon, self.emday)
+                start_time = get_start_of_day(syear-1, month_start_id, day_start)
         else:
             if now_epoch > end_time:
                 # just have to check for next year if necessary
-                day_start = find_day_by_offset(self.syear+1, self.smon, self.emday)
-                start_time = get_start_of_day(self.syear+1, month_start_id, day_start)
-                day_end = find_day_by_offset(self.eyear+1, self.emon, self.emday)
-                end_time = get_end_of_day(self.eyear+1, month_end_id, day_end)
+                day_start = find_day_by_offset(syear+1, self.smon, self.emday)
+                start_time = get_start_of_day(syear+1, month_start_id, day_start)
+                day_end = find_day_by_offset(eyear+1, self.emon, self.emday)
+                end_time = get_end_of_day(eyear+1, month_end_id, day_end)
 
         return (start_time, end_time)
 
@@ -521,20 +544,18 @@ class WeekDayDaterange(Daterange):
         now = time.localtime(ref)
 
         # If no year, it's our year
-        if self.syear == 0:
-            self.syear = now.tm_year
+        syear = self.syear or now.tm_year
         month_start_id = now.tm_mon
         month_start = Daterange.get_month_by_id(month_start_id)
-        day_start = find_day_by_weekday_offset(self.syear, month_start, self.swday, self.swday_offset)
-        start_time = get_start_of_day(self.syear, month_start_id, day_start)
+        day_start = find_day_by_weekday_offset(syear, month_start, self.swday, self.swday_offset)
+        start_time = get_start_of_day(syear, month_start_id, day_start)
 
         # Same for end year
-        if self.eyear == 0:
-            self.eyear = now.tm_year
+        eyear = self.eyear or now.tm_year
         month_end_id = now.tm_mon
         month_end = Daterange.get_month_by_id(month_end_id)
-        day_end = find_day_by_weekday_offset(self.eyear, month_end, self.ewday, self.ewday_offset)
-        end_time = get_end_of_day(self.eyear, month_end_id, day_end)
+        day_end = find_day_by_weekday_offset(eyear, month_end, self.ewday, self.ewday_offset)
+        end_time = get_end_of_day(eyear, month_end_id, day_end)
 
         # Maybe end_time is before start. So look for the
         # next month
@@ -542,10 +563,10 @@ class WeekDayDaterange(Daterange):
             month_end_id = month_end_id + 1
             if month_end_id > 12:
                 month_end_id = 1
-                self.eyear += 1
+                eyear += 1
             month_end = Daterange.get_month_by_id(month_end_id)
-            day_end = find_day_by_weekday_offset(self.eyear, month_end, self.ewday, self.ewday_offset)
-            end_time = get_end_of_day(self.eyear, month_end_id, day_end)
+            day_end = find_day_by_weekday_offset(eyear, month_end, self.ewday, self.ewday_offset)
+            end_time = get_end_of_day(eyear, month_end_id, day_end)
 
         now_epoch = time.mktime(now)
         # But maybe we look not enought far. We should add a month
@@ -554,18 +575,18 @@ class WeekDayDaterange(Daterange):
             month_start_id = month_start_id + 1
             if month_end_id > 12:
                 month_end_id = 1
-                self.eyear += 1
+                eyear += 1
             if month_start_id > 12:
                 month_start_id = 1
-                self.syear += 1
+                syear += 1
             # First start
             month_start = Daterange.get_month_by_id(month_start_id)
-            day_start = find_day_by_weekday_offset(self.syear, month_start, self.swday, self.swday_offset)
-            start_time = get_start_of_day(self.syear, month_start_id, day_start)
+            day_start = find_day_by_weekday_offset(syear, month_start, self.swday, self.swday_offset)
+            start_time = get_start_of_day(syear, month_start_id, day_start)
             # Then end
             month_end = Daterange.get_month_by_id(month_end_id)
-            day_end = find_day_by_weekday_offset(self.eyear, month_end, self.ewday, self.ewday_offset)
-            end_time = get_end_of_day(self.eyear, month_end_id, day_end)
+            day_end = find_day_by_weekday_offset(eyear, month_end, self.ewday, self.ewday_offset)
+            end_time = get_end_of_day(eyear, month_end_id, day_end)
 
         return (start_time, end_time)
 
@@ -574,19 +595,17 @@ class WeekDayDaterange(Daterange):
 class MonthDayDaterange(Daterange):
     def get_start_and_end_time(self, ref=None):
         now = time.localtime(ref)
-        if self.syear == 0:
-            self.syear = now.tm_year
+        syear = self.syear or now.tm_year
         month_start_id = now.tm_mon
         month_start = Daterange.get_month_by_id(month_start_id)
-        day_start = find_day_by_offset(self.syear, month_start, self.smday)
-        start_time = get_start_of_day(self.syear, month_start_id, day_start)
+        day_start = find_day_by_offset(syear, month_start, self.smday)
+        start_time = get_start_of_day(syear, month_start_id, day_start)
 
-        if self.eyear == 0:
-            self.eyear = now.tm_year
+        eyear = self.eyear or now.tm_year
         month_end_id = now.tm_mon
         month_end = Daterange.get_month_by_id(month_end_id)
-        day_end = find_day_by_offset(self.eyear, month_end, self.emday)
-        end_time = get_end_of_day(self.eyear, month_end_id, day_end)
+        day_end = find_day_by_offset(eyear, month_end, self.emday)
+        end_time = get_end_of_day(eyear, month_end_id, day_end)
 
         now_epoch = time.mktime(now)
 
@@ -594,28 +613,28 @@ class MonthDayDaterange(Daterange):
             month_end_id = month_end_id + 1
             if month_end_id > 12:
                 month_end_id = 1
-                self.eyear += 1
-            day_end = find_day_by_offset(self.eyear, month_end, self.emday)
-            end_time = get_end_of_day(self.eyear, month_end_id, day_end)
+                eyear += 1
+            day_end = find_day_by_offset(eyear, month_end, self.emday)
+            end_time = get_end_of_day(eyear, month_end_id, day_end)
 
         if end_time < now_epoch:
             month_end_id = month_end_id + 1
             month_start_id = month_start_id + 1
             if month_end_id > 12:
                 month_end_id = 1
-                self.eyear += 1
+                eyear += 1
             if month_start_id > 12:
                 month_start_id = 1
-                self.syear += 1
+                syear += 1
 
             # For the start
             month_start = Daterange.get_month_by_id(month_start_id)
-            day_start = find_day_by_offset(self.syear, month_start, self.smday)
-            start_time = get_start_of_day(self.syear, month_start_id, day_start)
+            day_start = find_day_by_offset(syear, month_start, self.smday)
+            start_time = get_start_of_day(syear, month_start_id, day_start)
 
             # For the end
             month_end = Daterange.get_month_by_id(month_end_id)
-            day_end = find_day_by_offset(self.eyear, month_end, self.emday)
-            end_time = get_end_of_day(self.eyear, month_end_id, day_end)
+            day_end = find_day_by_offset(eyear, month_end, self.emday)
+            end_time = get_end_of_day(eyear, month_end_id, day_end)
 
         return (start_time, end_time)
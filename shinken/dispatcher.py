@@ -37,6 +37,7 @@ import itertools
 
 from shinken.util import alive_then_spare_then_deads
 from shinken.log import logger
+from shinken.confdiff import get_conf_incompatibility, get_conf_diff, dumps_conf_diff
 
 # Always initialize random :)
 random.seed()
@@ -80,6 +81,11 @@ class Dispatcher:
             # if a satellite already got it or not :)
             cfg.push_flavor = 0
 
+        # The configuration of each host, so the external commands
+        # find their scheduler at once
+        self.hosts_confs = {}
+        self.index_hosts_confs()
+
         # Add satellites in the good lists
         self.elements.extend(self.schedulers)
 
@@ -318,6 +324,18 @@ class Dispatcher:
         return scheds
 
 
+    # Index the configurations by the names of their hosts
+    def index_hosts_confs(self):
+        self.hosts_confs = {}
+        for cfg in self.conf.confs.values():
+            for h in cfg.hosts:
+                self.hosts_confs[h.get_name()] = cfg
+
+    # Give the configuration of the host, or None if it's unknown. Its
+    # scheduler is the one it is assigned to
+    def get_host_conf(self, host_name):
+        return self.hosts_confs.get(host_name)
+
     # Manage the dispatch
     # REF: doc/shinken-conf-dispatching.png (3)
     def dispatch(self):
@@ -347,12 +365,20 @@ class Dispatcher:
                 # Now we do the real job
                 # every_one_need_conf = False
                 for conf in conf_to_dispatch:
-                    logger.info('[%s] Dispatching configuration %s' % (r.get_name(), conf.id))
+                    logger.info('[%s] Dispatching configuration %s (projected load %.2f checks/s)'
+                                % (r.get_name(), conf.id, getattr(conf, 'projected_load', 0.0)))
 
                     # If there is no alive schedulers, not good...
                     if len(scheds) == 0:
                         logger.info('[%s] but there a no alive schedulers in this realm!' % r.get_name())
 
+                    # The packs of the configuration were done for a scheduler
+                    # weight, so we try it first if it's still there
+                    planned = [s for s in scheds if s.get_name() == getattr(conf, 'planned_scheduler', '')]
+                    if planned:
+                        scheds.remove(planned[0])
+                        scheds.append(planned[0])
+
                     # we need to loop until the conf is assigned
                     # or when there are no more schedulers available
                     while True:
@@ -553,3 +579,60 @@ class Dispatcher:
                             logger.info('[%s] Dispatch OK of configuration to receiver %s' % (r.get_name(), rec.get_name()))
                         else:
                             logger.error('[%s] Dispatching failed for receiver %s' % (r.get_name(), rec.get_name()))
+
+
+    # The arbiter reloaded its configuration: if only hosts, services,
+    # commands or timeperiods changed, we send to each scheduler the diff
+    # of its configuration, so it keeps its checks and states, and we keep
+    # our links (and so the satellites that do not have to change). If a
+    # scheduler fails, it will get its new whole configuration by the
+    # standard dispatch. Say False if the new configuration need a whole
+    # new dispatch
+    def push_conf_diffs(self, new_conf):
+        reason = get_conf_incompatibility(self.conf, new_conf)
+        if reason is not None:
+            logger.info("The configuration cannot be sent as diffs, %s: all the configurations will be dispatched" % reason)
+            return False
+
+        for r in self.realms:
+            new_r = new_conf.realms.find_by_name(r.get_name())
+            for (cfg_id, cfg) in r.confs.items():
+                new_cfg = new_r.confs[cfg_id]
+                sched = cfg.assigned_to
+                is_sent = False
+                if cfg.is_assigned and sched is not None and sched.alive:
+                    t0 = time.time()
+                    diff = get_conf_diff(cfg, new_cfg)
+                    package = {'cfg_id': cfg_id, 'push_flavor': cfg.push_flavor,
+                               'diff': dumps_conf_diff(diff, new_cfg)}
+                    is_sent = sched.put_conf_diff(package)
+                    logger.info('[%s] Configuration diff of %d objects sent to scheduler %s in %.2fs: %s' %
+                                (r.get_name(), len(diff[0]) + len(diff[1]), sched.get_name(), time.time() - t0, is_sent))
+                if is_sent:
+                    new_cfg.is_assigned = True
+                    new_cfg.assigned_to = sched
+                    new_cfg.push_flavor = cfg.push_flavor
+                    sched.conf = new_cfg
+                    # The receivers must know the new hosts
+                    hnames = [h.get_name() for h in new_cfg.hosts]
+                    for rec in r.to_satellites_managed_by['receiver'].get(cfg_id, []):
+                        rec.push_host_names(cfg_id, hnames)
+                else:
+                    new_cfg.is_assigned = False
+                    new_cfg.assigned_to = None
+                    new_cfg.push_flavor = 0
+                    if sched is not None:
+                        sched.conf = None
+                        sched.push_flavor = 0
+                        sched.need_conf = True
+                    self.dispatch_ok = False
+                r.confs[cfg_id] = new_cfg
+                r.serialized_confs[cfg_id] = new_r.serialized_confs[cfg_id]
+                new_conf.confs[cfg_id] = new_cfg
+
+        # We keep our realms and satellites links, they did not change
+        for prop in ('realms', 'arbiters', 'schedulers', 'reactionners', 'brokers', 'receivers', 'pollers'):
+            setattr(new_conf, prop, getattr(self.conf, prop))
+        self.conf = new_conf
+        self.index_hosts_confs()
+        return True
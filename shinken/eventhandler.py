@@ -41,11 +41,12 @@ class EventHandler(Action):
         'is_a':           StringProp(default='eventhandler'),
         'type':           StringProp(default=''),
         '_in_timeout':    StringProp(default=False),
-        'status':         StringProp(default=''),
+        # status and t_to_go are properties of Action, so they can't be slots
+        'status':         StringProp(default='', no_slots=True),
         'exit_status':    StringProp(default=3),
         'output':         StringProp(default=''),
         'long_output':    StringProp(default=''),
-        't_to_go':        StringProp(default=0),
+        't_to_go':        StringProp(default=0, no_slots=True),
         'check_time':     StringProp(default=0),
         'execution_time': FloatProp(default=0),
         'u_time':         FloatProp(default=0.0),
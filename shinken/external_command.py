@@ -257,6 +257,10 @@ class ExternalCommandManager:
         self.cmd_fragments = ''
         if self.mode == 'dispatcher':
             self.confs = conf.confs
+        # The arbiter dispatcher, that knows the schedulers of the hosts
+        self.dispatcher = None
+        # (host name, command) we got while we resolve a list of commands
+        self.routed_commands = None
         # Will change for each command read, so if a command need it,
         # it can get it
         self.current_timestamp = 0
@@ -270,6 +274,9 @@ class ExternalCommandManager:
     def load_receiver(self, receiver):
         self.receiver = receiver
 
+    def load_dispatcher(self, dispatcher):
+        self.dispatcher = dispatcher
+
 
     def open(self):
         # At the first open del and create the fifo
@@ -311,6 +318,34 @@ class ExternalCommandManager:
         return r
 
 
+    # Resolve a list of commands. In the arbiter, we look for the
+    # scheduler of each host only one time, and then put the commands
+    # in the external_commands of their schedulers, in their order
+    def resolve_commands(self, excmds):
+        if self.mode != 'dispatcher':
+            for excmd in excmds:
+                self.resolve_command(excmd)
+            return
+
+        self.routed_commands = routed = []
+        try:
+            for excmd in excmds:
+                self.resolve_command(excmd)
+        finally:
+            self.routed_commands = None
+
+        scheds = {}
+        for (host_name, command) in routed:
+            # A global command
+            if host_name is None:
+                self.dispatch_global_command(command)
+                continue
+            if host_name not in scheds:
+                scheds[host_name] = self.get_host_scheduler(host_name)
+            sched = scheds[host_name]
+            if sched is not None:
+                sched.external_commands.append(command)
+
     def resolve_command(self, excmd):
         # Maybe the command is invalid. Bailout
         try:
@@ -360,27 +395,45 @@ class ExternalCommandManager:
                 sched['external_commands'].append(extcmd)
             return
         
-        host_found = False
-        for cfg in self.confs.values():
-            if cfg.hosts.find_by_name(host_name) is not None:
+        # We resolve a list of commands: they will be sent after it
+        if self.routed_commands is not None:
+            self.routed_commands.append((host_name, command))
+            return
+
+        sched = self.get_host_scheduler(host_name)
+        if sched is not None:
+            sched.external_commands.append(command)
+
+
+    # The scheduler that got the configuration of this host, or None
+    def get_host_scheduler(self, host_name):
+        # The dispatcher got the configurations by host name, if we do not
+        # have it, look in all of them
+        if self.dispatcher is not None:
+            cfgs = [self.dispatcher.get_host_conf(host_name)]
+        else:
+            cfgs = [cfg for cfg in self.confs.values() if cfg.hosts.find_by_name(host_name) is not None]
+
+        for cfg in cfgs:
+            if cfg is not None:
                 logger.debug("Host %s found in a configuration" % host_name)
                 if cfg.is_assigned:
-                    host_found = True
                     sched = cfg.assigned_to
                     logger.debug("Sending command to the scheduler %s" % sched.get_name())
-                    #sched.run_external_command(command)
-                    sched.external_commands.append(command)
-                    break
+                    return sched
                 else:
                     logger.warning("Problem: a configuration is found, but is not assigned!")
 
-        if not host_found:
-            logger.warning("Passive check result was received for host '%s', but the host could not be found!" % host_name)
-            #print "Sorry but the host", host_name, "was not found"
+        logger.warning("Passive check result was received for host '%s', but the host could not be found!" % host_name)
+        return None
 
 
     # The command is global, so sent it to every schedulers
     def dispatch_global_command(self, command):
+        # We keep it with the others, to not change their order
+        if self.routed_commands is not None:
+            self.routed_commands.append((None, command))
+            return
         for sched in self.conf.schedulers:
             logger.debug("Sending a command '%s' to scheduler %s" % (command, sched))
             if sched.alive:
@@ -24,130 +24,172 @@
 # along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from array import array
+
+
+# Give the root of the node n in the union-find parent array, and
+# make the path to it shorter for the next ones
+def find_root(parent, n):
+    root = n
+    while parent[root] != root:
+        root = parent[root]
+    while parent[n] != root:
+        (parent[n], n) = (root, parent[n])
+    return root
+
+
 class Graph:
     """Graph is a class to make graph things like DFS checks or accessibility
     Why use an atomic bomb when a little hammer is enough?
 
+    The nodes are given an integer id when they are added, and the
+    algorithms work on these ids, without recursion (so they do not
+    care about the recursion limit with long chains) and without
+    changing the nodes.
+
     """
 
     def __init__(self):
-        self.nodes = {}
+        # The nodes by their id, the ids of the nodes, and the ids of
+        # the sons of the nodes by their id
+        self.nodes = []
+        self.ids = {}
+        self.sons = []
+
+    # Give the id of the node, and add it if it's a new one
+    def get_id(self, node):
+        i = self.ids.get(node)
+        if i is None:
+            i = self.ids[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.sons.append([])
+        return i
 
-    # Do not call twice...
     def add_node(self, node):
-        self.nodes[node] = []
+        self.get_id(node)
 
     # Just loop over nodes
     def add_nodes(self, nodes):
         for node in nodes:
             self.add_node(node)
 
-    # Add an edge to the graph from->to
+    # Add an edge to the graph from->to. The nodes are added if
+    # they are unknown
     def add_edge(self, from_node, to_node):
-        # Maybe to_node is unknown
-        if to_node not in self.nodes:
-            self.add_node(to_node)
-
-        try:
-            self.nodes[from_node].append(to_node)
-        # If from_node does not exist, add it with its son
-        except KeyError, exp:
-            self.nodes[from_node] = [to_node]
+        from_id = self.get_id(from_node)
+        self.sons[from_id].append(self.get_id(to_node))
 
     # Return all nodes that are in a loop. So if return [], no loop
+    # It's the nodes of the strongly connected components of more than
+    # one node (or with an edge to itself), found with an iterative
+    # Tarjan algorithm
     def loop_check(self):
+        sons = self.sons
+        nb = len(self.nodes)
+        index = array('i', [-1]) * nb
+        low = array('i', [0]) * nb
+        on_stack = array('b', [0]) * nb
+        stack = []
         in_loop = []
-        # Add the tag for dfs check
-        for node in self.nodes:
-            node.dfs_loop_status = 'DFS_UNCHECKED'
-
-        # Now do the job
-        for node in self.nodes:
-            # Run the dfs only if the node has not been already done */
-            if node.dfs_loop_status == 'DFS_UNCHECKED':
-                self.dfs_loop_search(node)
-            # If LOOP_INSIDE, must be returned
-            if node.dfs_loop_status == 'DFS_LOOP_INSIDE':
-                in_loop.append(node)
-
-        # Remove the tag
-        for node in self.nodes:
-            del node.dfs_loop_status
-
-        return in_loop
-
-    # DFS_UNCHECKED default value
-    # DFS_TEMPORARY_CHECKED check just one time
-    # DFS_OK no problem for node and its children
-    # DFS_NEAR_LOOP has trouble sons
-    # DFS_LOOP_INSIDE is a part of a loop!
-    def dfs_loop_search(self, root):
-        # Make the root temporary checked
-        root.dfs_loop_status = 'DFS_TEMPORARY_CHECKED'
-
-        # We are scanning the sons
-        for child in self.nodes[root]:
-            child_status = child.dfs_loop_status
-            # If a child is not checked, check it
-            if child_status == 'DFS_UNCHECKED':
-                self.dfs_loop_search(child)
-                child_status = child.dfs_loop_status
-
-            # If a child has already been temporary checked, it's a problem,
-            # loop inside, and its a acked status
-            if child_status == 'DFS_TEMPORARY_CHECKED':
-                child.dfs_loop_status = 'DFS_LOOP_INSIDE'
-                root.dfs_loop_status = 'DFS_LOOP_INSIDE'
-
-            # If a child has already been temporary checked, it's a problem, loop inside
-            if child_status in ('DFS_NEAR_LOOP', 'DFS_LOOP_INSIDE'):
-                # if a node is known to be part of a loop, do not let it be less
-                if root.dfs_loop_status != 'DFS_LOOP_INSIDE':
-                    root.dfs_loop_status = 'DFS_NEAR_LOOP'
-                # We've already seen this child, it's a problem
-                child.dfs_loop_status = 'DFS_LOOP_INSIDE'
-
-        # If root have been modified, do not set it OK
-        # A node is OK if and only if all of its children are OK
-        # if it does not have a child, goes ok
-        if root.dfs_loop_status == 'DFS_TEMPORARY_CHECKED':
-            root.dfs_loop_status = 'DFS_OK'
+        next_index = 0
+
+        for root in xrange(nb):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack[root] = 1
+            # The DFS path, with the position of the next son to look at
+            path = [root]
+            pos = [0]
+            while path:
+                n = path[-1]
+                n_sons = sons[n]
+                i = pos[-1]
+                if i < len(n_sons):
+                    pos[-1] = i + 1
+                    s = n_sons[i]
+                    if index[s] == -1:
+                        # Not visited, go in it
+                        index[s] = low[s] = next_index
+                        next_index += 1
+                        stack.append(s)
+                        on_stack[s] = 1
+                        path.append(s)
+                        pos.append(0)
+                    elif on_stack[s] and index[s] < low[n]:
+                        low[n] = index[s]
+                    continue
+
+                # All the sons are done, go back to the father
+                path.pop()
+                pos.pop()
+                if path and low[n] < low[path[-1]]:
+                    low[path[-1]] = low[n]
+                if low[n] != index[n]:
+                    continue
+                # n is the first node of a component: it's the nodes
+                # above it in the stack
+                comp = []
+                while True:
+                    s = stack.pop()
+                    on_stack[s] = 0
+                    comp.append(s)
+                    if s == n:
+                        break
+                if len(comp) > 1 or n in n_sons:
+                    in_loop.extend(comp)
+
+        in_loop.sort()
+        return [self.nodes[i] for i in in_loop]
 
     # Get accessibility packs of the graph: in one pack,
     # element are related in a way. Between packs, there is no relation
-    # at all.
-    # TODO: Make it work for directional graph too
-    # Because for now, edge must be father->son AND son->father
+    # at all. The edges are not directional here, so one by relation
+    # is enough. The packs are done with an union-find of the node ids,
+    # and are given in the order of their first node
     def get_accessibility_packs(self):
-        packs = []
-        # Add the tag for dfs check
-        for node in self.nodes:
-            node.dfs_loop_status = 'DFS_UNCHECKED'
-
-        for node in self.nodes:
-            # Run the dfs only if the node is not already done */
-            if node.dfs_loop_status == 'DFS_UNCHECKED':
-                packs.append(self.dfs_get_all_childs(node))
-
-        # Remove the tag
-        for node in self.nodes:
-            del node.dfs_loop_status
+        nb = len(self.nodes)
+        parent = array('i', xrange(nb))
+        size = array('i', [1]) * nb
+
+        for (n, n_sons) in enumerate(self.sons):
+            for s in n_sons:
+                a = find_root(parent, n)
+                b = find_root(parent, s)
+                if a == b:
+                    continue
+                # The small tree goes under the big one
+                if size[a] < size[b]:
+                    (a, b) = (b, a)
+                parent[b] = a
+                size[a] += size[b]
 
+        packs = []
+        pack_ids = {}
+        nodes = self.nodes
+        for n in xrange(nb):
+            root = find_root(parent, n)
+            i = pack_ids.get(root)
+            if i is None:
+                i = pack_ids[root] = len(packs)
+                packs.append([])
+            packs[i].append(nodes[n])
         return packs
 
-    # Return all my children, and all my grandchildren
+    # Return all my children, and all my grandchildren. A node that is
+    # not in the graph got no children, and we do not add it
     def dfs_get_all_childs(self, root):
-        root.dfs_loop_status = 'DFS_CHECKED'
-
-        ret = set()
-        # Me
-        ret.add(root)
-        # And my sons
-        ret.update(self.nodes[root])
-
-        for child in self.nodes[root]:
-            # I just don't care about already checked childs
-            if child.dfs_loop_status == 'DFS_UNCHECKED':
-                ret.update(self.dfs_get_all_childs(child))
-
-        return list(ret)
+        sons = self.sons
+        root_id = self.ids.get(root)
+        if root_id is None:
+            return [root]
+        seen = set([root_id])
+        to_see = [root_id]
+        while to_see:
+            for s in sons[to_see.pop()]:
+                if s not in seen:
+                    seen.add(s)
+                    to_see.append(s)
+        return [self.nodes[i] for i in sorted(seen)]
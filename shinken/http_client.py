@@ -36,6 +36,8 @@ import urllib
 from StringIO import StringIO
 
 from shinken.bin import VERSION
+from shinken.log import logger
+from shinken import wireformat
 PYCURL_VERSION = pycurl.version_info()[1]
 
 class HTTPException(Exception):
@@ -61,10 +63,15 @@ class HTTPClient(object):
             self.uri = uri
         
         self.con     = pycurl.Curl()
-        
+        # Do the other side know about our binary frames format? We will know it
+        # at its first response
+        self.frames = False
+
         # Remove the Expect: 100-Continue default behavior of pycurl, because swsgiref do not
         # manage it
-        self.con.setopt(pycurl.HTTPHEADER, ['Expect:', 'Keep-Alive: 300', 'Connection: Keep-Alive'])
+        self.headers = ['Expect:', 'Keep-Alive: 300', 'Connection: Keep-Alive']
+        self.con.setopt(pycurl.HTTPHEADER, self.headers)
+        self.con.setopt(pycurl.HEADERFUNCTION, self._read_header)
         self.con.setopt(pycurl.USERAGENT,  'shinken:%s pycurl:%s' % (VERSION, PYCURL_VERSION) )
         self.con.setopt(pycurl.FOLLOWLOCATION, 1)
         self.con.setopt(pycurl.FAILONERROR, True)
@@ -76,7 +83,13 @@ class HTTPClient(object):
         self.con.setopt(pycurl.SSL_VERIFYPEER, 0)
         self.con.setopt(pycurl.SSL_VERIFYHOST, 0)
 
-    
+
+    # Look if the other side tell us it knows about the frames format
+    def _read_header(self, line):
+        if line.lower().startswith(wireformat.HEADER.lower() + ':'):
+            self.frames = True
+
+
     # Try to get an URI path
     def get(self, path, args={}, wait='short'):
         c = self.con
@@ -116,15 +129,59 @@ class HTTPClient(object):
             ret  = json.loads(response.getvalue().replace('\\/', '/'))
             # print "GOT RAW RESULT", ret, type(ret)
             return ret
-        
+
+
+    # Get an URI path that return python objects, like checks or broks. We ask
+    # for the binary frames format, and load the frames while they are coming.
+    # Older daemons will just answer with the json/base64/zlib/cPickle one.
+    def get_objects(self, path, args={}, wait='long'):
+        decoder = self.prepare_get_objects(path, args, wait)
+        errstr = None
+        try:
+            self.con.perform()
+        except pycurl.error, error:
+            errno, errstr = error
+        return self.get_objects_result(decoder, errstr)
+
+
+    # Set our handle for a get_objects, so it can be performed by us, or
+    # with others in a CurlMulti. The returned decoder must be given
+    # to get_objects_result when the transfer is done
+    def prepare_get_objects(self, path, args={}, wait='long'):
+        c = self.con
+        c.setopt(c.POST, 0)
+        c.setopt(pycurl.HTTPGET, 1)
+        if wait == 'short':
+            c.setopt(c.TIMEOUT, self.timeout)
+        else:
+            c.setopt(c.TIMEOUT, self.data_timeout)
+        c.setopt(c.URL, str(self.uri+path+'?'+urllib.urlencode(args)))
+        c.setopt(pycurl.HTTPHEADER, self.headers + ['Accept: %s, application/json' % wireformat.CONTENT_TYPE])
+        decoder = wireformat.FrameDecoder()
+        c.setopt(pycurl.WRITEFUNCTION, decoder.feed)
+        return decoder
+
+
+    # The objects of a prepared get_objects. errstr is the error message
+    # of the transfer if it failed
+    def get_objects_result(self, decoder, errstr=None):
+        c = self.con
+        c.setopt(pycurl.HTTPHEADER, self.headers)
+        if errstr is not None:
+            raise HTTPException ('Connexion error to %s : %s' % (self.uri, errstr))
+        r = c.getinfo(pycurl.HTTP_CODE)
+
+        if r != 200:
+            logger.error("There was a critical error : %s" % decoder.get_raw())
+            raise Exception ('Connexion error to %s : %s' % (self.uri, r))
+        try:
+            return decoder.get_value()
+        except (ValueError, TypeError, zlib.error, cPickle.PickleError), exp:
+            raise HTTPException ('Bad data from %s : %s' % (self.uri, exp))
+
 
     # Try to get an URI path
     def post(self, path, args, wait='short'):
-        # Take args, pickle them and then compress the result
-        for (k,v) in args.iteritems():
-            args[k] = zlib.compress(cPickle.dumps(v), 2)
-        # Ok go for it!
-        
         c = self.con
         c.setopt(pycurl.HTTPGET, 0)
         c.setopt(c.POST, 1)
@@ -138,9 +195,17 @@ class HTTPClient(object):
             c.setopt(c.TIMEOUT, self.data_timeout)
         #if proxy:
         #    c.setopt(c.PROXY, proxy)
-        # Pycurl want a list of tuple as args
-        postargs = [(k,v) for (k,v) in args.iteritems()]
-        c.setopt(c.HTTPPOST, postargs)
+        if self.frames:
+            # The other side knows about frames, send them as the body
+            c.setopt(c.POSTFIELDS, wireformat.dumps_args(args))
+            c.setopt(pycurl.HTTPHEADER, self.headers + ['Content-Type: %s' % wireformat.CONTENT_TYPE])
+        else:
+            # Take args, pickle them and then compress the result
+            for (k,v) in args.iteritems():
+                args[k] = zlib.compress(cPickle.dumps(v), 2)
+            # Pycurl want a list of tuple as args
+            postargs = [(k,v) for (k,v) in args.iteritems()]
+            c.setopt(c.HTTPPOST, postargs)
         c.setopt(c.URL, str(self.uri+path))
         # Ok now manage the response
         response = StringIO()
@@ -151,6 +216,8 @@ class HTTPClient(object):
         except pycurl.error, error:
             errno, errstr = error
             raise HTTPException ('Connexion error to %s : %s' % (self.uri, errstr))
+        finally:
+            c.setopt(pycurl.HTTPHEADER, self.headers)
 
         r = c.getinfo(pycurl.HTTP_CODE)
         # Do NOT close the connexion
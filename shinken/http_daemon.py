@@ -47,6 +47,7 @@ except ImportError:
 from wsgiref import simple_server
 
 from log import logger
+from shinken import wireformat
 
 # Let's load bottlecore! :)
 from shinken.webui import bottlecore as bottle
@@ -283,11 +284,16 @@ class HTTPDaemon(object):
                 # remove useless self in args, because we alredy got a bonded method f
                 if 'self' in args:
                     args.remove('self')
+                # Args with a default value can be missing in the query (like
+                # new args not sent by older daemons)
+                default_args = {}
+                if defaults:
+                    default_args = dict(zip(args[-len(defaults):], defaults))
                 print "Registering", fname, args
                 # WARNING : we MUST do a 2 levels function here, or the f_wrapper
                 # will be uniq and so will link to the last function again
                 # and again
-                def register_callback(fname, args, f, obj, lock):
+                def register_callback(fname, args, default_args, f, obj, lock):
                     def f_wrapper():
                         need_lock = getattr(f, 'need_lock', True)
                         
@@ -295,9 +301,15 @@ class HTTPDaemon(object):
                         # because outside it will break bottle
                         d = {}
                         method = getattr(f, 'method', 'get').lower()
+                        # Post args can come as binary frames from new daemons
+                        framed_args = None
+                        if method == 'post' and wireformat.CONTENT_TYPE in bottle.request.headers.get('Content-Type', ''):
+                            framed_args = wireformat.loads_args(bottle.request.body.read())
                         for aname in args:
                             v = None
-                            if method == 'post':
+                            if framed_args is not None:
+                                v = framed_args.get(aname, None)
+                            elif method == 'post':
                                 v = bottle.request.forms.get(aname, None)
                                 # Post args are zlibed and cPickled
                                 if v is not None:
@@ -306,24 +318,41 @@ class HTTPDaemon(object):
                             elif method == 'get':
                                 v = bottle.request.GET.get(aname, None)
                             if v is None:
-                                raise Exception('Missing argument %s' % aname)
+                                if aname not in default_args:
+                                    raise Exception('Missing argument %s' % aname)
+                                v = default_args[aname]
                             d[aname] = v
                         if need_lock:
                             logger.debug("HTTP: calling lock for %s" % fname)
                             lock.acquire()
 
-                        ret = f(**d)
-
-                        # Ok now we can release the lock
-                        if need_lock:
-                            lock.release()
-
-                        encode = getattr(f, 'encode', 'json').lower()
-                        j = json.dumps(ret)
+                        try:
+                            ret = f(**d)
+
+                            # Python objects are dumped while we still got the lock,
+                            # because they can be still used by the daemon (like checks).
+                            # Daemons that ask for it get binary frames, the older
+                            # ones the json/base64/zlib/cPickle format
+                            encode = getattr(f, 'encode', 'json').lower()
+                            if encode == 'pickle':
+                                if wireformat.CONTENT_TYPE in bottle.request.headers.get('Accept', ''):
+                                    bottle.response.content_type = wireformat.CONTENT_TYPE
+                                    j = wireformat.dumps(ret)
+                                else:
+                                    j = wireformat.dumps_legacy(ret)
+                            else:
+                                j = json.dumps(ret)
+                        finally:
+                            # Ok now we can release the lock
+                            if need_lock:
+                                lock.release()
+
+                        # Tell the clients we know about frames, so they can post with them
+                        bottle.response.set_header(wireformat.HEADER, '1')
                         return j
                     # Ok now really put the route in place
                     bottle.route('/'+fname, callback=f_wrapper, method=getattr(f, 'method', 'get').upper())
-                register_callback(fname, args, f, obj, self.lock)
+                register_callback(fname, args, default_args, f, obj, self.lock)
 
             # Add a simple / page
             def slash():
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The launcher is a small process that launch the plugins for a worker.
+
+A worker is a big python process, and forking it for each plugin (with
+close_fds on all the possible fds) cost a lot. So the worker start this
+file as a script (python -S, so nothing more than the modules here are
+loaded), send it the commands to launch, and the launcher give back the
+exit status, the outputs and the rusage of each plugin.
+
+Messages are marshal dumps, prefixed by their length:
+ * worker -> launcher: (id, argv, env, timeout, max_output_length), env
+   is only the variables to add to the launcher environment, and only
+   the first max_output_length chars of the outputs are given back
+ * launcher -> worker: (id, status, exit_status, stdout, stderr,
+   execution_time, u_time, s_time), status is 'done' or 'timeout'
+
+This file must only import modules of the standard library: it's
+launched outside of the shinken package.
+"""
+
+import os
+import sys
+import time
+import errno
+import signal
+import select
+import struct
+import marshal
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+HEADER = struct.Struct('!I')
+
+
+def set_non_blocking(fd):
+    fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+
+
+# Read all what is available on a non blocking fd. Return None on EOF
+def read_all(fd):
+    data = []
+    while True:
+        try:
+            s = os.read(fd, 65536)
+        except OSError, exp:
+            if exp.errno in (errno.EAGAIN, errno.EINTR):
+                break
+            s = ''
+        if not s:
+            if not data:
+                return None
+            break
+        data.append(s)
+    return ''.join(data)
+
+
+class OutputBuffer(object):
+    """An output of a plugin. We keep only its first max_length chars,
+    the output is cut after them anyway. The rest is still read (so the
+    plugin do not block on a full pipe) but dropped.
+    """
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self.data = bytearray()
+
+    def write(self, s):
+        room = self.max_length - len(self.data)
+        if room > 0:
+            if len(s) > room:
+                s = s[:room]
+            self.data.extend(s)
+
+    def getvalue(self):
+        return str(self.data)
+
+
+# Read all what is available on a non blocking fd in an OutputBuffer.
+# Return False on EOF
+def read_output(fd, buf):
+    while True:
+        try:
+            s = os.read(fd, 65536)
+        except OSError, exp:
+            if exp.errno in (errno.EAGAIN, errno.EINTR):
+                return True
+            return False
+        if not s:
+            return False
+        buf.write(s)
+
+
+# Cut the complete messages from buf, return them and the rest
+def get_messages(buf):
+    res = []
+    pos = 0
+    while len(buf) - pos >= HEADER.size:
+        size = HEADER.unpack_from(buf, pos)[0]
+        if len(buf) - pos - HEADER.size < size:
+            break
+        pos += HEADER.size
+        res.append(marshal.loads(buf[pos:pos + size]))
+        pos += size
+    return res, buf[pos:]
+
+
+def make_message(value):
+    data = marshal.dumps(value)
+    return HEADER.pack(len(data)) + data
+
+
+class Launcher(object):
+    """The worker side: start the launcher process, give it the
+    actions and get back their results.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.fd = None
+        self.buf = ''
+        # launcher id -> action
+        self.actions = {}
+        self.next_id = 0
+
+    def start(self):
+        # The subprocess module is only needed here, not in the launcher
+        import subprocess
+        path = os.path.abspath(__file__)
+        self.process = subprocess.Popen([sys.executable, '-S', path],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        close_fds=True)
+        self.fd = self.process.stdout.fileno()
+        set_non_blocking(self.fd)
+
+    # The fd to wait for the results
+    def get_fd(self):
+        return self.fd
+
+    # Send an action to launch. Raise IOError if the launcher is dead
+    def launch(self, action, argv, env, timeout, max_output_length=8192):
+        self.next_id += 1
+        self.actions[self.next_id] = action
+        self.process.stdin.write(make_message((self.next_id, argv, env, timeout, max_output_length)))
+        self.process.stdin.flush()
+
+    # Get the (action, result) that are ready. Return None if
+    # the launcher is dead
+    def read(self):
+        data = read_all(self.fd)
+        if data is None:
+            return None
+        res, self.buf = get_messages(self.buf + data)
+        return [(self.actions.pop(r[0]), r[1:]) for r in res]
+
+    # Give back the actions we did not finish
+    def stop(self):
+        actions = self.actions.values()
+        self.actions = {}
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        self.process.wait()
+        return actions
+
+
+class Plugin(object):
+    """A plugin launched by the launcher process"""
+
+    def __init__(self, id, pid, out, err, timeout, max_output_length):
+        self.id = id
+        self.pid = pid
+        self.outs = {out: OutputBuffer(max_output_length), err: OutputBuffer(max_output_length)}
+        self.out = out
+        self.err = err
+        self.t0 = time.time()
+        self.deadline = self.t0 + timeout
+        self.status = 'done'
+
+    def read(self, fd):
+        return read_output(fd, self.outs[fd])
+
+    # The process exited: we take what its outputs got now (some of
+    # its sons may keep them, we do not wait for them)
+    def get_result(self, exit_status, rusage):
+        for fd in self.outs:
+            self.read(fd)
+            os.close(fd)
+        if os.WIFSIGNALED(exit_status):
+            exit_status = -os.WTERMSIG(exit_status)
+        else:
+            exit_status = os.WEXITSTATUS(exit_status)
+        return (self.id, self.status, exit_status, self.outs[self.out].getvalue(),
+                self.outs[self.err].getvalue(), time.time() - self.t0,
+                rusage.ru_utime, rusage.ru_stime)
+
+
+class LauncherServer(object):
+    """The launcher process side"""
+
+    def __init__(self, inp, out):
+        self.inp = inp
+        self.out = out
+        self.buf = ''
+        self.to_send = ''
+        # pid -> Plugin
+        self.plugins = {}
+        # fd -> Plugin
+        self.fds = {}
+        self.poller = select.poll()
+
+    # Fork and exec a plugin, in its own process group so we can kill
+    # all its sons on timeout
+    def spawn(self, id, argv, env_delta, timeout, max_output_length):
+        env = os.environ.copy()
+        env.update(env_delta)
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        max_fd = max([out_r, out_w, err_r, err_w, self.sigchld_r, self.sigchld_w] + self.fds.keys())
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.setsid()
+                null = os.open(os.devnull, os.O_RDONLY)
+                os.dup2(null, 0)
+                os.dup2(out_w, 1)
+                os.dup2(err_w, 2)
+                # We only got a few fds, it's cheap
+                os.closerange(3, max_fd + 1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                try:
+                    os.execvpe(argv[0], argv, env)
+                except OSError, exp:
+                    # Maybe it's just a shell script without #!
+                    if exp.errno != errno.ENOEXEC:
+                        raise
+                    os.execvpe('/bin/sh', ['/bin/sh'] + argv, env)
+            except OSError, exp:
+                os.write(1, str(exp))
+            os._exit(2)
+        os.close(out_w)
+        os.close(err_w)
+        p = Plugin(id, pid, out_r, err_r, timeout, max_output_length)
+        self.plugins[pid] = p
+        for fd in (out_r, err_r):
+            set_non_blocking(fd)
+            self.fds[fd] = p
+            self.poller.register(fd, select.POLLIN)
+
+    def send(self, value):
+        self.to_send += make_message(value)
+
+    # Take all the plugins that exited
+    def reap(self):
+        while self.plugins:
+            try:
+                pid, exit_status, rusage = os.wait4(-1, os.WNOHANG)
+            except OSError, exp:
+                if exp.errno == errno.EINTR:
+                    continue
+                break
+            if pid == 0:
+                break
+            p = self.plugins.pop(pid, None)
+            if p is None:
+                continue
+            for fd in p.outs:
+                if fd in self.fds:
+                    del self.fds[fd]
+                    self.poller.unregister(fd)
+            self.send(p.get_result(exit_status, rusage))
+
+    def run(self):
+        set_non_blocking(self.inp)
+        set_non_blocking(self.out)
+        self.sigchld_r, self.sigchld_w = os.pipe()
+        set_non_blocking(self.sigchld_r)
+        set_non_blocking(self.sigchld_w)
+        signal.set_wakeup_fd(self.sigchld_w)
+        signal.signal(signal.SIGCHLD, lambda sig, frame: None)
+        signal.siginterrupt(signal.SIGCHLD, False)
+        self.poller.register(self.inp, select.POLLIN)
+        self.poller.register(self.sigchld_r, select.POLLIN)
+        out_registered = False
+
+        while True:
+            now = time.time()
+            timeout = 1.0
+            for p in self.plugins.itervalues():
+                if p.status == 'done':
+                    timeout = min(timeout, p.deadline - now)
+            if self.to_send and not out_registered:
+                self.poller.register(self.out, select.POLLOUT)
+                out_registered = True
+            try:
+                events = self.poller.poll(max(timeout, 0) * 1000)
+            except select.error, exp:
+                if exp.args[0] != errno.EINTR:
+                    raise
+                events = []
+
+            for fd, ev in events:
+                if fd == self.inp:
+                    data = read_all(fd)
+                    # The worker is gone, so do we
+                    if data is None:
+                        for pid in self.plugins:
+                            try:
+                                os.killpg(pid, signal.SIGKILL)
+                            except OSError:
+                                pass
+                        return
+                    msgs, self.buf = get_messages(self.buf + data)
+                    for (id, argv, env, timeout, max_output_length) in msgs:
+                        self.spawn(id, argv, env, timeout, max_output_length)
+                elif fd == self.sigchld_r:
+                    read_all(fd)
+                elif fd == self.out:
+                    try:
+                        n = os.write(fd, self.to_send)
+                        self.to_send = self.to_send[n:]
+                    except OSError, exp:
+                        if exp.errno not in (errno.EAGAIN, errno.EINTR):
+                            return
+                    if not self.to_send:
+                        self.poller.unregister(fd)
+                        out_registered = False
+                else:
+                    p = self.fds.get(fd)
+                    if p is not None and not p.read(fd):
+                        del self.fds[fd]
+                        self.poller.unregister(fd)
+
+            self.reap()
+
+            now = time.time()
+            for p in self.plugins.itervalues():
+                if p.status == 'done' and now > p.deadline:
+                    p.status = 'timeout'
+                    try:
+                        os.killpg(p.pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+
+
+if __name__ == '__main__':
+    LauncherServer(sys.stdin.fileno(), sys.stdout.fileno()).run()
@@ -37,6 +37,59 @@ import time
 from shinken.borg import Borg
 
 
+class MacroTemplate(object):
+    """A string with macros, cut once in literal parts and macro slots.
+    Resolve it is just get the values of the slots and join all.
+    """
+
+    def __init__(self, s):
+        # literals[i] is before macros[i], the last one is after all
+        self.literals = []
+        self.macros = []
+        # A $$ means we want a $, it's not a macro, and a $ without
+        # its closing one is not a macro too
+        parts = s.split('$')
+        literal = [parts[0]]
+        for i in xrange(1, len(parts), 2):
+            macro = parts[i]
+            if i + 1 == len(parts):
+                literal.append('$' + macro)
+            elif macro == '':
+                literal.append('$')
+                literal.append(parts[i + 1])
+            else:
+                self.literals.append(''.join(literal))
+                self.macros.append(macro)
+                literal = [parts[i + 1]]
+        self.literals.append(''.join(literal))
+        self.kinds = [get_type_of_macro(macro) for macro in self.macros]
+        # classes of the data -> getters of our macros for these data
+        self.getters = {}
+
+
+# ARGN -> ('ARGN', N-1)
+# _HOSTTOTO -> ('CUSTOM', 'HOST', '_TOTO'), HOST CUSTOM MACRO TOTO
+# $SERVICESTATEID:srv-1:Load$ -> ('ONDEMAND', ) MACRO SERVICESTATEID of
+# the service Load of host srv-1
+# HOSTBLABLA -> ('class', ), we look for it in the data classes
+def get_type_of_macro(macro):
+    # ARGN Macros
+    if re.match('ARG\d', macro):
+        return ('ARGN', int(re.search('ARG(?P<id>\d+)', macro).group('id')) - 1)
+    # USERN macros
+    # are managed in the Config class, so no
+    # need to look that here
+    for cls_type in ('HOST', 'SERVICE', 'CONTACT'):
+        if re.match('_%s\w' % cls_type, macro):
+            # Beware : only cut the first _HOST value, so the macro name can have it on it...
+            return ('CUSTOM', cls_type, '_' + re.split('_' + cls_type, macro, 1)[1].upper())
+    # On demand macro
+    if ':' in macro:
+        return ('ONDEMAND', )
+    # OK, classical macro...
+    return ('class', )
+
+
 class MacroResolver(Borg):
     """Please Add a Docstring to describe the class here"""
 
@@ -46,7 +99,7 @@ class MacroResolver(Borg):
         'TOTALHOSTSUP':         '_get_total_hosts_up',
         'TOTALHOSTSDOWN':       '_get_total_hosts_down',
         'TOTALHOSTSUNREACHABLE': '_get_total_hosts_unreachable',
-        'TOTALHOSTSDOWNUNHANDLED': '_get_total_hosts_unhandled',
+        'TOTALHOSTSDOWNUNHANDLED': '_get_total_hosts_down_unhandled',
         'TOTALHOSTSUNREACHABLEUNHANDLED': '_get_total_hosts_unreachable_unhandled',
         'TOTALHOSTPROBLEMS':    '_get_total_host_problems',
         'TOTALHOSTPROBLEMSUNHANDLED': '_get_total_host_problems_unhandled',
@@ -92,32 +145,15 @@ class MacroResolver(Borg):
         self.illegal_macro_output_chars = conf.illegal_macro_output_chars
         self.output_macros = ['HOSTOUTPUT', 'HOSTPERFDATA', 'HOSTACKAUTHOR', 'HOSTACKCOMMENT', 'SERVICEOUTPUT', 'SERVICEPERFDATA', 'SERVICEACKAUTHOR', 'SERVICEACKCOMMENT']
 
-        # Try cache :)
-        #self.cache = {}
-
-
-    # Return all macros of a string, so cut the $
-    # And create a dict with it:
-    # val: value, not set here
-    # type: type of macro, like class one, or ARGN one
-    def _get_macros(self, s):
-        #if s in self.cache:
-        #    return self.cache[s]
-
-        p = re.compile(r'(\$)')
-        elts = p.split(s)
-        macros = {}
-        in_macro = False
-        for elt in elts:
-            if elt == '$':
-                in_macro = not in_macro
-            elif in_macro:
-                macros[elt] = {'val': '', 'type': 'unknown'}
-
-        #self.cache[s] = macros
-        if '' in macros:
-            del macros['']
-        return macros
+        # string -> MacroTemplate, the classes macros can change
+        # with the conf so we start again
+        self.templates = {}
+        # The totals of the global macros, and the name indexes for
+        # the on demand macros, computed when we need them
+        self.totals = None
+        self.totals_time = 0
+        self.ondemand_indexes = None
+
 
     # Get a value from a property of a element
     # Prop can be a function or a property
@@ -149,6 +185,11 @@ class MacroResolver(Borg):
     # the macros of the datas object
     def get_env_macros(self, data):
         env = {}
+        # The global macros, and the USERN ones, like for the commands
+        data = list(data)
+        data.append(self)
+        if hasattr(self, 'conf'):
+            data.append(self.conf)
 
         for o in data:
             cls = o.__class__
@@ -168,88 +209,106 @@ class MacroResolver(Borg):
 
         return env
 
+    # Get the compiled template of a string. We keep the ones of the
+    # commands and properties, but also of some values (like the args),
+    # so we start again if we got too many of them
+    def _get_template(self, s):
+        templates = self.__dict__.setdefault('templates', {})
+        t = templates.get(s)
+        if t is None:
+            if len(templates) > 100000:
+                templates.clear()
+            t = templates[s] = MacroTemplate(s)
+        return t
+
+    # The getters of the macros of a template for data of these classes:
+    # the type of macro, and where we look for its value
+    def _get_getters(self, t, clss):
+        getters = t.getters.get(clss)
+        if getters is not None:
+            return getters
+        getters = []
+        for macro, kind in zip(t.macros, t.kinds):
+            if kind[0] == 'class':
+                # The last element that got this macro give its value
+                for i in xrange(len(clss) - 1, -1, -1):
+                    macros = getattr(clss[i], 'macros', {})
+                    if macro in macros:
+                        getters.append(('class', i, macros[macro], macro in self.output_macros))
+                        break
+                else:
+                    getters.append(('unknown', ))
+            elif kind[0] == 'CUSTOM':
+                # Now we get the elements in data that have the type HOST
+                # and we will check if they got the custom value
+                idxs = [i for (i, cls) in enumerate(clss)
+                        if getattr(cls, 'my_type', '').upper() == kind[1]]
+                getters.append(('CUSTOM', idxs, kind[2]))
+            elif kind[0] == 'ONDEMAND':
+                getters.append(('ONDEMAND', macro))
+            else:
+                getters.append(kind)
+        getters = t.getters[clss] = tuple(getters)
+        return getters
+
+    # Fill the macros of s with values from data. A value can get macros
+    # too, like $USER1$ hiding like a ninja in a $ARG2$ Macro. And if
+    # $USER1$ is pointing to $USER34$ etc etc, we resolve them too, until
+    # we reach the bottom
+    def _resolve_template(self, s, data, clss, args, nb_loop):
+        t = self._get_template(s)
+        if not t.macros:
+            return t.literals[0]
+        res = [t.literals[0]]
+        i = 1
+        for getter in self._get_getters(t, clss):
+            kind = getter[0]
+            val = ''
+            if kind == 'class':
+                val = self._get_value_from_element(data[getter[1]], getter[2])
+                # Now check if we do not have a 'output' macro. If so, we must
+                # delete all special characters that can be dangerous
+                if getter[3]:
+                    val = self._delete_unwanted_caracters(val)
+            elif kind == 'ARGN':
+                if args is not None:
+                    try:
+                        val = args[getter[1]]
+                    except IndexError:
+                        pass
+            elif kind == 'CUSTOM':
+                name = getter[2]
+                for idx in getter[1]:
+                    elt = data[idx]
+                    if name in elt.customs:
+                        val = elt.customs[name]
+                    # Then look on the macromodulations, in reserver order, so
+                    # the last to set, will be the firt to have. (yes, don't want to play
+                    # with break and such things sorry...)
+                    mms = getattr(elt, 'macromodulations', [])
+                    for mm in mms[::-1]:
+                        # Look if the modulation got the value, but also if it's currently active
+                        if name in mm.customs and mm.is_active():
+                            val = mm.customs[name]
+            elif kind == 'ONDEMAND':
+                val = self._resolve_ondemand(getter[1], data)
+            if '$' in val and nb_loop < 32:
+                val = self._resolve_template(val, data, clss, args, nb_loop + 1)
+            res.append(val)
+            res.append(t.literals[i])
+            i += 1
+        return ''.join(res)
+
     # This function will look at elements in data (and args if it filled)
     # to replace the macros in c_line with real value.
     def resolve_simple_macros_in_string(self, c_line, data, args=None):
         # Now we prepare the classes for looking at the class.macros
+        data = list(data)
         data.append(self)  # For getting global MACROS
         if hasattr(self, 'conf'):
             data.append(self.conf)  # For USERN macros
-        clss = [d.__class__ for d in data]
-
-        # we should do some loops for nested macros
-        # like $USER1$ hiding like a ninja in a $ARG2$ Macro. And if
-        # $USER1$ is pointing to $USER34$ etc etc, we should loop
-        # until we reach the bottom. So the last loop is when we do
-        # not still have macros :)
-        still_got_macros = True
-        nb_loop = 0
-        while still_got_macros:
-            nb_loop += 1
-            # Ok, we want the macros in the command line
-            macros = self._get_macros(c_line)
-
-            # We can get out if we do not have macros this loop
-            still_got_macros = (len(macros) != 0)
-            #print "Still go macros:", still_got_macros
-
-            # Put in the macros the type of macro for all macros
-            self._get_type_of_macro(macros, clss)
-            # Now we get values from elements
-            for macro in macros:
-                # If type ARGN, look at ARGN cutting
-                if macros[macro]['type'] == 'ARGN' and args is not None:
-                    macros[macro]['val'] = self._resolve_argn(macro, args)
-                    macros[macro]['type'] = 'resolved'
-                # If class, get value from properties
-                if macros[macro]['type'] == 'class':
-                    cls = macros[macro]['class']
-                    for elt in data:
-                        if elt is not None and elt.__class__ == cls:
-                            prop = cls.macros[macro]
-                            macros[macro]['val'] = self._get_value_from_element(elt, prop)
-                            # Now check if we do not have a 'output' macro. If so, we must
-                            # delete all special characters that can be dangerous
-                            if macro in self.output_macros:
-                                macros[macro]['val'] = self._delete_unwanted_caracters(macros[macro]['val'])
-                if macros[macro]['type'] == 'CUSTOM':
-                    cls_type = macros[macro]['class']
-                    # Beware : only cut the first _HOST value, so the macro name can have it on it...
-                    macro_name = re.split('_' + cls_type, macro, 1)[1].upper()
-                    # Ok, we've got the macro like MAC_ADDRESS for _HOSTMAC_ADDRESS
-                    # Now we get the element in data that have the type HOST
-                    # and we check if it got the custom value
-                    for elt in data:
-                        if elt is not None and elt.__class__.my_type.upper() == cls_type:
-                            if '_' + macro_name in elt.customs:
-                                macros[macro]['val'] = elt.customs['_' + macro_name]
-                            # Then look on the macromodulations, in reserver order, so
-                            # the last to set, will be the firt to have. (yes, don't want to play
-                            # with break and such things sorry...)
-                            mms = getattr(elt, 'macromodulations', [])
-                            for mm in mms[::-1]:
-                                # Look if the modulation got the value, but also if it's currently active
-                                if '_' + macro_name in mm.customs and mm.is_active():
-                                    macros[macro]['val'] = mm.customs['_' + macro_name]
-                if macros[macro]['type'] == 'ONDEMAND':
-                    macros[macro]['val'] = self._resolve_ondemand(macro, data)
-
-            # We resolved all we can, now replace the macro in the command call
-            for macro in macros:
-                c_line = c_line.replace('$'+macro+'$', macros[macro]['val'])
-
-            # A $$ means we want a $, it's not a macro!
-            # We replace $$ by a big dirty thing to be sure to not misinterpret it
-            c_line = c_line.replace("$$", "DOUBLEDOLLAR")
-
-            if nb_loop > 32:  # too much loop, we exit
-                still_got_macros = False
-
-        # We now replace the big dirty token we made by only a simple $
-        c_line = c_line.replace("DOUBLEDOLLAR", "$")
-
-        #print "Retuning c_line", c_line.strip()
-        return c_line.strip()
+        clss = tuple([d.__class__ for d in data])
+        return self._resolve_template(c_line, data, clss, args, 0).strip()
 
     # Resolve a command with macro by looking at data classes.macros
     # And get macro from item properties.
@@ -257,56 +316,26 @@ class MacroResolver(Borg):
         c_line = com.command.command_line
         return self.resolve_simple_macros_in_string(c_line, data, args=com.args)
 
-    # For all Macros in macros, set the type by looking at the
-    # MACRO name (ARGN? -> argn_type,
-    # HOSTBLABLA -> class one and set Host in class)
-    # _HOSTTOTO -> HOST CUSTOM MACRO TOTO
-    # $SERVICESTATEID:srv-1:Load$ -> MACRO SERVICESTATEID of
-    # the service Load of host srv-1
-    def _get_type_of_macro(self, macros, clss):
-        for macro in macros:
-            # ARGN Macros
-            if re.match('ARG\d', macro):
-                macros[macro]['type'] = 'ARGN'
-                continue
-            # USERN macros
-            # are managed in the Config class, so no
-            # need to look that here
-            elif re.match('_HOST\w', macro):
-                macros[macro]['type'] = 'CUSTOM'
-                macros[macro]['class'] = 'HOST'
-                continue
-            elif re.match('_SERVICE\w', macro):
-                macros[macro]['type'] = 'CUSTOM'
-                macros[macro]['class'] = 'SERVICE'
-                # value of macro: re.split('_HOST', '_HOSTMAC_ADDRESS')[1]
-                continue
-            elif re.match('_CONTACT\w', macro):
-                macros[macro]['type'] = 'CUSTOM'
-                macros[macro]['class'] = 'CONTACT'
-                continue
-            # On demand macro
-            elif len(macro.split(':')) > 1:
-                macros[macro]['type'] = 'ONDEMAND'
-                continue
-            # OK, classical macro...
-            for cls in clss:
-                if macro in cls.macros:
-                    macros[macro]['type'] = 'class'
-                    macros[macro]['class'] = cls
-                    continue
-
-    # Resolve MACROS for the ARGN
-    def _resolve_argn(self, macro, args):
-        # first, get the number of args
-        id = None
-        r = re.search('ARG(?P<id>\d+)', macro)
-        if r is not None:
-            id = int(r.group('id')) - 1
-            try:
-                return args[id]
-            except IndexError:
-                return ''
+    # The name -> element dicts of the lists_on_demand, and the
+    # (host_name, service_description) -> service one. Like the
+    # find_by_name functions, the first element with a name win
+    def _get_ondemand_indexes(self):
+        if getattr(self, 'ondemand_indexes', None) is None:
+            by_list = []
+            for list in self.lists_on_demand:
+                name_property = list.__class__.name_property
+                names = {}
+                for i in list:
+                    name = getattr(i, name_property, None)
+                    if name is not None and name not in names:
+                        names[name] = i
+                by_list.append(names)
+            services = {}
+            for s in self.services:
+                if hasattr(s, 'service_description') and hasattr(s, 'host_name'):
+                    services.setdefault((s.host_name, s.service_description), s)
+            self.ondemand_indexes = (by_list, services)
+        return self.ondemand_indexes
 
     # Resolve on-demand macro, quite hard in fact
     def _resolve_ondemand(self, macro, data):
@@ -327,7 +356,7 @@ class MacroResolver(Borg):
                     if elt is not None and elt.__class__ == self.host_class:
                         host_name = elt.host_name
             # Ok now we get service
-            s = self.services.find_srv_by_name_and_hostname(host_name, service_description)
+            s = self._get_ondemand_indexes()[1].get((host_name, service_description))
             if s is not None:
                 cls = s.__class__
                 prop = cls.macros[macro_name]
@@ -344,12 +373,12 @@ class MacroResolver(Borg):
                 for elt in data:
                     if elt is not None and elt.__class__ == self.host_class:
                         elt_name = elt.host_name
-            for list in self.lists_on_demand:
+            for (list, names) in zip(self.lists_on_demand, self._get_ondemand_indexes()[0]):
                 cls = list.inner_class
                 # We search our type by looking at the macro
                 if macro_name in cls.macros:
                     prop = cls.macros[macro_name]
-                    i = list.find_by_name(elt_name)
+                    i = names.get(elt_name)
                     if i is not None:
                         val = self._get_value_from_element(i, prop)
                         # Ok we got our value :)
@@ -382,52 +411,93 @@ class MacroResolver(Borg):
     def _get_timet(self):
         return str(int(time.time()))
 
+    # The hosts and services totals for the global macros. We compute
+    # them all in one pass on the hosts and services, and keep them for
+    # the scheduler tick (the scheduler call reset_totals) or a second
+    def _get_totals(self):
+        now = time.time()
+        if getattr(self, 'totals', None) is not None and 0 <= now - self.totals_time < 1:
+            return self.totals
+        totals = {}
+        for h in self.hosts:
+            state = 'HOST' + h.state
+            totals[state] = totals.get(state, 0) + 1
+            if h.is_problem:
+                totals['HOSTPROBLEMS'] = totals.get('HOSTPROBLEMS', 0) + 1
+            # Unhandled: not acknowledged, and not in a downtime
+            if state in ('HOSTDOWN', 'HOSTUNREACHABLE') and not h.problem_has_been_acknowledged \
+                    and h.scheduled_downtime_depth == 0:
+                key = state + 'UNHANDLED'
+                totals[key] = totals.get(key, 0) + 1
+                totals['HOSTPROBLEMSUNHANDLED'] = totals.get('HOSTPROBLEMSUNHANDLED', 0) + 1
+        for s in self.services:
+            state = 'SERVICE' + s.state
+            totals[state] = totals.get(state, 0) + 1
+            if s.is_problem:
+                totals['SERVICEPROBLEMS'] = totals.get('SERVICEPROBLEMS', 0) + 1
+            # Unhandled: not acknowledged, not in a downtime, and its
+            # host is not the problem
+            if state in ('SERVICEWARNING', 'SERVICECRITICAL', 'SERVICEUNKNOWN') and not s.problem_has_been_acknowledged \
+                    and s.scheduled_downtime_depth == 0 \
+                    and getattr(s.host, 'state', 'UP') not in ('DOWN', 'UNREACHABLE'):
+                key = state + 'UNHANDLED'
+                totals[key] = totals.get(key, 0) + 1
+                totals['SERVICEPROBLEMSUNHANDLED'] = totals.get('SERVICEPROBLEMSUNHANDLED', 0) + 1
+        self.totals = totals
+        self.totals_time = now
+        return totals
+
+    # The states changed, the totals must be computed again
+    def reset_totals(self):
+        self.totals = None
+
     def _get_total_hosts_up(self):
-        return len([h for h in self.hosts if h.state == 'UP'])
+        return self._get_totals().get('HOSTUP', 0)
 
     def _get_total_hosts_down(self):
-        return len([h for h in self.hosts if h.state == 'DOWN'])
+        return self._get_totals().get('HOSTDOWN', 0)
 
     def _get_total_hosts_unreachable(self):
-        return len([h for h in self.hosts if h.state == 'UNREACHABLE'])
+        return self._get_totals().get('HOSTUNREACHABLE', 0)
+
+    def _get_total_hosts_down_unhandled(self):
+        return self._get_totals().get('HOSTDOWNUNHANDLED', 0)
 
-    # TODO
     def _get_total_hosts_unreachable_unhandled(self):
-        return 0
+        return self._get_totals().get('HOSTUNREACHABLEUNHANDLED', 0)
 
-    def _get_total_hosts_problems(self):
-        return len([h for h in self.hosts if h.is_problem])
+    def _get_total_host_problems(self):
+        return self._get_totals().get('HOSTPROBLEMS', 0)
 
-    def _get_total_hosts_problems_unhandled(self):
-        return 0
+    def _get_total_host_problems_unhandled(self):
+        return self._get_totals().get('HOSTPROBLEMSUNHANDLED', 0)
 
     def _get_total_service_ok(self):
-        return len([s for s in self.services if s.state == 'OK'])
+        return self._get_totals().get('SERVICEOK', 0)
 
     def _get_total_services_warning(self):
-        return len([s for s in self.services if s.state == 'WARNING'])
+        return self._get_totals().get('SERVICEWARNING', 0)
 
     def _get_total_services_critical(self):
-        return len([s for s in self.services if s.state == 'CRITICAL'])
+        return self._get_totals().get('SERVICECRITICAL', 0)
 
     def _get_total_services_unknown(self):
-        return len([s for s in self.services if s.state == 'UNKNOWN'])
+        return self._get_totals().get('SERVICEUNKNOWN', 0)
 
-    # TODO
     def _get_total_services_warning_unhandled(self):
-        return 0
+        return self._get_totals().get('SERVICEWARNINGUNHANDLED', 0)
 
     def _get_total_services_critical_unhandled(self):
-        return 0
+        return self._get_totals().get('SERVICECRITICALUNHANDLED', 0)
 
     def _get_total_services_unknown_unhandled(self):
-        return 0
+        return self._get_totals().get('SERVICEUNKNOWNUNHANDLED', 0)
 
     def _get_total_service_problems(self):
-        return len([s for s in self.services if s.is_problem])
+        return self._get_totals().get('SERVICEPROBLEMS', 0)
 
     def _get_total_service_problems_unhandled(self):
-        return 0
+        return self._get_totals().get('SERVICEPROBLEMSUNHANDLED', 0)
 
     def _get_process_start_time(self):
         return 0
@@ -65,8 +65,9 @@ class Notification(Action):
         'contact':             StringProp(default=None),
         '_in_timeout':         BoolProp(default=False),
         'notif_nb':            IntegerProp(default=0),
-        'status':              StringProp(default='scheduled'),
-        't_to_go':             IntegerProp(default=0),
+        # status and t_to_go are properties of Action, so they can't be slots
+        'status':              StringProp(default='scheduled', no_slots=True),
+        't_to_go':             IntegerProp(default=0, no_slots=True),
         'command':             StringProp(default=''),
         'sched_id':            IntegerProp(default=0),
         'timeout':             IntegerProp(default=10),
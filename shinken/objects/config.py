@@ -35,12 +35,12 @@ import string
 import copy
 import os
 import socket
-import itertools
 import time
 import random
 import cPickle
 from StringIO import StringIO
-from multiprocessing import Process, Manager
+import select
+from multiprocessing import Process, Pipe, Pool, cpu_count
 
 from item import Item
 from timeperiod import Timeperiod, Timeperiods
@@ -77,10 +77,130 @@ from shinken.brokerlink import BrokerLink, BrokerLinks
 from shinken.receiverlink import ReceiverLink, ReceiverLinks
 from shinken.pollerlink import PollerLink, PollerLinks
 from shinken.graph import Graph
+from shinken.confstream import ConfStreamWriter, dumps_conf
 from shinken.log import logger, console_logger
 from shinken.property import UnusedProp, BoolProp, IntegerProp, CharProp, StringProp, LogLevelProp
 from shinken.daemon import get_cur_user, get_cur_group
 
+# All the types of objects of the configuration files
+config_types = ['void', 'timeperiod', 'command', 'contactgroup', 'hostgroup',
+                'contact', 'notificationway', 'checkmodulation', 'macromodulation', 'host', 'service', 'servicegroup',
+                'servicedependency', 'hostdependency', 'arbiter', 'scheduler',
+                'reactionner', 'broker', 'receiver', 'poller', 'realm', 'module',
+                'resultmodulation', 'escalation', 'serviceescalation', 'hostescalation',
+                'discoveryrun', 'discoveryrule', 'businessimpactmodulation',
+                'hostextinfo', 'serviceextinfo']
+
+
+# The regexps of the parsing, compiled once
+continuation_line_re = re.compile("\\\s*$")
+leading_spaces_re = re.compile("^\s+")
+end_of_define_re = re.compile("^\s*}\s*$")
+nothing_to_read_re = re.compile("^\s*#|^\s*$|^\s*}")
+define_re = re.compile("^define")
+space_re = re.compile("\s")
+spaces_re = re.compile("[" + string.whitespace + "]+")
+
+
+def cut_line(line):
+    #punct = '"#$%&\'()*+/<=>?@[\\]^`{|}~'
+    tmp = spaces_re.split(line, 1)
+    r = [elt for elt in tmp if elt != '']
+    return r
+
+
+# Cut the buffer of read_config in parts, one by file
+def split_config_buf(buf):
+    return re.split('\n(?=# IMPORTEDFROM=)', buf)
+
+
+# Parse a part of the configuration buffer, and give its global
+# parameters and its objects (dicts of prop/value by type). It's not
+# a Config method so it can be run by a process pool
+def parse_config_part(buf):
+    params = []
+    objectscfg = {}
+    for t in config_types:
+        objectscfg[t] = []
+
+    tmp = []
+    tmp_type = 'void'
+    in_define = False
+    continuation_line = False
+    tmp_line = ''
+    lines = buf.split('\n')
+    for line in lines:
+        if line.startswith("# IMPORTEDFROM="):
+            filefrom = line.split('=')[1]
+            continue
+        # Protect \; to be considered as comments
+        line = line.replace('\;', '__ANTI-VIRG__')
+        line = line.split(';')[0].strip()
+        # Now we removed real comments, replace them with just ;
+        line = line.replace('__ANTI-VIRG__', ';')
+        # A backslash means, there is more to come
+        if continuation_line_re.search(line) is not None:
+            continuation_line = True
+            line = continuation_line_re.sub("", line)
+            line = leading_spaces_re.sub(" ", line)
+            tmp_line += line
+            continue
+        elif continuation_line:
+            # Now the continuation line is complete
+            line = leading_spaces_re.sub("", line)
+            line = tmp_line + line
+            tmp_line = ''
+            continuation_line = False
+        # } alone in a line means stop the object reading
+        if end_of_define_re.search(line) is not None:
+            in_define = False
+
+        if nothing_to_read_re.search(line) is not None:
+            pass
+        # A define must be catch and the type save
+        # The old entry must be save before
+        elif define_re.search(line) is not None:
+            in_define = True
+            if tmp_type not in objectscfg:
+                objectscfg[tmp_type] = []
+            objectscfg[tmp_type].append(tmp)
+            tmp = []
+            tmp.append("imported_from " + filefrom)
+            # Get new type
+            elts = space_re.split(line)
+            # Maybe there was space before and after the type
+            # so we must get all and strip it
+            tmp_type = ' '.join(elts[1:]).strip()
+            tmp_type = tmp_type.split('{')[0].strip()
+        else:
+            if in_define:
+                tmp.append(line)
+            else:
+                params.append(line)
+
+    # Maybe the type of the last element is unknown, declare it
+    if not tmp_type in objectscfg:
+        objectscfg[tmp_type] = []
+
+    objectscfg[tmp_type].append(tmp)
+    objects = {}
+
+    for type in objectscfg:
+        objects[type] = []
+        for items in objectscfg[type]:
+            tmp = {}
+            for line in items:
+                elts = cut_line(line)
+                if elts != []:
+                    prop = elts[0]
+                    value = ' '.join(elts[1:])
+                    tmp[prop] = value
+            if tmp != {}:
+                objects[type].append(tmp)
+
+    return (params, objects)
+
+
 no_longer_used_txt = 'This parameter is not longer take from the main file, but must be defined in the status_dat broker module instead. But Shinken will create you one if there are no present and use this parameter in it, so no worry.'
 not_interresting_txt = 'We do not think such an option is interesting to manage.'
 
@@ -351,6 +471,9 @@ class Config(Item):
     }
 
     read_config_silent = 0
+    # From this size (in chars), the configuration files are parsed
+    # by a process pool
+    parallel_parse_min_size = 1000000
 
     def __init__(self):
         self.params = {}
@@ -366,10 +489,26 @@ class Config(Item):
         self.triggers = Triggers({})
         self.packs_dirs = []
         self.packs = Packs({})
+        # (phase name, time) of the loading
+        self.phases_times = []
 
     def get_name(self):
         return 'global configuration file'
 
+    # Call one of our loading phases (like 'explode') and keep its time,
+    # so we can log where the loading time goes
+    def run_phase(self, name, *args):
+        t0 = time.time()
+        res = getattr(self, name)(*args)
+        self.phases_times.append((name, time.time() - t0))
+        return res
+
+    def log_phases_times(self):
+        total = sum([t for (name, t) in self.phases_times])
+        logger.info("[config] Configuration loaded in %.2fs:" % total)
+        for (name, t) in self.phases_times:
+            logger.info("[config]    %-35s %7.2fs %3d%%" % (name, t, total and 100 * t / total))
+
     # We've got macro in the resource file and we want
     # to update our MACRO dict with it
     def fill_resource_macros_names_macros(self):
@@ -398,10 +537,7 @@ class Config(Item):
                     self.resource_macros_names.append(macro_name)
 
     def _cut_line(self, line):
-        #punct = '"#$%&\'()*+/<=>?@[\\]^`{|}~'
-        tmp = re.split("[" + string.whitespace + "]+", line, 1)
-        r = [elt for elt in tmp if elt != '']
-        return r
+        return cut_line(line)
 
     def read_config(self, files):
         # just a first pass to get the cfg_file and all files in a buf
@@ -507,101 +643,52 @@ class Config(Item):
         return res
 #        self.read_config_buf(res)
 
-    def read_config_buf(self, buf):
-        params = []
-        types = ['void', 'timeperiod', 'command', 'contactgroup', 'hostgroup',
-                 'contact', 'notificationway', 'checkmodulation', 'macromodulation', 'host', 'service', 'servicegroup',
-                 'servicedependency', 'hostdependency', 'arbiter', 'scheduler',
-                 'reactionner', 'broker', 'receiver', 'poller', 'realm', 'module',
-                 'resultmodulation', 'escalation', 'serviceescalation', 'hostescalation',
-                 'discoveryrun', 'discoveryrule', 'businessimpactmodulation',
-                 'hostextinfo', 'serviceextinfo']
-        objectscfg = {}
-        for t in types:
-            objectscfg[t] = []
-
-        tmp = []
-        tmp_type = 'void'
-        in_define = False
-        continuation_line = False
-        tmp_line = ''
-        lines = buf.split('\n')
-        for line in lines:
-            if line.startswith("# IMPORTEDFROM="):
-                filefrom = line.split('=')[1]
-                continue
-            # Protect \; to be considered as comments
-            line = line.replace('\;', '__ANTI-VIRG__')
-            line = line.split(';')[0].strip()
-            # Now we removed real comments, replace them with just ;
-            line = line.replace('__ANTI-VIRG__', ';')
-            # A backslash means, there is more to come
-            if re.search("\\\s*$", line) is not None:
-                continuation_line = True
-                line = re.sub("\\\s*$", "", line)
-                line = re.sub("^\s+", " ", line)
-                tmp_line += line
-                continue
-            elif continuation_line:
-                # Now the continuation line is complete
-                line = re.sub("^\s+", "", line)
-                line = tmp_line + line
-                tmp_line = ''
-                continuation_line = False
-            # } alone in a line means stop the object reading
-            if re.search("^\s*}\s*$", line) is not None:
-                in_define = False
-
-            if re.search("^\s*#|^\s*$|^\s*}", line) is not None:
-                pass
-            # A define must be catch and the type save
-            # The old entry must be save before
-            elif re.search("^define", line) is not None:
-                in_define = True
-                if tmp_type not in objectscfg:
-                    objectscfg[tmp_type] = []
-                objectscfg[tmp_type].append(tmp)
-                tmp = []
-                tmp.append("imported_from " + filefrom)
-                # Get new type
-                elts = re.split('\s', line)
-                # Maybe there was space before and after the type
-                # so we must get all and strip it
-                tmp_type = ' '.join(elts[1:]).strip()
-                tmp_type = tmp_type.split('{')[0].strip()
-            else:
-                if in_define:
-                    tmp.append(line)
-                else:
-                    params.append(line)
-
-        # Maybe the type of the last element is unknown, declare it
-        if not tmp_type in objectscfg:
-            objectscfg[tmp_type] = []
+    def read_config_buf(self, buf, processes=None):
+        # The files are parsed in parallel, by a process pool, if
+        # the configuration is big
+        if processes is None:
+            processes = self.get_parse_processes(buf)
+        parts = split_config_buf(buf)
+        if processes > 1 and len(parts) > 1:
+            logger.info("[config] Parsing %d configuration files with %d processes" % (len(parts), processes))
+            pool = Pool(processes)
+            try:
+                results = pool.map(parse_config_part, parts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [parse_config_part(buf)]
 
-        objectscfg[tmp_type].append(tmp)
+        # Now merge them, in the files order
+        params = []
         objects = {}
+        for t in config_types:
+            objects[t] = []
+        for (part_params, part_objects) in results:
+            params.extend(part_params)
+            for t in part_objects:
+                if t not in objects:
+                    objects[t] = []
+                objects[t].extend(part_objects[t])
 
         #print "Params", params
         self.load_params(params)
         # And then update our MACRO dict
         self.fill_resource_macros_names_macros()
 
-        for type in objectscfg:
-            objects[type] = []
-            for items in objectscfg[type]:
-                tmp = {}
-                for line in items:
-                    elts = self._cut_line(line)
-                    if elts != []:
-                        prop = elts[0]
-                        value = ' '.join(elts[1:])
-                        tmp[prop] = value
-                if tmp != {}:
-                    objects[type].append(tmp)
-
         return objects
 
+    # The number of processes to parse the configuration files. It's
+    # only worth for the big configurations
+    def get_parse_processes(self, buf):
+        if len(buf) < self.__class__.parallel_parse_min_size:
+            return 1
+        try:
+            return cpu_count()
+        except NotImplementedError:
+            return 1
+
     # We need to have some ghost objects like
     # the check_command bp_rule for business
     # correlator rules
@@ -824,6 +911,8 @@ class Config(Item):
         # There are two ways of configuration serializing
         # One if to use the serial way, the other is with use_multiprocesses_serializer
         # to call to sub-wrokers to do the job.
+        # The configurations are chunks of a ConfStreamWriter, so we keep
+        # them compressed, and the sub-process send them as they are done
         # TODO : enable on windows? I'm not sure it will work, must give a test
         if os.name == 'nt' or not self.use_multiprocesses_serializer:
             logger.info('Using the default serialization pass')
@@ -832,94 +921,97 @@ class Config(Item):
                     # Remember to protect the local conf hostgroups too!
                     conf.hostgroups.prepare_for_sending()
                     logger.debug('[%s] Serializing the configuration %d' % (r.get_name(), i))
-                    t0 = time.time()
-                    r.serialized_confs[i] = cPickle.dumps(conf, cPickle.HIGHEST_PROTOCOL)
-                    logger.debug("[config] time to serialize the conf %s:%s is %s" % (r.get_name(), i, time.time() - t0))
-                    logger.debug("PICKLE LEN : %d" % len(r.serialized_confs[i]))
+                    (r.serialized_confs[i], w) = dumps_conf(conf)
+                    self.log_conf_stream_stats(r.get_name(), i, w.nb_objects, w.nb_chunks, w.size, w.raw_size, w.encode_time)
             # Now pickle the whole conf, for easy and quick spare send
             t0 = time.time()
             whole_conf_pack = cPickle.dumps(self, cPickle.HIGHEST_PROTOCOL)
             logger.debug("[config] time to serialize the global conf : %s" % (time.time() - t0))
             self.whole_conf_pack = whole_conf_pack
             print "TOTAL serializing in", time.time() - t1
-    
+
         else:
-            logger.info('Using the multiprocessing serialization pass')            
+            logger.info('Using the multiprocessing serialization pass')
             t1 = time.time()
-            
-            # We ask a manager to manage the communication with our children
-            m = Manager()
-            # The list will got all the strings from the children
-            q = m.list()
+
             for r in self.realms:
                 processes = []
                 for (i, conf) in r.confs.iteritems():
-                    # This function will be called by the children, and will give
-                    # us the pickle result
-                    def Serialize_config(q, rname, i, conf):
+                    # This function will be called by the children, and will send
+                    # us the chunks, then an empty one and the stats
+                    def Serialize_config(w_conn, rname, i, conf):
                         # Remember to protect the local conf hostgroups too!
                         conf.hostgroups.prepare_for_sending()
                         logger.debug('[%s] Serializing the configuration %d' % (rname, i))
-                        t0 = time.time()
-                        res = cPickle.dumps(conf, cPickle.HIGHEST_PROTOCOL)
-                        logger.debug("[config] time to serialize the conf %s:%s is %s" % (rname, i, time.time() - t0))
-                        q.append((i, res))
+                        w = ConfStreamWriter(conf)
+                        for chunk in w.chunks():
+                            w_conn.send_bytes(chunk)
+                        w_conn.send_bytes('')
+                        w_conn.send((w.nb_objects, w.nb_chunks, w.size, w.raw_size, w.encode_time))
+                        w_conn.close()
 
                     # Prepare a sub-process that will manage the pickle computation
-                    p = Process(target=Serialize_config, name="serializer-%s-%d" %(r.get_name(), i) , args=(q, r.get_name(), i, conf))
+                    (r_conn, w_conn) = Pipe(duplex=False)
+                    p = Process(target=Serialize_config, name="serializer-%s-%d" % (r.get_name(), i), args=(w_conn, r.get_name(), i, conf))
                     p.start()
-                    processes.append( (i, p) )
+                    # Only the child writes in it
+                    w_conn.close()
+                    processes.append((i, p, r_conn))
+                    r.serialized_confs[i] = []
 
-                # Here all sub-processes are launched for this realm, now wait for them to finish
+                # Here all sub-processes are launched for this realm, now read
+                # their chunks as soon as they come, so they are not blocked
                 while len(processes) != 0:
-                    to_del = []
-                    for (i, p) in processes:
-                        if p.exitcode is not None:
-                            to_del.append((i, p))
-                            # remember to join() so the children can die
-                            p.join()
-                    for (i, p) in to_del:
+                    ready = select.select([r_conn for (i, p, r_conn) in processes], [], [], 1)[0]
+                    for (i, p, r_conn) in [e for e in processes if e[2] in ready]:
+                        try:
+                            chunk = r_conn.recv_bytes()
+                            if chunk != '':
+                                r.serialized_confs[i].append(chunk)
+                                continue
+                            stats = r_conn.recv()
+                        except EOFError:
+                            # Maybe one of the children got problems?
+                            logger.error("Something goes wrong in the configuration serializations, please restart Shinken Arbiter")
+                            sys.exit(2)
+                        self.log_conf_stream_stats(r.get_name(), i, *stats)
+                        # remember to join() so the children can die
+                        r_conn.close()
+                        p.join()
                         logger.debug("The sub process %s is done with the return code %d" % (p.name, p.exitcode))
-                        processes.remove( (i, p ) )
-                    # Don't be too quick to poll!
-                    time.sleep(0.1)
-                    
-                # Check if we got the good number of configuration, maybe one of the cildren got problems?
-                if len(q) != len(r.confs):
-                    logger.error("Something goes wrong in the configuration serializations, please restart Shinken Arbiter")
-                    sys.exit(2)
-                # Now get the serialized configuration and saved them into self
-                for (i, cfg) in q:
-                    r.serialized_confs[i] = cfg
+                        processes.remove((i, p, r_conn))
             print "TOTAL TIME", time.time() - t1
 
             # Now pickle the whole configuration into one big pickle object, for the arbiter spares
-            whole_queue = m.list()
             t0 = time.time()
             # The function that just compute the whole conf pickle string, but n a children
-            def create_whole_conf_pack(whole_queue, self):
+            def create_whole_conf_pack(w_conn, self):
                 logger.debug("[config] sub processing the whole configuration pack creation")
-                whole_queue.append(cPickle.dumps(self, cPickle.HIGHEST_PROTOCOL))
+                w_conn.send_bytes(cPickle.dumps(self, cPickle.HIGHEST_PROTOCOL))
+                w_conn.close()
                 logger.debug("[config] sub processing the whole configuration pack creation finished")
             # Go for it
-            p = Process(target=create_whole_conf_pack, args=(whole_queue, self), name='serializer-whole-configuration')
+            (r_conn, w_conn) = Pipe(duplex=False)
+            p = Process(target=create_whole_conf_pack, args=(w_conn, self), name='serializer-whole-configuration')
             p.start()
-            # Wait for it to die
-            while p.exitcode is None:
-                time.sleep(0.1)
-            p.join()
+            w_conn.close()
             # Maybe we don't have our result?
-            if len(whole_queue) != 1:
+            try:
+                self.whole_conf_pack = r_conn.recv_bytes()
+            except EOFError:
                 logger.error("Something goes wrong in the whole configuration pack creation, please restart Shinken Arbiter")
                 sys.exit(2)
-                
-            #Get it and save it
-            self.whole_conf_pack = whole_queue.pop()
+            r_conn.close()
+            # Wait for it to die
+            p.join()
             logger.debug("[config] time to serialize the global conf : %s" % (time.time() - t0))
 
-            print "TOTAL serializing iin", time.time() - t2
-            # Shutdown the manager, the sub-process should be gone now
-            m.shutdown()
+            print "TOTAL serializing in", time.time() - t1
+
+    # Say what the configurations for the schedulers cost
+    def log_conf_stream_stats(self, rname, i, nb_objects, nb_chunks, size, raw_size, encode_time):
+        logger.info("[%s] Configuration %d serialized: %d objects in %d chunks, %d bytes (%d uncompressed) in %.2fs" %
+                    (rname, i, nb_objects, nb_chunks, size, raw_size, encode_time))
 
 
     def dump(self):
@@ -1565,7 +1657,8 @@ class Config(Item):
     # We will compute simple element md5hash, so we can know
     # if they changed or not between the restart
     def compute_hash(self):
-        self.hosts.compute_hash()
+        for (cls, clss, prop) in self.__class__.types_creations.values():
+            getattr(self, prop).compute_hash()
         self.contacts.pythonize()
         self.notificationways.pythonize()
         self.checkmodulations.pythonize()
@@ -1650,10 +1743,10 @@ class Config(Item):
 
 
         # Now we create links in the graph. With links (set)
-        # We are sure to call the less add_edge
+        # We are sure to call the less add_edge. The packs do not
+        # care about the direction of the links
         for (dep, h) in links:
             g.add_edge(dep, h)
-            g.add_edge(h, dep)
 
         # Access_list from a node il all nodes that are connected
         # with it: it's a list of ours mini_packs
@@ -1695,9 +1788,10 @@ class Config(Item):
                         err = '    Impacted host: %s ' % h.get_name()
                         self.add_error(err)
 
-        # The load balancing is for a loop, so all
-        # hosts of a realm (in a pack) will be dispatch
-        # in the schedulers of this realm
+        # The load balancing is done with the load of the packs: the
+        # checks by second of their hosts and services (with dependencies
+        # and business rules), so the schedulers get a load that match
+        # their weight
         # REF: doc/pack-agregation.png
 
         # Count the numbers of elements in all the realms, to compare it the total number of hosts
@@ -1705,11 +1799,6 @@ class Config(Item):
         for r in self.realms:
             #print "Load balancing realm", r.get_name()
             packs = {}
-            # create roundrobin iterator for id of cfg
-            # So dispatching is loadbalanced in a realm
-            # but add a entry in the roundrobin tourniquet for
-            # every weight point schedulers (so Weight round robin)
-            weight_list = []
             no_spare_schedulers = [s for s in r.schedulers if not s.spare]
             nb_schedulers = len(no_spare_schedulers)
 
@@ -1727,21 +1816,27 @@ class Config(Item):
                 err = "The realm %s have hosts but no scheduler!" % r.get_name()
                 self.add_error(err)
                 r.packs = []  # Dumb pack
+                r.packs_loads = {}
+                r.packs_schedulers = {}
                 continue
 
+            # The distribution file gives the schedulers by name, their
+            # ids change with the reloads
             packindex = 0
             packindices = {}
+            scheds = {}
             for s in no_spare_schedulers:
                 packindices[s.id] = packindex
+                scheds[s.get_name()] = s
                 packindex += 1
-                for i in xrange(0, s.weight):
-                    weight_list.append(s.id)
-
-            rr = itertools.cycle(weight_list)
 
-            # We must have nb_schedulers packs
+            # We must have nb_schedulers packs, with their loads
+            loads = {}
+            nb_hosts = {}
             for i in xrange(0, nb_schedulers):
                 packs[i] = []
+                loads[i] = 0.0
+                nb_hosts[i] = 0
 
             # Try to load the history association dict so we will try to
             # send the hosts in the same "pack"
@@ -1756,45 +1851,44 @@ class Config(Item):
                 except Exception, exp:
                     logger.warning('Warning: cannot open the distribution file %s: %s' % (self.pack_distribution_file, str(exp)))
 
+            # The packs that were in a scheduler go in it again, the
+            # others are put after, the biggest first
+            to_place = []
+            for pack in r.packs:
+                old_sched = self.get_pack_old_scheduler(pack, assoc)
+                load = self.get_pack_load(pack)
+                # If it's a valid sub pack and the scheduler really exist, use it!
+                if old_sched in scheds:
+                    self.add_pack_to_scheduler(pack, load, scheds[old_sched], packs, loads, nb_hosts, packindices, assoc)
+                else:
+                    to_place.append((load, pack))
+            to_place.sort(key=lambda e: e[0], reverse=True)
 
             # Now we explode the numerous packs into nb_packs reals packs:
-            # we 'load balance' them in a roundrobin way
-            for pack in r.packs:
-                valid_value = False
-                old_pack = -1
-                for elt in pack:
-                    #print 'Look for host', elt.get_name(), 'in assoc'
-                    old_i = assoc.get(elt.get_name(), -1)
-                    #print 'Founded in ASSOC: ', elt.get_name(),old_i
-                    # Maybe it's a new, if so, don't count it
-                    if old_i == -1:
-                        continue
-                    # Maybe it is the first we look at, if so, take it's value
-                    if old_pack == -1 and old_i != -1:
-                        #print 'First value set', elt.get_name(), old_i
-                        old_pack = old_i
-                        valid_value = True
-                        continue
-                    if old_i == old_pack:
-                        #print 'I found a match between elements', old_i
-                        valid_value = True
-                    if old_i != old_pack:
-                        #print 'Outch found a change sorry', old_i, old_pack
-                        valid_value = False
-                #print 'Is valid?', elt.get_name(), valid_value, old_pack
-                i = None
-                # If it's a valid sub pack and the pack id really exist, use it!
-                if valid_value and old_pack in packindices:
-                    #print 'Use a old id for pack', old_pack, [h.get_name() for h in pack]
-                    i = old_pack
-                else:  # take a new one
-                    #print 'take a new id for pack', [h.get_name() for h in pack]
-                    i = rr.next()
-
-                for elt in pack:
-                    #print 'We got the element', elt.get_full_name(), ' in pack', i, packindices
-                    packs[packindices[i]].append(elt)
-                    assoc[elt.get_name()] = i
+            # each one goes in the scheduler that will have the less load
+            # for its weight (a scheduler with no weight do not get packs
+            # if others can)
+            weighted = [s for s in no_spare_schedulers if s.weight > 0]
+            if not weighted:
+                weighted = no_spare_schedulers
+            for (load, pack) in to_place:
+                best = None
+                for s in weighted:
+                    j = packindices[s.id]
+                    weight = float(max(s.weight, 1))
+                    key = ((loads[j] + load) / weight, (nb_hosts[j] + len(pack)) / weight, j)
+                    if best is None or key < best[0]:
+                        best = (key, s)
+                self.add_pack_to_scheduler(pack, load, best[1], packs, loads, nb_hosts, packindices, assoc)
+
+            # Say the load each scheduler should get
+            r.packs_loads = loads
+            r.packs_schedulers = {}
+            for s in no_spare_schedulers:
+                j = packindices[s.id]
+                r.packs_schedulers[j] = s.get_name()
+                logger.info("[%s] Projected load for the scheduler %s (weight %d): %d hosts, %.2f checks/s"
+                            % (r.get_name(), s.get_name(), s.weight, nb_hosts[j], loads[j]))
 
             try:
                 logger.info('Saving the distribution file %s' % self.pack_distribution_file)
@@ -1819,6 +1913,45 @@ class Config(Item):
                            "been ignored"
                            % (len(self.hosts), nb_elements_all_realms))
 
+    # Give the scheduler name the hosts of the pack were in, from the
+    # distribution file, or None if they were not all in the same one
+    def get_pack_old_scheduler(self, pack, assoc):
+        valid_value = False
+        old_sched = None
+        for elt in pack:
+            old_s = assoc.get(elt.get_name())
+            # Maybe it's a new, if so, don't count it
+            if old_s is None:
+                continue
+            # Maybe it is the first we look at, if so, take it's value
+            if old_sched is None:
+                old_sched = old_s
+                valid_value = True
+                continue
+            if old_s != old_sched:
+                valid_value = False
+        if not valid_value:
+            return None
+        return old_sched
+
+    # The estimated checks by second of a pack: its hosts and their services
+    def get_pack_load(self, pack):
+        load = 0.0
+        for h in pack:
+            load += h.get_checks_load()
+            for s in h.services:
+                load += s.get_checks_load()
+        return load
+
+    # Put the pack in the scheduler s, and remember it in assoc
+    def add_pack_to_scheduler(self, pack, load, s, packs, loads, nb_hosts, packindices, assoc):
+        j = packindices[s.id]
+        loads[j] += load
+        nb_hosts[j] += len(pack)
+        for elt in pack:
+            packs[j].append(elt)
+            assoc[elt.get_name()] = s.get_name()
+
     # Use the self.conf and make nb_parts new confs.
     # nbparts is equal to the number of schedulerlink
     # New confs are independent with checks. The only communication
@@ -1874,6 +2007,9 @@ class Config(Item):
             cur_conf.other_elements = {}
             # if a scheduler have accepted the conf
             cur_conf.is_assigned = False
+            # The load create_packs gave it, and for which scheduler
+            cur_conf.projected_load = 0.0
+            cur_conf.planned_scheduler = ''
 
         logger.info("Creating packs for realms")
 
@@ -1896,8 +2032,13 @@ class Config(Item):
                         self.confs[i+offset].services.append(s)
                 # Now the conf can be link in the realm
                 r.confs[i+offset] = self.confs[i+offset]
+                # The dispatcher will say it, and try to follow it
+                self.confs[i+offset].projected_load = r.packs_loads[i]
+                self.confs[i+offset].planned_scheduler = r.packs_schedulers[i]
             offset += len(r.packs)
             del r.packs
+            del r.packs_loads
+            del r.packs_schedulers
 
         # We've nearly have hosts and services. Now we want REALS hosts (Class)
         # And we want groups too
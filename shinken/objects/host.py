@@ -300,6 +300,15 @@ class Host(SchedulingItem):
         'triggers':  StringProp(default=[]),
     })
 
+    # The links made by the arbiter with the others objects (groups,
+    # dependencies...). They are not in our hash, so a configuration
+    # diff compares them too, and they are the only running properties
+    # a configuration diff changes on an already running host
+    linked_properties = ('hash', 'customs', 'tags', 'triggers', 'hostgroups', 'contacts', 'escalations',
+                         'parents', 'childs', 'services', 'act_depend_of', 'chk_depend_of',
+                         'act_depend_of_me', 'chk_depend_of_me', 'parent_dependencies',
+                         'child_dependencies', 'business_rule', 'got_business_rule')
+
     # Hosts macros and prop that give the information
     # the prop can be callable or not
     macros = {
@@ -1148,13 +1157,7 @@ class Hosts(Items):
             return []
 
         # Ok, we find the tpl. We should find its father template too
-        for t in self.templates.values():
-            t.dfs_loop_status = 'DFS_UNCHECKED'
         all_tpl_searched = self.templates_graph.dfs_get_all_childs(tpl)
-        # Clean the search tag
-        # TODO: better way?
-        for t in self.templates.values():
-            del t.dfs_loop_status
 
         # Now we got all the templates we are looking for (so the template
         # and all its own templates too, we search for the hosts that are
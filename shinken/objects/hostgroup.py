@@ -34,6 +34,10 @@ class Hostgroup(Itemgroup):
     id = 1  # zero is always a little bit special... like in database
     my_type = 'hostgroup'
 
+    # Our members are compared with the hosts groups links, so a new
+    # configuration can change them and still be sent as a diff
+    hash_excluded_properties = Itemgroup.hash_excluded_properties + ('members',)
+
     properties = Itemgroup.properties.copy()
     properties.update({
         'id':             StringProp(default=0, fill_brok=['full_status']),
@@ -28,6 +28,7 @@
 """
 import time
 import cPickle  # for hashing compute
+from cStringIO import StringIO
 
 # Try to import md5 function
 try:
@@ -73,6 +74,10 @@ class Item(object):
     macros = {
     }
 
+    # The attributes that are not in our hash: the id changes between
+    # the runs, and the templates values are already in ours
+    hash_excluded_properties = ('id', 'templates')
+
     def __init__(self, params={}):
         # We have our own id of My Class type :)
         # use set attr for going into the slots
@@ -140,18 +145,25 @@ Like temporary attributes such as "imported_from", etc.. """
 
     def is_tpl(self):
         """ Return if the elements is a template """
-        try:
-            return self.register == '0'
-        except Exception, exp:
-            return False
+        return getattr(self, 'register', '1') == '0'
 
     # If a prop is absent and is not required, put the default value
     def fill_default(self):
         """ Fill missing properties if they are missing """
         cls = self.__class__
+        # The global configuration values are set on the classes (like
+        # use_ssl for the satellites links), they are not ours: else a
+        # reload would not give the same objects than the first load
+        slots = getattr(cls, '__slots__', ())
 
         for prop, entry in cls.properties.items():
-            if not hasattr(self, prop) and entry.has_default:
+            if not entry.has_default:
+                continue
+            if prop in slots:
+                has_value = hasattr(self, prop)
+            else:
+                has_value = prop in self.__dict__
+            if not has_value:
                 setattr(self, prop, entry.default)
 
     # We load every useful parameter so no need to access global conf later
@@ -200,16 +212,25 @@ Like temporary attributes such as "imported_from", etc.. """
     # Compute a hash of this element values. Should be launched
     # When we got all our values, but not linked with other objects
     def compute_hash(self):
-        # ID will always changed between runs, so we remove it
-        # for hash compute
-        i = self.id
-        del self.id
+        # ID will always changed between runs, so it's not in the hash.
+        # The values are sorted so the hash do not depend on the order
+        # we set them. The slots values are only in the state, like for pickle
+        if hasattr(self, '__getstate__'):
+            state = self.__getstate__()
+        else:
+            state = self.__dict__
+        excluded = self.__class__.hash_excluded_properties
+        values = [(k, v) for (k, v) in state.iteritems() if k not in excluded and k != 'hash']
+        values.sort()
+        # No memo in the pickle, so the same values give the same
+        # string, even if they are shared or not between the objects
+        f = StringIO()
+        p = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+        p.fast = 1
+        p.dump(values)
         m = md5()
-        tmp = cPickle.dumps(self, cPickle.HIGHEST_PROTOCOL)
-        m.update(tmp)
+        m.update(f.getvalue())
         self.hash = m.digest()
-        # and put again our id
-        self.id = i
 
     def get_templates(self):
         if hasattr(self, 'use') and self.use != '':
@@ -334,10 +355,9 @@ Like temporary attributes such as "imported_from", etc.. """
 
     def has_plus(self, prop):
         try:
-            self.plus[prop]
-        except:
+            return prop in self.plus
+        except AttributeError:
             return False
-        return True
 
 
     def get_all_plus_and_delete(self):
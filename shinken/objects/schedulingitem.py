@@ -47,6 +47,13 @@ from shinken.log import logger
 # on system time change just reevaluate the following attributes:
 on_time_change_update = ('last_notification', 'last_state_change', 'last_hard_state_change')
 
+# The load of an item for its scheduler, in checks by second, is its checks,
+# but the scheduler must also get its results (even passive ones), resolve
+# its dependencies on problems and compute its business rule
+BASE_LOAD = 1.0 / 3600
+DEPENDENCY_LOAD = 0.1
+BUSINESS_RULE_LOAD = 0.2
+
 
 class SchedulingItem(Item):
 
@@ -476,6 +483,24 @@ class SchedulingItem(Item):
         return checks
 
 
+    # Give the estimated load of the item for its scheduler, in checks by
+    # second. Used by the arbiter to balance the packs between the schedulers
+    def get_checks_load(self):
+        cls = self.__class__
+        load = 0.0
+        if self.active_checks_enabled:
+            interval = self.check_interval
+            # Like in schedule(), the hosts are checked every 5min anyway
+            if interval == 0 and cls.my_type == 'host':
+                interval = 300.0 / cls.interval_length
+            if interval > 0:
+                load = 1.0 / (interval * cls.interval_length)
+        nb_deps = len(self.act_depend_of) + len(self.chk_depend_of)
+        load += load * nb_deps * DEPENDENCY_LOAD
+        if self.got_business_rule:
+            load += load * len(self.business_rule.list_all_elements()) * BUSINESS_RULE_LOAD
+        return BASE_LOAD + load
+
     # Main scheduling function
     # If a check is in progress, or active check are disabled, do
     # not schedule a check.
@@ -274,6 +274,12 @@ class Service(SchedulingItem):
 
     })
 
+    # The links made by the arbiter with the others objects, like
+    # for the hosts
+    linked_properties = ('hash', 'customs', 'tags', 'triggers', 'servicegroups', 'contacts', 'escalations',
+                         'host', 'act_depend_of', 'chk_depend_of', 'act_depend_of_me', 'chk_depend_of_me',
+                         'parent_dependencies', 'child_dependencies', 'business_rule', 'got_business_rule')
+
     # Mapping between Macros and properties (can be prop or a function)
     macros = {
         'SERVICEDESC':            'service_description',
@@ -88,6 +88,7 @@
 import time
 import re
 import string
+import bisect
 
 from item import Item, Items
 
@@ -98,6 +99,42 @@ from shinken.daterange import MonthDayDaterange
 from shinken.brok import Brok
 from shinken.property import IntegerProp, StringProp, ListProp, BoolProp
 from shinken.log import logger, console_logger
+from shinken.util import get_day
+
+
+# The valid intervals of a timeperiod are sorted bounds
+# [start1, end1, start2, end2...]. A time t is valid if start <= t < end,
+# so if the number of bounds <= t is odd (look at bisect_right)
+
+# Give the bounds of the (start, end) intervals, merged
+def merge_intervals(intervals):
+    bounds = []
+    for (start, end) in sorted(intervals):
+        if bounds and start <= bounds[-1]:
+            bounds[-1] = max(bounds[-1], end)
+        else:
+            bounds.extend((start, end))
+    return bounds
+
+
+# Remove the excluded bounds from the bounds
+def substract_intervals(bounds, excluded):
+    res = []
+    j = 0
+    for i in xrange(0, len(bounds), 2):
+        (start, end) = (bounds[i], bounds[i + 1])
+        # Skip the excluded intervals that are before this one
+        while j < len(excluded) and excluded[j + 1] <= start:
+            j += 2
+        k = j
+        while k < len(excluded) and excluded[k] < end:
+            if excluded[k] > start:
+                res.extend((start, excluded[k]))
+            start = max(start, excluded[k + 1])
+            k += 2
+        if start < end:
+            res.extend((start, end))
+    return res
 
 
 class Timeperiod(Item):
@@ -118,6 +155,20 @@ class Timeperiod(Item):
     })
     running_properties = Item.running_properties.copy()
 
+    # We keep the valid intervals of the next 2 months
+    table_horizon = 86400 * 62
+    table = None
+    table_start = 0
+    table_end = 0
+    table_def = None
+    # Our state for the current second of the scheduler: are we active
+    # and the next transition. It's the same between state_start and
+    # state_end, so the items just read it
+    state_start = 0
+    state_end = 0
+    state_active = False
+    state_next = None
+
     def __init__(self, params={}):
         self.id = Timeperiod.id
         Timeperiod.id = Timeperiod.id + 1
@@ -133,8 +184,6 @@ class Timeperiod(Item):
             else:
                 self.unresolved.append(key + ' ' + params[key])
 
-        self.cache = {}  # For tunning purpose only
-        self.invalid_cache = {}  # same but for invalid search
         self.configuration_errors = []
         self.configuration_warnings = []
         # By default the tp is None so we know we just start
@@ -169,7 +218,59 @@ class Timeperiod(Item):
         return r
 
 
+    # The sorted bounds of our valid intervals between t_start and t_end,
+    # without the excluded ones
+    def get_valid_intervals(self, t_start, t_end):
+        intervals = []
+        for dr in self.dateranges:
+            intervals.extend(dr.get_valid_intervals(t_start, t_end))
+        bounds = merge_intervals(intervals)
+        if bounds and self.exclude:
+            excluded = []
+            for tp in self.exclude:
+                b = tp.get_valid_intervals(t_start, t_end)
+                excluded.extend(zip(b[::2], b[1::2]))
+            bounds = substract_intervals(bounds, merge_intervals(excluded))
+        return bounds
+
+    # Compute our table of valid intervals, from yesterday
+    # to the horizon
+    def compute_table(self, now):
+        self.table_start = get_day(now - 86400)
+        self.table_end = self.table_start + self.table_horizon
+        self.table = self.get_valid_intervals(self.table_start, self.table_end)
+        self.table_def = self.get_table_def()
+        # Our state must be computed again too
+        self.state_end = 0
+
+    def get_table_def(self):
+        return (id(self.dateranges), len(self.dateranges), id(self.exclude), len(self.exclude))
+
+    # Compute our table if we do not have it yet, or if our dateranges
+    # or excludes changed since
+    def check_table(self):
+        if self.table is None or self.table_def != self.get_table_def():
+            self.compute_table(time.time())
+
+    # Give the bounds of the valid intervals around t and the time
+    # they stop: our table if t is in it, else the ones of the days
+    # from t for length seconds
+    def get_bounds_from_t(self, t, length):
+        self.check_table()
+        if self.table_start <= t < self.table_end:
+            return (self.table, self.table_end)
+        t_start = get_day(t)
+        t_end = t_start + length
+        return (self.get_valid_intervals(t_start, t_end), t_end)
+
     def is_time_valid(self, t):
+        if self.state_start <= t < self.state_end:
+            return self.state_active
+        self.check_table()
+        if self.table_start <= t < self.table_end:
+            return bisect.bisect_right(self.table, int(t)) % 2 == 1
+
+        # Too far for our table, look at the dateranges
         if self.has('exclude'):
             for dr in self.exclude:
                 if dr.is_time_valid(t):
@@ -190,18 +291,6 @@ class Timeperiod(Item):
     def get_not_in_min_from_t(self, f):
         pass
 
-    def find_next_valid_time_from_cache(self, t):
-        try:
-            return self.cache[t]
-        except KeyError:
-            return None
-
-    def find_next_invalid_time_from_cache(self, t):
-        try:
-            return self.invalid_cache[t]
-        except KeyError:
-            return None
-
     # will look for active/un-active change. And log it
     # [1327392000] TIMEPERIOD TRANSITION: <name>;<from>;<to>
     # from is -1 on startup.  to is 1 if the timeperiod starts
@@ -210,7 +299,8 @@ class Timeperiod(Item):
         now = int(time.time())
 
         was_active = self.is_active
-        self.is_active = self.is_time_valid(now)
+        self.update_state(now)
+        self.is_active = self.state_active
 
         # If we got a change, log it!
         if self.is_active != was_active:
@@ -228,191 +318,82 @@ class Timeperiod(Item):
             console_logger.info('TIMEPERIOD TRANSITION: %s;%d;%d'
                                 % (self.get_name(), _from, _to))
 
-    # clean the get_next_valid_time_from_t cache
-    # The entries are a dict on t. t < now are useless
-    # Because we do not care about past anymore.
-    # If not, it's not important, it's just a cache after all :)
+    # Our table of valid intervals is for the next days. We compute
+    # it again when we are at its middle, so it's always far enough
+    # (and when the time goes back before it)
     def clean_cache(self):
-        now = int(time.time())
-        t_to_del = []
-        for t in self.cache:
-            if t < now:
-                t_to_del.append(t)
-        for t in t_to_del:
-            del self.cache[t]
-
-        # same for the invalid cache
-        t_to_del = []
-        for t in self.invalid_cache:
-            if t < now:
-                t_to_del.append(t)
-        for t in t_to_del:
-            del self.invalid_cache[t]
+        now = time.time()
+        if self.table is not None and (now < self.table_start or now + self.table_horizon / 2 > self.table_end):
+            self.compute_table(now)
+
+    # Compute our state for now: are we active, and until when. It's
+    # computed again only after this next transition (or if we changed)
+    def update_state(self, now):
+        self.check_table()
+        if self.state_start <= now < self.state_end:
+            return
+        now = int(now)
+        # (state_end = 0 so is_time_valid do not look at the old state)
+        self.state_end = 0
+        self.state_active = self.is_time_valid(now)
+        if self.state_active:
+            self.state_next = self.get_next_invalid_time_from_t(now)
+        else:
+            self.state_next = self.get_next_valid_time_from_t(now)
+        self.state_start = now
+        # No transition in the next year
+        if self.state_next is None:
+            self.state_end = now + 86400 * 366
+        else:
+            self.state_end = self.state_next
 
     def get_next_valid_time_from_t(self, t):
-        # first find from cache
+        if self.state_start <= t < self.state_end:
+            if self.state_active:
+                return int(t)
+            return self.state_next
         t = int(t)
-        original_t = t
-
-        #logger.debug("[%s] Check valid time for %s" % ( self.get_name(), time.asctime(time.localtime(t)))
-
-        res_from_cache = self.find_next_valid_time_from_cache(t)
-        if res_from_cache is not None:
-            return res_from_cache
-
-        still_loop = True
-
-        # Loop for all minutes...
-        while still_loop:
-            local_min = None
-
-            # Ok, not in cache...
-            dr_mins = []
-            s_dr_mins = []
-
-            for dr in self.dateranges:
-                dr_mins.append(dr.get_next_valid_time_from_t(t))
-
-            s_dr_mins = sorted([d for d in dr_mins if d is not None])
-
-            for t1 in s_dr_mins:
-                if not self.exclude and still_loop is True:
-                    # No Exclude so we are good
-                    local_min = t1
-                    still_loop = False
-                else:               
-                    for tp in self.exclude:
-                        if not tp.is_time_valid(t1) and still_loop is True:
-                            # OK we found a date that is not valid in any exclude timeperiod 
-                            local_min = t1
-                            still_loop = False
-               
-            if local_min is None:
-                # print "Looking for next valid date"
-                exc_mins = []
-                if s_dr_mins != []:
-                    for tp in self.exclude:
-                        exc_mins.append(tp.get_next_invalid_time_from_t(s_dr_mins[0]))
-
-                s_exc_mins = sorted([d for d in exc_mins if d is not None])
-
-                if s_exc_mins != []:
-                    local_min = s_exc_mins[0] 
-            
-            if local_min is None:
-                still_loop = False
-            else:
-                t = local_min
-                # No loop more than one year
-                if t > original_t + 3600*24*366 + 1:
-                    still_loop = False
-                    local_min = None
-
-        # Ok, we update the cache...
-        self.cache[original_t] = local_min
-        return local_min
+        # No search for more than one year
+        t_max = t + 86400 * 366 + 1
+        length = 86400
+        while t <= t_max:
+            (bounds, t_end) = self.get_bounds_from_t(t, length)
+            i = bisect.bisect_right(bounds, t)
+            # Odd: we are in a valid interval
+            if i % 2 == 1:
+                return t
+            # Even: the next bound is the start of the next valid one
+            if i < len(bounds):
+                if bounds[i] > t_max:
+                    return None
+                return bounds[i]
+            # Look further, quicker and quicker
+            t = t_end
+            length = min(length * 4, 86400 * 366)
+        return None
 
     def get_next_invalid_time_from_t(self, t):
-        #print '\n\n', self.get_name(), 'Search for next invalid from', time.asctime(time.localtime(t)), t
+        if self.state_start <= t < self.state_end:
+            if self.state_active:
+                return self.state_next
+            return int(t)
         t = int(t)
         original_t = t
-        still_loop = True
-
-        # First try to find in cache
-        res_from_cache = self.find_next_invalid_time_from_cache(t)
-        if res_from_cache is not None:
-            return res_from_cache
-
-        # Then look, maybe t is already invalid
-        if not self.is_time_valid(t):
-            return t
-
-        local_min = t
-        res = None
-        # Loop for all minutes...
-        while still_loop:
-            #print "Invalid loop with", time.asctime(time.localtime(local_min))
-
-            dr_mins = []
-            #val_valids = []
-            #val_inval = []
-            # But maybe we can find a better solution with next invalid of standard dateranges
-            #print self.get_name(), "After valid of exclude, local_min =", time.asctime(time.localtime(local_min))
-            for dr in self.dateranges:
-                #print self.get_name(), "Search a next invalid from DR", time.asctime(time.localtime(local_min))
-                #print dr.__dict__
-                m = dr.get_next_invalid_time_from_t(local_min)
-
-                #print self.get_name(), "Dr", dr.__dict__,  "give me next invalid", time.asctime(time.localtime(m))
-                if m is not None:
-                    # But maybe it's invalid for this dr, but valid for other ones.
-                    #if not self.is_time_valid(m):
-                    #     print "Final: Got a next invalid at", time.asctime(time.localtime(m))
-                    dr_mins.append(m)
-                    #if not self.is_time_valid(m):
-                    #    val_inval.append(m)
-                    #else:
-                    #    val_valids.append(m)
-                    #    print "Add a m", time.asctime(time.localtime(m))
-                    #else:
-                    #     print dr.__dict__
-                    #     print "FUCK bad result\n\n\n"
-            #print "Inval"
-            #for v in val_inval:
-            #    print "\t", time.asctime(time.localtime(v))
-            #print "Valid"
-            #for v in val_valids:
-            #    print "\t", time.asctime(time.localtime(v))
-
-            if dr_mins != []:
-                local_min = min(dr_mins)
-                # Take the minimum valid as lower for next search
-                #local_min_valid = 0
-                #if val_valids != []:
-                #    local_min_valid = min(val_valids)
-                #if local_min_valid != 0:
-                #    local_min = local_min_valid
-                #else:
-                #    local_min = min(dr_mins)
-                #print "UPDATE After dr: found invalid local min:", time.asctime(time.localtime(local_min)), "is valid", self.is_time_valid(local_min)
-
-            #print self.get_name(), 'Invalid: local min', local_min #time.asctime(time.localtime(local_min))
-            # We do not loop unless the local_min is not valid
-            if not self.is_time_valid(local_min):
-                still_loop = False
-            else:  # continue until we reach too far..., in one minute
-                # After one month, go quicker...
-                if local_min > original_t + 3600*24*30:
-                    local_min += 3600
-                else:  # else search for 1min precision
-                    local_min += 60
-                # after one year, stop.
-                if local_min > original_t + 3600*24*366 + 1:  # 60*24*366 + 1:
-                    still_loop = False
-            #print "Loop?", still_loop
-            # if we've got a real value, we check it with the exclude
-            if local_min is not None:
-                # Now check if local_min is not valid
-                for tp in self.exclude:
-                    #print self.get_name(),"we check for invalid", time.asctime(time.localtime(local_min)), 'with tp', tp.name
-                    if tp.is_time_valid(local_min):
-                        still_loop = True
-                        # local_min + 60
-                        local_min = tp.get_next_invalid_time_from_t(local_min+60)
-                        # No loop more than one year
-                        if local_min > original_t + 60*24*366 + 1:
-                            still_loop = False
-                            res = None
-
-            if not still_loop:  # We find a possible value
-                # We take the result the minimal possible
-                if res is None or local_min < res:
-                    res = local_min
-
-        #print "Finished Return the next invalid", time.asctime(time.localtime(local_min))
-        # Ok, we update the cache...
-        self.invalid_cache[original_t] = local_min
-        return local_min
+        t_max = t + 86400 * 366 + 1
+        length = 86400
+        while t <= t_max:
+            (bounds, t_end) = self.get_bounds_from_t(t, length)
+            i = bisect.bisect_right(bounds, t)
+            if i % 2 == 0:
+                return t
+            # The valid interval can continue after our bounds
+            if bounds[i] < t_end:
+                return bounds[i]
+            t = t_end
+            length = min(length * 4, 86400 * 366)
+        # Valid for more than one year (like 24x7), so we
+        # say it's in one year and one minute
+        return original_t + 86400 * 366 + 60
 
     def has(self, prop):
         return hasattr(self, prop)
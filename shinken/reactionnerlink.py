@@ -40,6 +40,7 @@ class ReactionnerLink(SatelliteLink):
         'min_workers':      IntegerProp(default='1', fill_brok=['full_status'], to_send=True),
         'max_workers':      IntegerProp(default='30', fill_brok=['full_status'], to_send=True),
         'processes_by_worker': IntegerProp(default='256', fill_brok=['full_status'], to_send=True),
+        'use_launcher': BoolProp(default='0', fill_brok=['full_status'], to_send=True),
         'reactionner_tags':      ListProp(default='None', to_send=True),
     })
 
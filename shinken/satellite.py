@@ -58,8 +58,6 @@ import sys
 import cPickle
 import traceback
 import socket
-import zlib
-import base64
 import threading
 
 from shinken.http_daemon import HTTPDaemon
@@ -172,8 +170,8 @@ class IBroks(Interface):
 
     # poller or reactionner ask us actions
     def get_broks(self, bname):
-        res = self.app.get_broks()
-        return base64.b64encode(zlib.compress(cPickle.dumps(res), 2))
+        return self.app.get_broks()
+    get_broks.encode = 'pickle'
 
 
 class BaseSatellite(Daemon):
@@ -230,6 +228,17 @@ class BaseSatellite(Daemon):
 class Satellite(BaseSatellite):
     """Our main APP class"""
 
+    # Workers autoscaling between min_workers and max_workers:
+    # * we add a worker if a scheduler gave us all the actions we asked
+    #   (it may have others waiting for us), or if the checks are late
+    #   (latency in s) while the workers are busy
+    # * but not if the CPUs are already overloaded (load avg by cpu)
+    # * we remove a worker when the others can do the job since
+    #   worker_shrink_delay seconds
+    worker_max_latency = 5.0
+    worker_max_cpu_load = 2.0
+    worker_shrink_delay = 60
+
     def __init__(self, name, config_file, is_daemon, do_replace, debug, debug_file):
 
         super(Satellite, self).__init__(name, config_file, is_daemon, do_replace,
@@ -253,6 +262,12 @@ class Satellite(BaseSatellite):
 
         self.returns_queue = None
         self.q_by_mod = {}
+        # mod -> [sum of latencies, nb of actions] since the last adjust
+        self.latency_by_mod = {}
+        # mod -> nb of full batches the schedulers gave since the last adjust
+        self.full_batches_by_mod = {}
+        # mod -> since when we got too many workers
+        self.shrink_since = {}
 
 
     
@@ -293,6 +308,7 @@ class Satellite(BaseSatellite):
             logger.info("[%s] The running id of the scheduler %s changed, we must clear its actions"
                         % (self.name, sname))
             sched['wait_homerun'].clear()
+            sched['actions'].clear()
         sched['running_id'] = new_run_id
         logger.info("[%s] Connection OK with scheduler %s" % (self.name, sname))
 
@@ -314,6 +330,18 @@ class Satellite(BaseSatellite):
         # Now we now where to put action, we do not need sched_id anymore
         del action.sched_id
 
+        # The worker got one action less, and look at the check latency
+        # for the workers autoscaling
+        w = self.workers.get(getattr(action, 'worker_id', None))
+        if w is not None:
+            w.nb_actions = max(0, w.nb_actions - 1)
+            t_to_go = getattr(action, 't_to_go', None)
+            check_time = getattr(action, 'check_time', None)
+            if t_to_go and check_time:
+                latency = self.latency_by_mod.setdefault(w.module_name, [0.0, 0])
+                latency[0] += max(0, check_time - t_to_go)
+                latency[1] += 1
+
         # Unset the tag of the worker_id too
         try:
             del action.worker_id
@@ -427,7 +455,8 @@ class Satellite(BaseSatellite):
         # We want to give to the Worker the name of the daemon (poller or reactionner)
         cls_name = self.__class__.__name__.lower()
         w = Worker(1, q, self.returns_queue, self.processes_by_worker, \
-                   mortal=mortal, max_plugins_output_length=self.max_plugins_output_length, target=target, loaded_into=cls_name, http_daemon=self.http_daemon)
+                   mortal=mortal, max_plugins_output_length=self.max_plugins_output_length, target=target, loaded_into=cls_name, http_daemon=self.http_daemon,
+                   use_launcher=self.use_launcher)
         w.module_name = module_name
         # save this worker
         self.workers[w.id] = w
@@ -530,6 +559,7 @@ class Satellite(BaseSatellite):
 
 
     # Here we create new workers if the queue load (len of verifs) is too long
+    # and remove some if they have nothing to do
     def adjust_worker_number_by_load(self):
         to_del = []
         logger.debug("[%s] Trying to adjust worker number."
@@ -538,54 +568,122 @@ class Satellite(BaseSatellite):
 
         # I want at least min_workers by module then if I can, I add worker for load balancing
         for mod in self.q_by_mod:
-            #At least min_workers
-            while len(self.q_by_mod[mod]) < self.min_workers:
-                try:
+            try:
+                #At least min_workers
+                while len(self.q_by_mod[mod]) < self.min_workers:
                     self.create_and_launch_worker(module_name=mod)
-                # Maybe this modules is not a true worker one.
-                # if so, just delete if from q_by_mod
-                except NotWorkerMod:
-                    to_del.append(mod)
-            """
-            # Try to really adjust load if necessary
-            if self.get_max_q_len(mod) > self.max_q_size:
-                if len(self.q_by_mod[mod]) >= self.max_workers:
-                    logger.info("Cannot add a new %s worker, even if load is high. "
-                                "Consider changing your max_worker parameter") % mod
-                else:
-                    try:
-                        self.create_and_launch_worker(module_name=mod)
-                    # Maybe this modules is not a true worker one.
-                    # if so, just delete if from q_by_mod
-                    except NotWorkerMod:
-                        to_del.append(mod)
-            """
+                # Try to really adjust load if necessary
+                self.adjust_module_workers(mod)
+            # Maybe this modules is not a true worker one.
+            # if so, just delete if from q_by_mod
+            except NotWorkerMod:
+                to_del.append(mod)
 
         for mod in to_del:
             logger.debug("[%s] The module %s is not a worker one, "
                          "I remove it from the worker list" % (self.name, mod))
             del self.q_by_mod[mod]
-        # TODO: if len(workers) > 2*wish, maybe we can kill a worker?
+
+        self.stop_retired_workers()
+
+
+    # The load avg by cpu, or 0 if we cannot know it
+    def get_cpu_load(self):
+        try:
+            return os.getloadavg()[0] / cpu_count()
+        # No getloadavg or cpu_count (android)
+        except (AttributeError, NameError, OSError, NotImplementedError):
+            return 0
+
+
+    # Add or retire one worker of this module, from its queues and
+    # the latency of the checks that came back since the last call
+    def adjust_module_workers(self, mod):
+        workers = [self.workers[i] for i in self.q_by_mod[mod] if not self.workers[i].retiring]
+        if not workers:
+            return
+        nb_actions = sum(w.nb_actions for w in workers)
+        # A scheduler gave us as many actions as we can run: it may
+        # keep others for us that our workers cannot take
+        full_batches = self.full_batches_by_mod.pop(mod, 0)
+        busy = float(nb_actions) / (len(workers) * self.processes_by_worker)
+        latency_sum, latency_nb = self.latency_by_mod.pop(mod, (0.0, 0))
+        latency = latency_nb and latency_sum / latency_nb
+
+        if full_batches > 0 or (latency > self.worker_max_latency and busy > 0.5):
+            self.shrink_since.pop(mod, None)
+            if len(workers) >= self.max_workers:
+                logger.debug("[%s] Cannot add a new %s worker, even if load is high. "
+                             "Consider changing your max_workers parameter" % (self.name, mod))
+                return
+            cpu_load = self.get_cpu_load()
+            if cpu_load > self.worker_max_cpu_load:
+                logger.debug("[%s] The CPUs are too loaded (%.2f) for a new %s worker"
+                             % (self.name, cpu_load, mod))
+                return
+            logger.info("[%s] Adding a %s worker (full batches: %d, latency: %.2fs)"
+                        % (self.name, mod, full_batches, latency))
+            self.create_and_launch_worker(module_name=mod)
+            return
+
+        # Can the others do the job, without being more than half busy?
+        if len(workers) <= self.min_workers or \
+                nb_actions > (len(workers) - 1) * self.processes_by_worker / 2:
+            self.shrink_since.pop(mod, None)
+            return
+        now = time.time()
+        since = self.shrink_since.setdefault(mod, now)
+        if now - since < self.worker_shrink_delay:
+            return
+        # It will not get new actions, and we stop it when it gave back
+        # the ones it got
+        w = min(workers, key=lambda w: w.nb_actions)
+        logger.info("[%s] Retiring the %s worker %d" % (self.name, mod, w.id))
+        w.retiring = True
+        del self.shrink_since[mod]
+
+
+    # The retiring workers that finished their actions can go now
+    def stop_retired_workers(self):
+        for w in self.workers.values():
+            if w.retiring and w.nb_actions == 0:
+                logger.info("[%s] Stopping the retired worker %d" % (self.name, w.id))
+                try:
+                    w.terminate()
+                    w.join(timeout=1)
+                # A already dead worker
+                except (AttributeError, AssertionError):
+                    pass
+                # Its queue can go only now, it's still reading it before
+                del self.q_by_mod[w.module_name][w.id]
+                del self.workers[w.id]
 
     # Get the Queue() from an action by looking at which module
-    # it wants with a round robin way to scale the load between
-    # workers
+    # it wants, and the worker of this module that got the less
+    # actions to do, so a worker with slow plugins do not keep the
+    # actions while the others wait for them
     def _got_queue_from_action(self, a):
         # get the module name, if not, take fork
         mod = getattr(a, 'module_type', 'fork')
-        queues = self.q_by_mod[mod].items()
+        queues = self.q_by_mod[mod]
 
         # Maybe there is no more queue, it's very bad!
         if len(queues) == 0:
             return (0, None)
 
-        # if not get a round robin index to get a queue based
-        # on the action id
-        rr_idx = a.id % len(queues)
-        (i, q) = queues[rr_idx]
+        best = None
+        for (i, q) in queues.iteritems():
+            w = self.workers[i]
+            if w.retiring:
+                continue
+            if best is None or w.nb_actions < best[0]:
+                best = (w.nb_actions, i, q)
+        # Only retiring ones? They can still take it
+        if best is None:
+            return queues.items()[0]
 
         # return the id of the worker (i), and its queue
-        return (i, q)
+        return best[1:]
 
 
     # Add a list of actions to our queues
@@ -597,9 +695,21 @@ class Satellite(BaseSatellite):
                 continue
             a.sched_id = sched_id
             a.status = 'queue'
+            # Keep it until it comes back from the worker
+            self.schedulers[sched_id]['actions'][a.id] = a
             self.assign_to_a_queue(a)
 
 
+    # Number of actions we can still take: all our workers slots minus
+    # the actions they are already working on
+    def get_free_slots(self):
+        nb_in_progress = 0
+        for sched in self.schedulers.values():
+            nb_in_progress += len(sched['actions'])
+        nb_workers = len([w for w in self.workers.values() if not w.retiring])
+        return max(0, nb_workers * self.processes_by_worker - nb_in_progress)
+
+
     # Take an action and put it into one queue
     def assign_to_a_queue(self, a):
         msg = Message(id=0, type='Do', data=a)
@@ -608,6 +718,10 @@ class Satellite(BaseSatellite):
         a.worker_id = i
         if q is not None:
             q.put(msg)
+            w = self.workers[i]
+            w.nb_actions += 1
+            # The worker may be waiting for its checks, it must look at its queue
+            w.wake()
 
 
     # We get new actions from schedulers, we create a Message and we
@@ -623,6 +737,10 @@ class Satellite(BaseSatellite):
         do_checks = self.__class__.do_checks
         do_actions = self.__class__.do_actions
 
+        # We do not ask more actions than our workers can run, so the
+        # schedulers can give the others to the other satellites
+        free_slots = self.get_free_slots()
+
         # We check for new check in each schedulers and put the result in new_checks
         for sched_id in self.schedulers:
             sched = self.schedulers[sched_id]
@@ -630,6 +748,11 @@ class Satellite(BaseSatellite):
             if not sched['active']:
                 continue
 
+            # Our workers are full, wait for them
+            if free_slots == 0:
+                logger.debug("[%s] All our workers slots are busy, we do not ask new actions" % self.name)
+                break
+
             try:
                 try:
                     con = sched['con']
@@ -640,16 +763,19 @@ class Satellite(BaseSatellite):
                     # OK, go for it :)
                     # Before ask a call that can be long, do a simple ping to be sure it is alive
                     con.get('ping')
-                    tmp = con.get('get_checks', {'do_checks':do_checks, 'do_actions':do_actions,
+                    tmp = con.get_objects('get_checks', {'do_checks':do_checks, 'do_actions':do_actions,
                                                           'poller_tags':self.poller_tags,
                                                           'reactionner_tags':self.reactionner_tags,
                                                           'worker_name':self.name,
-                                                          'module_types':self.q_by_mod.keys()}, wait='long')
-                    # Explicit pickle load
-                    tmp = base64.b64decode(tmp)
-                    tmp = zlib.decompress(tmp)
-                    tmp = cPickle.loads(str(tmp))
+                                                          'module_types':self.q_by_mod.keys(),
+                                                          'max_actions':free_slots}, wait='long')
                     logger.debug("Ask actions to %d, got %d" % (sched_id, len(tmp)))
+                    # We got all we asked: the modules of these actions
+                    # may need more workers
+                    if tmp and len(tmp) == free_slots:
+                        for mod in set(getattr(a, 'module_type', 'fork') for a in tmp):
+                            self.full_batches_by_mod[mod] = self.full_batches_by_mod.get(mod, 0) + 1
+                    free_slots = max(0, free_slots - len(tmp))
                     # We 'tag' them with sched_id and put into queue for workers
                     # REF: doc/shinken-action-queues.png (2)
                     self.add_actions(tmp, sched_id)
@@ -923,6 +1049,7 @@ class Satellite(BaseSatellite):
         self.poller_tags = g_conf.get('poller_tags', ['None'])
         self.reactionner_tags = g_conf.get('reactionner_tags', ['None'])
         self.max_plugins_output_length = g_conf.get('max_plugins_output_length', 8192)
+        self.use_launcher = g_conf.get('use_launcher', False)
 
         # Set our giving timezone from arbiter
         use_timezone = g_conf['use_timezone']
@@ -32,6 +32,8 @@ import traceback
 import json
 import cPickle
 import zlib
+import bisect
+import threading
 from Queue import Empty
 
 from shinken.external_command import ExternalCommand
@@ -47,6 +49,17 @@ from shinken.log import logger
 from shinken.util import nighty_five_percent
 from shinken.load import Load
 from shinken.http_client import HTTPClient, HTTPExceptions
+from shinken.actionqueue import ActionQueue
+from shinken.macroresolver import MacroResolver
+from shinken.confdiff import ref_types, diff_types, loads_conf_diff, set_diff_state
+from shinken import wireformat
+
+
+# The memory a brok takes in the broks log, it's mostly its serialized data
+def get_brok_size(brok):
+    if isinstance(brok.data, str):
+        return len(brok.data)
+    return 0
 
 
 class Scheduler:
@@ -67,35 +80,39 @@ class Scheduler:
         # The order is important, so make key an int.
         # TODO: at load, change value by configuration one (like reaper time, etc)
         self.recurrent_works = {
-            0: ('update_downtimes_and_comments', self.update_downtimes_and_comments, 1),
-            1: ('schedule', self.schedule, 1), # just schedule
-            2: ('consume_results', self.consume_results, 1), # incorporate checks and dependencies
-            3: ('get_new_actions', self.get_new_actions, 1), # now get the news actions (checks, notif) raised
-            4: ('get_new_broks', self.get_new_broks, 1), # and broks
-            5: ('delete_zombie_checks', self.delete_zombie_checks, 1),
-            6: ('delete_zombie_actions', self.delete_zombie_actions, 1),
+            # First the state of the timeperiods, that all the items will read
+            0: ('update_timeperiods_state', self.update_timeperiods_state, 1),
+            1: ('update_downtimes_and_comments', self.update_downtimes_and_comments, 1),
+            2: ('schedule', self.schedule, 1), # just schedule
+            3: ('consume_results', self.consume_results, 1), # incorporate checks and dependencies
+            4: ('get_new_actions', self.get_new_actions, 1), # now get the news actions (checks, notif) raised
+            5: ('get_new_broks', self.get_new_broks, 1), # and broks
+            6: ('delete_zombie_checks', self.delete_zombie_checks, 1),
+            7: ('delete_zombie_actions', self.delete_zombie_actions, 1),
             # 3: (self.delete_unwanted_notifications, 1),
-            7: ('check_freshness', self.check_freshness, 10),
-            8: ('clean_caches', self.clean_caches, 1),
-            9: ('update_retention_file', self.update_retention_file, 3600),
-            10: ('check_orphaned', self.check_orphaned, 60),
+            8: ('check_freshness', self.check_freshness, 10),
+            9: ('clean_caches', self.clean_caches, 1),
+            10: ('update_retention_file', self.update_retention_file, 3600),
+            11: ('check_orphaned', self.check_orphaned, 60),
             # For NagVis like tools: update our status every 10s
-            11: ('get_and_register_update_program_status_brok', self.get_and_register_update_program_status_brok, 10),
+            12: ('get_and_register_update_program_status_brok', self.get_and_register_update_program_status_brok, 10),
             # Check for system time change. And AFTER get new checks
             # so they are changed too.
-            12: ('check_for_system_time_change', self.sched_daemon.check_for_system_time_change, 1),
+            13: ('check_for_system_time_change', self.sched_daemon.check_for_system_time_change, 1),
             # launch if need all internal checks
-            13: ('manage_internal_checks', self.manage_internal_checks, 1),
+            14: ('manage_internal_checks', self.manage_internal_checks, 1),
             # clean some times possible overridden Queues, to do not explode in memory usage
             # every 1/4 of hour
-            14: ('clean_queues', self.clean_queues, 1),
+            15: ('clean_queues', self.clean_queues, 1),
             # Look for new business_impact change by modulation every minute
-            15: ('update_business_values', self.update_business_values, 60),
+            16: ('update_business_values', self.update_business_values, 60),
             # Reset the topology change flag if need
-            16: ('reset_topology_change_flag', self.reset_topology_change_flag, 1),
-            17: ('check_for_expire_acknowledge', self.check_for_expire_acknowledge, 1),
-            18: ('send_broks_to_modules', self.send_broks_to_modules, 1),
-            19: ('get_objects_from_from_queues', self.get_objects_from_from_queues, 1),
+            17: ('reset_topology_change_flag', self.reset_topology_change_flag, 1),
+            18: ('check_for_expire_acknowledge', self.check_for_expire_acknowledge, 1),
+            19: ('send_broks_to_modules', self.send_broks_to_modules, 1),
+            20: ('get_objects_from_from_queues', self.get_objects_from_from_queues, 1),
+            # Apply the configuration diffs the arbiter sent us
+            21: ('apply_conf_diffs', self.apply_conf_diffs, 1),
         }
 
         # stats part
@@ -104,14 +121,24 @@ class Scheduler:
         self.nb_broks_send = 0
         self.nb_check_received = 0
 
+        # Pollers and reactionners that ask us actions, with the number
+        # of actions we gave them. It's used to share the due actions
+        # between the satellites of the same tags
+        self.dispatch_by_worker = {'checks': {}, 'actions': {}}
+        # A satellite that did not ask us anything since this time (in s)
+        # is no more taken into account for the sharing
+        self.dispatch_fairness_window = 10
+
         # Log init
         logger.load_obj(self)
 
         self.instance_id = 0  # Temporary set. Will be erase later
 
-        # Ours queues
-        self.checks = {}
-        self.actions = {}
+        # Ours queues. Checks and actions are indexed by status and
+        # tags, so we do not have to loop over all of them to find
+        # the ones we want
+        self.checks = ActionQueue('poller_tag')
+        self.actions = ActionQueue('reactionner_tag')
         self.downtimes = {}
         self.contact_downtimes = {}
         self.comments = {}
@@ -127,15 +154,48 @@ class Scheduler:
 
         # Now fake initialize for our satellites
         self.brokers = {}
+        # The broks for all brokers are in one log of (seq, brok, size), each
+        # broker only remember the last seq it acknowledged. Only the broks
+        # for one broker (like initial ones) are in its own 'broks' queue.
+        # The log starts at broks_log_start, so we do not have to move it
+        # at each trim.
+        self.broks_log = []
+        self.broks_log_start = 0
+        self.broks_log_size = 0
+        self.broks_seq = 0
+        # The full blocks of broks_frames_block broks of the log are serialized
+        # only once for all brokers. broks_log_pos is the position of
+        # broks_log[0] since our start, so blocks numbers do not change
+        # when we trim the log
+        self.broks_log_pos = 0
+        self.broks_frames_block = 256
+        self.broks_frames = {}
+        # Brokers can wait for new broks in a get_broks call
+        self.broks_cond = None
+        self.nb_broks_waiters = 0
+        # A broker that acknowledged its broks in the last seconds is
+        # alive, we keep its broks until it get them, but the log can't
+        # be bigger than this (in bytes of broks data)
+        self.broks_ack_timeout = 300
+        self.broks_log_max_size = 256 * 1024 * 1024
         self.pollers = {}
         self.reactionners = {}
 
+        # The configuration diffs from the arbiter, not yet applied
+        self.conf_diffs = []
+
 
     def reset(self):
         self.must_run = True
         del self.waiting_results[:]
+        del self.conf_diffs[:]
         for o in self.checks, self.actions, self.downtimes, self.contact_downtimes, self.comments, self.broks, self.brokers:
             o.clear()
+        del self.broks_log[:]
+        self.broks_log_start = 0
+        self.broks_log_size = 0
+        self.broks_log_pos = 0
+        self.broks_frames.clear()
 
 
 
@@ -266,27 +326,141 @@ class Scheduler:
     # on starting, the broks are put in a global queue : self.broks
     # then when the first broker connect, it will generate initial_broks
     # in it's own queue (so bname != None).
-    # and when in "normal" run, we just need to put the brok to all queues
+    # and when in "normal" run, we just need to put the brok in the
+    # broks log of all brokers
     def add_Brok(self, brok, bname=None):
         # For brok, we TAG brok with our instance_id
         brok.instance_id = self.instance_id
         # Maybe it's just for one broker
         if bname:
-            broks = self.brokers[bname]['broks']
-            broks[brok.id] = brok
+            self.add_brok_to_broker_queue(self.brokers[bname], brok)
         else:
             # If there are known brokers, give it to them
             if len(self.brokers) > 0:
-                # Or maybe it's for all
-                for bname in self.brokers:
-                    broks = self.brokers[bname]['broks']
-                    broks[brok.id] = brok
+                self.broks_seq += 1
+                size = get_brok_size(brok)
+                self.broks_log.append((self.broks_seq, brok, size))
+                self.broks_log_size += size
+                self.wake_broks_waiters()
             else: # no brokers? maybe at startup for logs
                 # we will put in global queue, that the first broker
                 # connexion will get all
                 self.broks[brok.id] = brok
 
 
+    # The broks are indexed by a sequence number, so the broker can say us
+    # until where it got them (broks can be created long before being put
+    # in queues, so their ids are not ordered)
+    def add_brok_to_broker_queue(self, e, brok):
+        self.broks_seq += 1
+        e['broks'][self.broks_seq] = brok
+        self.wake_broks_waiters()
+
+
+    # The daemon give us its HTTP lock, so the brokers can wait for new
+    # broks in their get_broks call, without blocking us
+    def set_broks_lock(self, lock):
+        self.broks_cond = threading.Condition(lock)
+
+
+    # Brokers are waiting for broks, they will get them as soon as we
+    # release the HTTP lock. We must have this lock here, like in
+    # all our loop or in the HTTP calls
+    def wake_broks_waiters(self):
+        if self.nb_broks_waiters:
+            self.broks_cond.notify_all()
+
+
+    # Do the broker have broks after since_id?
+    def have_new_broks(self, bname, since_id):
+        # We were reset, it must ask us again
+        if bname not in self.brokers:
+            return True
+        e = self.brokers[bname]
+        acked = e.get('acked', 0)
+        if since_id < 0:
+            since_id = acked
+        # A cursor from a previous run of us, it will get the good ones
+        elif since_id > self.broks_seq:
+            return True
+        since_id = max(since_id, acked)
+        if self.broks:
+            return True
+        if self.find_in_broks_log(since_id) < len(self.broks_log):
+            return True
+        for seq in e['broks']:
+            if seq > since_id:
+                return True
+        return False
+
+
+    # A broker can wait at most wait_time for new broks, so it do not need
+    # to poll us. We release the HTTP lock while waiting, so our loop can
+    # run and give us broks
+    def wait_for_broks(self, bname, since_id, wait_time):
+        if self.broks_cond is None or wait_time <= 0:
+            return
+        end = time.time() + wait_time
+        self.nb_broks_waiters += 1
+        try:
+            while not self.have_new_broks(bname, since_id):
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return
+                self.broks_cond.wait(remaining)
+        finally:
+            self.nb_broks_waiters -= 1
+
+
+    # Index in the broks log of the first brok after seq
+    def find_in_broks_log(self, seq):
+        # (seq + 0.5,) is between (seq, ...) and (seq + 1, ...)
+        return bisect.bisect_right(self.broks_log, (seq + 0.5,), self.broks_log_start)
+
+
+    # Number of broks a broker still did not acknowledge
+    def get_broker_lag(self, bname):
+        e = self.brokers[bname]
+        return len(e['broks']) + len(self.broks_log) - self.find_in_broks_log(e.get('acked', 0))
+
+
+    # Forget the broks all brokers acknowledged. Dead brokers only keep
+    # the max_broks last ones. And we stay in our memory budget even for
+    # the alive ones. Return the number of broks a broker will not get
+    def trim_broks_log(self, max_broks):
+        now = time.time()
+        nb_drops = 0
+        keep_after = self.broks_seq
+        for e in self.brokers.values():
+            acked = e.get('acked', 0)
+            if now - e.get('last_ack', 0) > self.broks_ack_timeout and acked < self.broks_seq - max_broks:
+                nb_drops += self.find_in_broks_log(self.broks_seq - max_broks) - self.find_in_broks_log(acked)
+                acked = e['acked'] = self.broks_seq - max_broks
+            keep_after = min(keep_after, acked)
+
+        log = self.broks_log
+        start = self.broks_log_start
+        end = len(log)
+        while start < end and (log[start][0] <= keep_after or self.broks_log_size > self.broks_log_max_size):
+            (seq, b, size) = log[start]
+            self.broks_log_size -= size
+            if seq > keep_after:
+                nb_drops += 1
+            start += 1
+        # We really remove the old entries only when they are half the log,
+        # so it costs nothing more than the appends
+        if start > end / 2:
+            del log[:start]
+            self.broks_log_pos += start
+            start = 0
+        self.broks_log_start = start
+        # The frames of the forgotten blocks are no more useful
+        first_block = (self.broks_log_pos + start) / self.broks_frames_block
+        for block in [block for block in self.broks_frames if block < first_block]:
+            del self.broks_frames[block]
+        return nb_drops
+
+
     def add_Notification(self, notif):
         self.actions[notif.id] = notif
         # A notification ask for a brok
@@ -381,6 +555,10 @@ class Scheduler:
         if self.conf.cleaning_queues_interval == 0:
             return
 
+        # Give back the memory of the outdated launch heaps entries
+        self.checks.clean_heaps()
+        self.actions.clean_heaps()
+
         max_checks = 5 * (len(self.hosts) + len(self.services))
         max_broks = 5 * (len(self.hosts) + len(self.services))
         max_actions = 5 * len(self.contacts) * (len(self.hosts) + len(self.services))
@@ -412,19 +590,22 @@ class Scheduler:
             nb_checks_drops = 0
 
         # For broks and actions, it's more simple
-        # or brosk, manage global but also all brokers queue
+        # or brosk, manage global but also all brokers queue. But brokers
+        # that are paging their broks are just slow, not dead: we keep
+        # their broks until they acknowledge them
+        now = time.time()
+        nb_broks_drops = self.trim_broks_log(max_broks)
         b_lists = [self.broks]
         for (bname, e) in self.brokers.iteritems():
-            b_lists.append(e['broks'])
+            if now - e.get('last_ack', 0) > self.broks_ack_timeout:
+                b_lists.append(e['broks'])
         for broks in b_lists:
             if len(broks) > max_broks:
-                id_max = broks.keys()[-1]
+                id_max = max(broks)
                 id_to_del_broks = [i for i in broks if i < id_max - max_broks]
-                nb_broks_drops = len(id_to_del_broks)
+                nb_broks_drops += len(id_to_del_broks)
                 for i in id_to_del_broks:
                     del broks[i]
-            else:
-                nb_broks_drops = 0
 
         if len(self.actions) > max_actions:
             id_max = self.actions.keys()[-1]
@@ -448,6 +629,87 @@ class Scheduler:
         for tp in self.timeperiods:
             tp.clean_cache()
 
+    # Compute the state of the timeperiods for this tick, so the items
+    # that use them (a lot use the same) just read it
+    def update_timeperiods_state(self):
+        now = time.time()
+        for tp in self.timeperiods:
+            tp.update_state(now)
+
+    # The arbiter reloaded its configuration, and sent us only the diffs
+    # of ours. If we cannot apply one, we ask for a whole configuration:
+    # with a bad push flavor, the arbiter will send us one
+    def apply_conf_diffs(self):
+        while len(self.conf_diffs) != 0:
+            raw = self.conf_diffs.pop(0)
+            try:
+                self.apply_conf_diff(raw)
+            except Exception, exp:
+                logger.error("[%s] Cannot apply the configuration diff (%s), I need a whole new configuration" % (self.instance_name, exp))
+                logger.debug("Back trace of this error: %s" % traceback.format_exc())
+                del self.conf_diffs[:]
+                self.conf.push_flavor = 0
+                self.push_flavor = 0
+
+    # Apply a configuration diff in place: the objects already there keep
+    # their checks, notifications, downtimes and states
+    def apply_conf_diff(self, raw):
+        t0 = time.time()
+        (entries, deleted) = loads_conf_diff(raw, self.conf)
+
+        for (t, k, obj, state, is_new) in entries:
+            set_diff_state(obj, state, is_new)
+            if is_new:
+                getattr(self.conf, ref_types[t])[obj.id] = obj
+                if t in ('host', 'service'):
+                    obj.instance_id = self.instance_id
+
+        deleted_objs = set()
+        for (t, k, obj) in deleted:
+            del getattr(self.conf, ref_types[t])[obj.id]
+            if t in ('host', 'service'):
+                deleted_objs.add(obj)
+                for dt in obj.downtimes:
+                    self.downtimes.pop(dt.id, None)
+                for c in obj.comments:
+                    self.comments.pop(c.id, None)
+        # The scheduled checks and actions of the deleted objects are useless
+        for q in (self.checks, self.actions):
+            for a in q.get_by_status('scheduled'):
+                if getattr(a, 'ref', None) in deleted_objs:
+                    a.status = 'zombie'
+
+        for (t, prop) in diff_types:
+            getattr(self.conf, prop).create_reversed_list()
+        # The new command calls are not linked to our commands
+        self.conf.late_linkify()
+        # The timeperiods tables can come from the changed ones, by the excludes
+        # and their state of the tick too
+        if 'timeperiod' in [entry[0] for entry in entries]:
+            for tp in self.timeperiods:
+                tp.table = None
+                tp.state_end = 0
+        # Our groups have only our hosts and services
+        for (groups, elts, prop) in ((self.hostgroups, self.hosts, 'hostgroups'),
+                                     (self.servicegroups, self.services, 'servicegroups')):
+            for g in groups:
+                g.members = []
+            for elt in elts:
+                for g in getattr(elt, prop):
+                    g = groups.find_by_name(g.get_name())
+                    if g is not None and elt not in g.members:
+                        g.members.append(elt)
+
+        # The macros indexes are on the old lists
+        m = MacroResolver()
+        m.init(self.conf)
+        # And the brokers need all our objects again, but they must
+        # still get the broks of the log they did not get yet
+        for bname in self.brokers:
+            self.fill_initial_broks(bname, reset_cursor=False)
+        logger.info("[%s] Configuration diff applied in %.2fs: %d new or changed objects, %d deleted" %
+                    (self.instance_name, time.time() - t0, len(entries), len(deleted)))
+
     # Ask item (host or service) an update_status
     # and add it to our broks queue
     def get_and_register_status_brok(self, item):
@@ -516,100 +778,134 @@ class Scheduler:
 
     # Called by poller to get checks
     # Can get checks and actions (notifications and co)
+    # max_actions is the number of actions the satellite can still take
+    # (-1 for no limit). We do not give more, and we do not give more
+    # than a fair share of the due actions if other satellites are
+    # taking the same tags.
     def get_to_run_checks(self, do_checks=False, do_actions=False,
                           poller_tags=['None'], reactionner_tags=['None'], \
-                              worker_name='none', module_types=['fork']
-                          ):
+                              worker_name='none', module_types=['fork'],
+                          max_actions=-1):
         res = []
         now = time.time()
 
         # If poller want to do checks
         if do_checks:
-            for c in self.checks.values():
-                #  If the command is untagged, and the poller too, or if both are tagged
-                #  with same name, go for it
-                # if do_check, call for poller, and so poller_tags by default is ['None']
-                # by default poller_tag is 'None' and poller_tags is ['None']
-                # and same for module_type, the default is the 'fork' type
-                if c.poller_tag in poller_tags and c.module_type in module_types:
-                    # must be ok to launch, and not an internal one (business rules based)
-                    if c.status == 'scheduled' and c.is_launchable(now) and not c.internal:
-                        c.status = 'inpoller'
-                        c.worker = worker_name
-                        # We do not send c, because it is a link (c.ref) to
-                        # host/service and poller do not need it. It only
-                        # need a shell with id, command and defaults
-                        # parameters. It's the goal of copy_shell
-                        res.append(c.copy_shell())
+            max_checks = self.get_dispatch_batch_size('checks', self.checks, worker_name,
+                                                      poller_tags, module_types, max_actions, now)
+            #  If the command is untagged, and the poller too, or if both are tagged
+            #  with same name, go for it
+            # if do_check, call for poller, and so poller_tags by default is ['None']
+            # by default poller_tag is 'None' and poller_tags is ['None']
+            # and same for module_type, the default is the 'fork' type
+            # The queue only gives us the launchable ones, and never the
+            # internal ones (business rules based)
+            for c in self.checks.pop_launchable(poller_tags, module_types, now, max_checks):
+                c.status = 'inpoller'
+                c.worker = worker_name
+                # We do not send c, because it is a link (c.ref) to
+                # host/service and poller do not need it. It only
+                # need a shell with id, command and defaults
+                # parameters. It's the goal of copy_shell
+                res.append(c.copy_shell())
+
+            self.dispatch_by_worker['checks'][worker_name]['dispatched'] += len(res)
 
         # If reactionner want to notify too
         if do_actions:
-            for a in self.actions.values():
-                # if do_action, call the reactionner, and so reactionner_tags by default is ['None']
-                # by default reactionner_tag is 'None' and reactionner_tags is ['None'] too
-                # So if not the good one, loop for next :)
-                if not a.reactionner_tag in reactionner_tags:
-                    continue
-
-                # same for module_type
-                if not a.module_type in module_types:
-                    continue
-
-                # And now look for can launch or not :)
-                if a.status == 'scheduled' and a.is_launchable(now):
-                    a.status = 'inpoller'
-                    a.worker = worker_name
-                    if a.is_a == 'notification' and not a.contact:
-                        # This is a "master" notification created by create_notifications.
-                        # It wont sent itself because it has no contact.
-                        # We use it to create "child" notifications (for the contacts and
-                        # notification_commands) which are executed in the reactionner.
-                        item = a.ref
-                        childnotifications = []
-
-                        if not item.notification_is_blocked_by_item(a.type, now):
-                            # If it is possible to send notifications of this type at the current time, then create
-                            # a single notification for each contact of this item.
-                            childnotifications = item.scatter_notification(a)
-                            for c in childnotifications:
-                                c.status = 'inpoller'
-                                self.add(c)  # this will send a brok
-                                new_c = c.copy_shell()
-                                res.append(new_c)
-
-                        # If we have notification_interval then schedule the next notification (problems only)
-                        if a.type == 'PROBLEM':
-                            # Update the ref notif number after raise the one of the notification
-                            if len(childnotifications) != 0:
-                                # notif_nb of the master notification was already current_notification_number+1.
-                                # If notifications were sent, then host/service-counter will also be incremented
-                                item.current_notification_number = a.notif_nb
-
-                            if item.notification_interval != 0 and a.t_to_go is not None:
-                                # We must continue to send notifications.
-                                # Just leave it in the actions list and set it to "scheduled" and it will be found again later
-                                # Ask the service/host to compute the next notif time. It can be just
-                                # a.t_to_go + item.notification_interval * item.__class__.interval_length
-                                # or maybe before because we have an escalation that need to raise up before
-                                a.t_to_go = item.get_next_notification_time(a)
+            max_notifs = self.get_dispatch_batch_size('actions', self.actions, worker_name,
+                                                      reactionner_tags, module_types, max_actions, now)
+            nb_before = len(res)
+            # if do_action, call the reactionner, and so reactionner_tags by default is ['None']
+            # by default reactionner_tag is 'None' and reactionner_tags is ['None'] too
+            # and same for module_type, and we only get the launchable ones
+            for a in self.actions.pop_launchable(reactionner_tags, module_types, now, max_notifs):
+                a.status = 'inpoller'
+                a.worker = worker_name
+                if a.is_a == 'notification' and not a.contact:
+                    # This is a "master" notification created by create_notifications.
+                    # It wont sent itself because it has no contact.
+                    # We use it to create "child" notifications (for the contacts and
+                    # notification_commands) which are executed in the reactionner.
+                    item = a.ref
+                    childnotifications = []
+
+                    if not item.notification_is_blocked_by_item(a.type, now):
+                        # If it is possible to send notifications of this type at the current time, then create
+                        # a single notification for each contact of this item.
+                        childnotifications = item.scatter_notification(a)
+                        for c in childnotifications:
+                            c.status = 'inpoller'
+                            self.add(c)  # this will send a brok
+                            new_c = c.copy_shell()
+                            res.append(new_c)
+
+                    # If we have notification_interval then schedule the next notification (problems only)
+                    if a.type == 'PROBLEM':
+                        # Update the ref notif number after raise the one of the notification
+                        if len(childnotifications) != 0:
+                            # notif_nb of the master notification was already current_notification_number+1.
+                            # If notifications were sent, then host/service-counter will also be incremented
+                            item.current_notification_number = a.notif_nb
+
+                        if item.notification_interval != 0 and a.t_to_go is not None:
+                            # We must continue to send notifications.
+                            # Just leave it in the actions list and set it to "scheduled" and it will be found again later
+                            # Ask the service/host to compute the next notif time. It can be just
+                            # a.t_to_go + item.notification_interval * item.__class__.interval_length
+                            # or maybe before because we have an escalation that need to raise up before
+                            a.t_to_go = item.get_next_notification_time(a)
                                 
-                                a.notif_nb = item.current_notification_number + 1
-                                a.status = 'scheduled'
-                            else:
-                                # Wipe out this master notification. One problem notification is enough.
-                                item.remove_in_progress_notification(a)
-                                self.actions[a.id].status = 'zombie'
-
+                            a.notif_nb = item.current_notification_number + 1
+                            a.status = 'scheduled'
                         else:
-                            # Wipe out this master notification. We don't repeat recover/downtime/flap/etc...
+                            # Wipe out this master notification. One problem notification is enough.
                             item.remove_in_progress_notification(a)
                             self.actions[a.id].status = 'zombie'
+
                     else:
-                        # This is for child notifications and eventhandlers
-                        new_a = a.copy_shell()
-                        res.append(new_a)
+                        # Wipe out this master notification. We don't repeat recover/downtime/flap/etc...
+                        item.remove_in_progress_notification(a)
+                        self.actions[a.id].status = 'zombie'
+                else:
+                    # This is for child notifications and eventhandlers
+                    new_a = a.copy_shell()
+                    res.append(new_a)
+            self.dispatch_by_worker['actions'][worker_name]['dispatched'] += len(res) - nb_before
         return res
 
+    # Get the number of actions we can give to a satellite. It's its
+    # asked max_actions (its free slots), but if others satellites
+    # with the same tags asked us actions recently, it's limited to
+    # its share of the due actions, so the first satellite that ask
+    # after a restart do not take all of them
+    def get_dispatch_batch_size(self, kind, queue, worker_name, tags, module_types, max_actions, now):
+        by_worker = self.dispatch_by_worker[kind]
+        tags = set(tags)
+        module_types = set(module_types)
+        if worker_name not in by_worker:
+            by_worker[worker_name] = {'dispatched': 0}
+        e = by_worker[worker_name]
+        e['last_request'] = now
+        e['tags'] = tags
+        e['module_types'] = module_types
+        e['max_actions'] = max_actions
+
+        nb_peers = 0
+        for (name, w) in by_worker.iteritems():
+            if name != worker_name and now - w['last_request'] < self.dispatch_fairness_window \
+                    and w['tags'] & tags and w['module_types'] & module_types:
+                nb_peers += 1
+        if nb_peers == 0:
+            return max_actions
+
+        nb_due = queue.count_launchable(tags, module_types, now)
+        # Round up, so every one got at least one if there are some
+        share = (nb_due + nb_peers) // (nb_peers + 1)
+        if max_actions < 0:
+            return share
+        return min(max_actions, share)
+
     # Called by poller and reactionner to send result
     def put_results(self, c):
         if c.is_a == 'notification':
@@ -876,30 +1172,117 @@ class Scheduler:
     # simply ask their ref to manage it when it's ok to run
     def manage_internal_checks(self):
         now = time.time()
-        for c in self.checks.values():
+        for c in self.checks.get_by_status('scheduled'):
             # must be ok to launch, and not an internal one (business rules based)
-            if c.internal and c.status == 'scheduled' and c.is_launchable(now):
+            if c.internal and c.is_launchable(now):
                 c.ref.manage_internal_check(c)
                 # it manage it, now just ask to consume it
                 # like for all checks
                 c.status = 'waitconsume'
 
-    # Call by brokers to have broks
-    # We give them, and clean them!
-    def get_broks(self, bname):
+    # Call by brokers to have broks. since_id is the sequence number of the
+    # last brok the broker got: all broks until it are acknowledged and so
+    # forgotten, and we give at most max_count broks after it. Older brokers
+    # do not give since_id (-1): we give them all, and clean them!
+    # We return the broks of its own queue as a list of (seq, brok), and
+    # the range of the broks log it must get
+    def get_broks_page(self, bname, since_id=-1, max_count=-1):
         # If we are here, we are sure the broker entry exists
-        res = self.brokers[bname]['broks']
-        # They are gone, we keep none!
-        self.brokers[bname]['broks'] = {}
-
-        # Also put in the result the possible first log broks if so
-        res.update(self.broks)
-        # and clean the global broks too now
-        self.broks.clear()
-        
+        e = self.brokers[bname]
+        # Also put in the queue the possible first log broks if so
+        if self.broks:
+            for b in sorted(self.broks.values(), key=lambda b: b.id):
+                self.add_brok_to_broker_queue(e, b)
+            # and clean the global broks too now
+            self.broks.clear()
+
+        broks = e['broks']
+        acked = e.get('acked', 0)
+        e['last_ack'] = time.time()
+        legacy = since_id < 0
+        if legacy:
+            since_id = acked
+            max_count = -1
+        # A cursor further than our queue is from a previous run of us,
+        # we can't trust it
+        elif since_id > self.broks_seq:
+            since_id = acked
+        for seq in [seq for seq in broks if seq <= since_id]:
+            del broks[seq]
+        acked = max(acked, since_id)
+
+        # Then we merge the broks of the log and of its own queue, in order
+        own = sorted(broks)
+        own_items = []
+        i = 0
+        log = self.broks_log
+        first = j = self.find_in_broks_log(acked)
+        nb = 0
+        while nb != max_count:
+            if i < len(own) and (j == len(log) or own[i] < log[j][0]):
+                own_items.append((own[i], broks[own[i]]))
+                i += 1
+            elif j < len(log):
+                j += 1
+            else:
+                break
+            nb += 1
+
+        # Old brokers got them all, they are gone, we keep none!
+        if legacy:
+            broks.clear()
+            acked = self.broks_seq
+        e['acked'] = acked
+        return (own_items, first, j)
+
+
+    # The broks for a broker, as a dict
+    def get_broks(self, bname, since_id=-1, max_count=-1):
+        (own_items, first, last) = self.get_broks_page(bname, since_id, max_count)
+        res = dict(own_items)
+        for (seq, b, size) in self.broks_log[first:last]:
+            res[seq] = b
         return res
 
 
+    # The broks for a broker, already in frames for the wire. The full
+    # blocks of the broks log are serialized only once, and their frames
+    # are given to all brokers
+    def get_broks_frames(self, bname, since_id=-1, max_count=-1):
+        (own_items, first, last) = self.get_broks_page(bname, since_id, max_count)
+        res = dict(own_items)
+        frames = []
+        if own_items:
+            frames.extend(wireformat.get_frames('', res))
+
+        log = self.broks_log
+        size = self.broks_frames_block
+        # Position of log[0] since our start
+        pos = self.broks_log_pos
+        j = first
+        while j < last:
+            block = (pos + j) / size
+            block_start = block * size - pos
+            block_end = block_start + size
+            if j == block_start and block_end <= last:
+                block_frames = self.broks_frames.get(block)
+                if block_frames is None:
+                    block_broks = dict((seq, b) for (seq, b, _) in log[block_start:block_end])
+                    block_frames = self.broks_frames[block] = wireformat.get_frames('', block_broks)
+                frames.extend(block_frames)
+                end = block_end
+            else:
+                end = min(last, block_end)
+                frames.extend(wireformat.get_frames('', dict((seq, b) for (seq, b, _) in log[j:end])))
+            for (seq, b, _) in log[j:end]:
+                res[seq] = b
+            j = end
+
+        if not frames:
+            frames = wireformat.get_frames('', res)
+        return wireformat.EncodedValue(res, frames)
+
+
     # An element can have its topology changed by an external command
     # if so a brok will be generated with this flag. No need to reset all of
     # them.
@@ -1121,7 +1504,15 @@ class Scheduler:
 
     # Fill the self.broks with broks of self (process id, and co)
     # broks of service and hosts (initial status)
-    def fill_initial_broks(self, bname, with_logs=False):
+    def fill_initial_broks(self, bname, with_logs=False, reset_cursor=True):
+        # The broker will have all from these broks, no need to give
+        # it the older ones of the broks log (but for a configuration diff,
+        # the broker keeps its objects until it gets these broks)
+        e = self.brokers[bname]
+        if reset_cursor:
+            e['acked'] = self.broks_seq
+            e['last_ack'] = time.time()
+
         # First a Brok for delete all from my instance_id
         b = Brok('clean_all_my_instance_id', {'instance_id': self.instance_id})
         self.add_Brok(b, bname)
@@ -1215,6 +1606,9 @@ class Scheduler:
     # Called every 1sec to consume every result in services or hosts
     # with these results, they are OK, CRITICAL, UP/DOWN, etc...
     def consume_results(self):
+        # The states will change, the global macros totals must be
+        # computed again for this tick
+        MacroResolver().reset_totals()
         # All results are in self.waiting_results
         # We need to get them first
         for c in self.waiting_results:
@@ -1223,23 +1617,23 @@ class Scheduler:
 
         # Then we consume them
         #print "**********Consume*********"
-        for c in self.checks.values():
+        for c in self.checks.get_by_status('waitconsume'):
+            # A previous consume may have already changed this one
             if c.status == 'waitconsume':
                 item = c.ref
                 item.consume_result(c)
 
 
         # All 'finished' checks (no more dep) raise checks they depends on
-        for c in self.checks.values():
-            if c.status == 'havetoresolvedep':
-                for dependent_checks in c.depend_on_me:
-                    # Ok, now dependent will no more wait c
-                    dependent_checks.depend_on.remove(c.id)
-                # REMOVE OLD DEP CHECK -> zombie
-                c.status = 'zombie'
+        for c in self.checks.get_by_status('havetoresolvedep'):
+            for dependent_checks in c.depend_on_me:
+                # Ok, now dependent will no more wait c
+                dependent_checks.depend_on.remove(c.id)
+            # REMOVE OLD DEP CHECK -> zombie
+            c.status = 'zombie'
 
         # Now, reinteger dep checks
-        for c in self.checks.values():
+        for c in self.checks.get_by_status('waitdep'):
             if c.status == 'waitdep' and len(c.depend_on) == 0:
                 item = c.ref
                 item.consume_result(c)
@@ -1248,10 +1642,7 @@ class Scheduler:
     # zombie = not useful anymore
     def delete_zombie_checks(self):
         #print "**********Delete zombies checks****"
-        id_to_del = []
-        for c in self.checks.values():
-            if c.status == 'zombie':
-                id_to_del.append(c.id)
+        id_to_del = [c.id for c in self.checks.get_by_status('zombie')]
         # une petite tape dans le dos et tu t'en vas, merci...
         # *pat pat* GFTO, thks :)
         for id in id_to_del:
@@ -1261,10 +1652,7 @@ class Scheduler:
     # zombie = not useful anymore
     def delete_zombie_actions(self):
         #print "**********Delete zombies actions****"
-        id_to_del = []
-        for a in self.actions.values():
-            if a.status == 'zombie':
-                id_to_del.append(a.id)
+        id_to_del = [a.id for a in self.actions.get_by_status('zombie')]
         # une petite tape dans le dos et tu t'en vas, merci...
         # *pat pat* GFTO, thks :)
         for id in id_to_del:
@@ -1390,19 +1778,19 @@ class Scheduler:
     def check_orphaned(self):
         worker_names = {}
         now = int(time.time())
-        for c in self.checks.values():
+        for c in self.checks.get_by_status('inpoller'):
             time_to_orphanage = c.ref.get_time_to_orphanage()
             if time_to_orphanage:
-                if c.status == 'inpoller' and c.t_to_go < now - time_to_orphanage:
+                if c.t_to_go < now - time_to_orphanage:
                     c.status = 'scheduled'
                     if c.worker not in worker_names:
                         worker_names[c.worker] = 1
                         continue
                     worker_names[c.worker] += 1
-        for a in self.actions.values():
+        for a in self.actions.get_by_status('inpoller'):
             time_to_orphanage = a.ref.get_time_to_orphanage()
             if time_to_orphanage:
-                if a.status == 'inpoller' and a.t_to_go < now - time_to_orphanage:
+                if a.t_to_go < now - time_to_orphanage:
                     a.status = 'scheduled'
                     if a.worker not in worker_names:
                         worker_names[a.worker] = 1
@@ -1515,9 +1903,9 @@ class Scheduler:
             #    self.conf.quick_debug()
 
             # stats
-            nb_scheduled = len([c for c in self.checks.values() if c.status == 'scheduled'])
-            nb_inpoller = len([c for c in self.checks.values() if c.status == 'inpoller'])
-            nb_zombies = len([c for c in self.checks.values() if c.status == 'zombie'])
+            nb_scheduled = self.checks.len_by_status('scheduled')
+            nb_inpoller = self.checks.len_by_status('inpoller')
+            nb_zombies = self.checks.len_by_status('zombie')
             nb_notifications = len(self.actions)
 
             logger.debug("Checks: total %s, scheduled %s, inpoller %s, zombies %s, notifications %s" %\
@@ -1535,10 +1923,16 @@ class Scheduler:
 
             if self.nb_checks_send != 0:
                 logger.debug("Nb checks/notifications/event send: %s" % self.nb_checks_send)
+            for kind in ('checks', 'actions'):
+                for (name, e) in self.dispatch_by_worker[kind].iteritems():
+                    logger.debug("Dispatched %s to %s: %d (asked max %d)" % (kind, name, e['dispatched'], e['max_actions']))
             self.nb_checks_send = 0
             if self.nb_broks_send != 0:
                 logger.debug("Nb Broks send: %s" % self.nb_broks_send)
             self.nb_broks_send = 0
+            for bname in self.brokers:
+                logger.debug("Broks waiting for the broker %s: %d" % (bname, self.get_broker_lag(bname)))
+            logger.debug("Broks log: %d broks, %d bytes" % (len(self.broks_log) - self.broks_log_start, self.broks_log_size))
 
             time_elapsed = now - gogogo
             logger.debug("Check average = %d checks/s" % int(self.nb_check_received / time_elapsed))
@@ -23,9 +23,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+
 from shinken.satellitelink import SatelliteLink, SatelliteLinks
 from shinken.property import BoolProp, IntegerProp, StringProp, ListProp
 from shinken.log  import logger
+from shinken.http_client import HTTPExceptions
 
 
 class SchedulerLink(SatelliteLink):
@@ -68,6 +71,24 @@ class SchedulerLink(SatelliteLink):
             logger.debug(exp)
             return False
 
+    # Send the diff of the configuration the scheduler have. It says
+    # False if it does not have this configuration any more
+    def put_conf_diff(self, package):
+        if self.con is None:
+            self.create_connection()
+
+        # Maybe the connexion was not ok, bail out
+        if not self.con:
+            return False
+
+        try:
+            ret = self.con.post('put_conf_diff', {'diff': package}, wait='long')
+            return json.loads(ret) is True
+        except (HTTPExceptions, ValueError), exp:
+            self.con = None
+            logger.error("Failed sending configuration diff for %s: %s" % (self.get_name(), str(exp)))
+            return False
+
     def register_to_my_realm(self):
         self.realm.schedulers.append(self)
 
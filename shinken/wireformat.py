@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+""" The binary format used between the daemons for big payloads (checks,
+broks, results, configurations...).
+
+The old format was cPickle, then zlib, then base64 (for the get side) in a
+json string. Here we just send a magic string, then a list of frames, each
+one is a 4 bytes length (network order) followed by a zlib compressed
+cPickle of (name, kind, payload). Lists and dicts are cut in several
+frames, so the receiver can load them while they are still coming.
+
+Daemons that know this format tell it with the X-Shinken-Frames header in
+their responses, and clients ask for it with the Accept header. Other ones
+still use the old format.
+"""
+
+import struct
+import zlib
+import cPickle
+import base64
+import json
+
+CONTENT_TYPE = 'application/x-shinken-frames'
+HEADER = 'X-Shinken-Frames'
+MAGIC = 'SHKF\x01'
+
+# Number of elements of a list or dict in a frame
+CHUNK_SIZE = 1000
+COMPRESS_LEVEL = 2
+
+_len_struct = struct.Struct('!I')
+
+
+# Return the frames of a value named name, as a list of strings
+def get_frames(name, value):
+    if isinstance(value, list):
+        kind = 'list'
+        chunks = [value[i:i + CHUNK_SIZE] for i in xrange(0, len(value), CHUNK_SIZE)]
+    elif isinstance(value, dict):
+        kind = 'dict'
+        items = value.items()
+        chunks = [dict(items[i:i + CHUNK_SIZE]) for i in xrange(0, len(items), CHUNK_SIZE)]
+    else:
+        kind = 'obj'
+        chunks = [value]
+    # Even an empty list or dict need a frame, or it will be missing
+    if not chunks:
+        chunks = [value]
+
+    res = []
+    for chunk in chunks:
+        data = zlib.compress(cPickle.dumps((name, kind, chunk), cPickle.HIGHEST_PROTOCOL), COMPRESS_LEVEL)
+        res.append(_len_struct.pack(len(data)))
+        res.append(data)
+    return res
+
+
+# Dump a dict of named values (like POST args)
+def dumps_args(args):
+    res = [MAGIC]
+    for (name, value) in args.iteritems():
+        res.extend(get_frames(name, value))
+    return ''.join(res)
+
+
+class EncodedValue(object):
+    """A value with its frames already done, so they can be computed
+    only once and given to several clients (like the broks log blocks).
+    frames must be the ones of the whole value, named ''.
+
+    """
+
+    def __init__(self, value, frames):
+        self.value = value
+        self.frames = frames
+
+
+# Dump a single value (like a GET response)
+def dumps(value):
+    if isinstance(value, EncodedValue):
+        return MAGIC + ''.join(value.frames)
+    return MAGIC + ''.join(get_frames('', value))
+
+
+# The format the old daemons are waiting for in a GET response
+def dumps_legacy(value):
+    if isinstance(value, EncodedValue):
+        value = value.value
+    return json.dumps(base64.b64encode(zlib.compress(cPickle.dumps(value), COMPRESS_LEVEL)))
+
+
+def loads_legacy(data):
+    return cPickle.loads(zlib.decompress(base64.b64decode(json.loads(data))))
+
+
+class FrameDecoder(object):
+    """Load the frames as soon as they are received. It can be given
+    as the pycurl write function. If the data do not start with our magic,
+    we keep them as is for the old format.
+
+    """
+
+    def __init__(self):
+        # Received data not loaded for now
+        self.pieces = []
+        self.size = 0
+        # Number of bytes we need before we can load something
+        self.need = len(MAGIC)
+        # None means we do not know yet
+        self.framed = None
+        self.values = {}
+
+    def feed(self, data):
+        self.pieces.append(data)
+        self.size += len(data)
+        if self.framed is False or self.size < self.need:
+            return
+
+        # Only join when we can load something, so a big frame
+        # that comes in a lot of small pieces is copied only once
+        buf = ''.join(self.pieces)
+        pos = 0
+        if self.framed is None:
+            if not buf.startswith(MAGIC):
+                self.framed = False
+                self.pieces = [buf]
+                return
+            self.framed = True
+            pos = len(MAGIC)
+
+        size = len(buf)
+        self.need = 4
+        while size - pos >= 4:
+            length = _len_struct.unpack_from(buf, pos)[0]
+            if size - pos - 4 < length:
+                self.need = 4 + length
+                break
+            self._load_frame(buffer(buf, pos + 4, length))
+            pos += 4 + length
+
+        rest = buf[pos:]
+        self.pieces = rest and [rest] or []
+        self.size = len(rest)
+
+    def _load_frame(self, data):
+        name, kind, payload = cPickle.loads(zlib.decompress(data))
+        if kind == 'list':
+            self.values.setdefault(name, []).extend(payload)
+        elif kind == 'dict':
+            self.values.setdefault(name, {}).update(payload)
+        else:
+            self.values[name] = payload
+
+    # Raise if we got an incomplete stream
+    def check_done(self):
+        if self.framed and self.size != 0:
+            raise ValueError('Truncated frames stream (%d bytes left)' % self.size)
+
+    # All the named values (POST args)
+    def get_values(self):
+        self.check_done()
+        return self.values
+
+    # The value of a GET response, in the new or the old format
+    def get_value(self):
+        if self.framed:
+            self.check_done()
+            return self.values.get('')
+        return loads_legacy(''.join(self.pieces))
+
+    # The raw received data when it was not framed
+    def get_raw(self):
+        return ''.join(self.pieces)
+
+
+def loads_args(data):
+    d = FrameDecoder()
+    d.feed(data)
+    return d.get_values()
+
+
+def loads(data):
+    d = FrameDecoder()
+    d.feed(data)
+    return d.get_value()
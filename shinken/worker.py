@@ -38,14 +38,24 @@ else:
     from Queue import Queue
     from threading import Thread as Process
 
+import os
 import time
 import sys
 import signal
+import select
+import errno
 import traceback
 import cStringIO
 
+# The event engine need non blocking pipes, so only on Unix
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 
 from log import logger
+from launcher import Launcher
 
 
 class Worker:
@@ -64,7 +74,7 @@ class Worker:
     _timeout = None
     _c = None
 
-    def __init__(self, id, s, returns_queue, processes_by_worker, mortal=True, timeout=300, max_plugins_output_length=8192, target=None, loaded_into='unknown', http_daemon=None):
+    def __init__(self, id, s, returns_queue, processes_by_worker, mortal=True, timeout=300, max_plugins_output_length=8192, target=None, loaded_into='unknown', http_daemon=None, use_launcher=False):
         self.id = self.__class__.id
         self.__class__.id += 1
 
@@ -74,6 +84,25 @@ class Worker:
         self.s = None
         self.processes_by_worker = processes_by_worker
         self._c = Queue()  # Private Control queue for the Worker
+        # Our own work can wait for the checks outputs (and SIGCHLD) with
+        # poll() instead of looking at each check every few ms. The master
+        # write in the wake pipe when it gives us new checks, so we do not
+        # sleep for them either
+        self.use_events = (target is None and fcntl is not None and not is_android
+                           and hasattr(select, 'poll'))
+        self.wake_r = self.wake_w = None
+        if self.use_events:
+            self.wake_r, self.wake_w = self.get_pipe()
+        # fd -> check, set only when we really wait with the events
+        self.fd_to_check = None
+        # With the events, we can ask a small process to fork the
+        # plugins instead of us (see launcher.py)
+        self.use_launcher = use_launcher
+        self.launcher = None
+        # For the master: actions it gave us that are not back yet, and
+        # if it wants us to stop (no more actions for us)
+        self.nb_actions = 0
+        self.retiring = False
         # By default, take our own code
         if target is None:
             target = self.work
@@ -84,7 +113,26 @@ class Worker:
         # Keep a trace where the worker is launch from (poller or reactionner?)
         self.loaded_into = loaded_into
         self.http_daemon = http_daemon
-        
+
+    # A non blocking pipe, that is not given to the plugins
+    @staticmethod
+    def get_pipe():
+        fds = os.pipe()
+        for fd in fds:
+            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+            fl = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fl | fcntl.FD_CLOEXEC)
+        return fds
+
+    # Read all we can from a non blocking fd
+    @staticmethod
+    def drain(fd):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except OSError:
+            pass
 
     def is_mortal(self):
         return self._mortal
@@ -107,6 +155,13 @@ class Worker:
         if hasattr(self.s, 'close'):
             self.s.close()
             self.s.join_thread()
+        for fd in (self.wake_r, self.wake_w):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.wake_r = self.wake_w = None
 
     def join(self, timeout=None):
         self._process.join(timeout)
@@ -125,6 +180,16 @@ class Worker:
 
     def send_message(self, msg):
         self._c.put(msg)
+        self.wake()
+
+    # Tell the worker it got something to do in its queues. If the pipe
+    # is full, it already have a lot of wake up to read
+    def wake(self):
+        if self.wake_w is not None:
+            try:
+                os.write(self.wake_w, 'x')
+            except OSError:
+                pass
 
     # A zombie is immortal, so kill not be kill anymore
     def set_zombie(self):
@@ -143,7 +208,8 @@ class Worker:
                     self.checks.append(msg.get_data())
                 #print "I", self.id, "I've got a message!"
         except Empty, exp:
-            if len(self.checks) == 0:
+            # With the events, we will wait for them in wait_for_checks_events
+            if len(self.checks) == 0 and self.fd_to_check is None:
                 self._idletime = self._idletime + 1
                 time.sleep(1)
         # Maybe the Queue() is not available, if so, just return
@@ -158,12 +224,19 @@ class Worker:
         for chk in self.checks:
             if chk.status == 'queue':
                 self._idletime = 0
+                if self.launcher is not None:
+                    self.launch_in_launcher(chk)
+                    # If the launcher died, we fork it ourself
+                    if chk.status != 'queue':
+                        continue
                 r = chk.execute()
                 # Maybe we got a true big problem in the
                 # action launching
                 if r == 'toomanyopenfiles':
                     # We should die as soon as we return all checks
                     self.i_am_dying = True
+                if self.fd_to_check is not None:
+                    self.register_check(chk)
 
     # Check the status of checks
     # if done, return message finished :)
@@ -196,6 +269,177 @@ class Worker:
         # Little sleep
         time.sleep(wait_time)
 
+    # Prepare the poll on our checks outputs, the wake pipe and SIGCHLD
+    # (with a pipe where the signal module write when we got one). We do
+    # not use select, it can't look at more than 1024 fds
+    def init_events(self):
+        self.poller = select.poll()
+        self.fd_to_check = {}
+        # check -> number of its outputs still open
+        self.open_fds = {}
+        # checks that closed their outputs, so their process is exiting
+        self.pipes_closed = set()
+        # checks that are done but not returned (like a launch error)
+        self.finished = []
+        self.last_sweep = time.time()
+        # We got a SIGCHLD, but we did not look at all the checks since
+        self.sigchld_pending = False
+        self.sigchld_r, sigchld_w = self.get_pipe()
+        signal.set_wakeup_fd(sigchld_w)
+        self.poller.register(self.wake_r, select.POLLIN)
+        self.poller.register(self.sigchld_r, select.POLLIN)
+        signal.signal(signal.SIGCHLD, lambda sig, frame: None)
+        # Do not break the queues calls
+        signal.siginterrupt(signal.SIGCHLD, False)
+        if self.use_launcher:
+            self.start_launcher()
+
+
+    def start_launcher(self):
+        launcher = Launcher()
+        try:
+            launcher.start()
+        except (OSError, IOError), exp:
+            logger.error("[%d] Cannot start the launcher, we will fork the plugins ourself: %s" % (self.id, exp))
+            return
+        self.launcher = launcher
+        self.poller.register(launcher.get_fd(), select.POLLIN)
+
+
+    # The launcher is dead, its checks go back in the queue and
+    # we will launch them ourself
+    def stop_launcher(self):
+        self.poller.unregister(self.launcher.get_fd())
+        for chk in self.launcher.stop():
+            chk.status = 'queue'
+        self.launcher = None
+
+
+    def launch_in_launcher(self, chk):
+        try:
+            chk.execute_in_launcher(self.launcher, self.max_plugins_output_length)
+        except (OSError, IOError), exp:
+            logger.error("[%d] The launcher is dead: %s" % (self.id, exp))
+            self.stop_launcher()
+            return
+        # Maybe the command was not even valid
+        if chk.status == 'done':
+            self.finished.append(chk)
+
+
+    # A check was launched, we will look at its outputs
+    def register_check(self, chk):
+        if chk.status != 'launched':
+            self.finished.append(chk)
+            return
+        fds = chk.get_output_fds()
+        for fd in fds:
+            self.fd_to_check[fd] = chk
+            self.poller.register(fd, select.POLLIN)
+        self.open_fds[chk] = len(fds)
+
+
+    def unregister_fd(self, fd):
+        del self.fd_to_check[fd]
+        self.poller.unregister(fd)
+
+
+    def unregister_check(self, chk):
+        for fd in chk.get_output_fds():
+            if fd in self.fd_to_check:
+                self.unregister_fd(fd)
+        self.open_fds.pop(chk, None)
+        self.pipes_closed.discard(chk)
+
+
+    # Wait for something to do: outputs of our checks, checks that
+    # exit, new checks from the master or the next timeout. Then
+    # return the finished checks
+    # REF: doc/shinken-action-queues.png (5)
+    def wait_for_checks_events(self):
+        begin = time.time()
+        timeout = 1.0
+        launched = [chk for chk in self.checks if chk.status == 'launched']
+        for chk in launched:
+            timeout = min(timeout, chk.check_time + chk.timeout - begin)
+        if self.finished:
+            timeout = 0
+        # Do not wait more than the next look at all the checks
+        if self.sigchld_pending:
+            timeout = min(timeout, self.last_sweep + 1 - begin)
+        timeout = max(timeout, 0)
+
+        try:
+            events = self.poller.poll(timeout * 1000)
+        except select.error, exp:
+            if exp.args[0] != errno.EINTR:
+                raise
+            events = []
+
+        for fd, _ in events:
+            if fd == self.wake_r:
+                self.drain(fd)
+            elif fd == self.sigchld_r:
+                self.drain(fd)
+                self.sigchld_pending = True
+            elif self.launcher is not None and fd == self.launcher.get_fd():
+                res = self.launcher.read()
+                if res is None:
+                    logger.error("[%d] The launcher is dead" % self.id)
+                    self.stop_launcher()
+                    continue
+                for (chk, r) in res:
+                    chk.set_launcher_result(r, self.max_plugins_output_length)
+                    self.finished.append(chk)
+            else:
+                chk = self.fd_to_check.get(fd)
+                if chk is not None and not chk.read_output_fd(fd, self.max_plugins_output_length):
+                    self.unregister_fd(fd)
+                    self.open_fds[chk] -= 1
+                    if self.open_fds[chk] == 0:
+                        self.pipes_closed.add(chk)
+
+        now = time.time()
+        _, _, child_utime, child_stime, _ = os.times()
+        # The checks that closed their outputs should be done
+        to_look = list(self.pipes_closed)
+        # But some plugins let their sons keep their outputs, so
+        # sometimes we look at all of them (the launcher manage its ones).
+        # The SIGCHLD is remembered until we do it
+        if self.sigchld_pending and now - self.last_sweep > 1:
+            self.last_sweep = now
+            self.sigchld_pending = False
+            to_look = self.open_fds.keys()
+        for chk in to_look:
+            if chk.status == 'launched' and chk.process.poll() is not None:
+                # Maybe its sons still have the outputs, we take what we can
+                for fd in chk.get_output_fds():
+                    if fd in self.fd_to_check:
+                        chk.read_output_fd(fd, self.max_plugins_output_length)
+                self.unregister_check(chk)
+                chk.set_finished(self.max_plugins_output_length, child_utime, child_stime)
+                self.finished.append(chk)
+
+        for chk in launched:
+            if chk.status == 'launched' and chk in self.open_fds and now - chk.check_time > chk.timeout:
+                self.unregister_check(chk)
+                chk.set_timeout(now, child_utime, child_stime)
+                self.finished.append(chk)
+
+        # We answer to the master
+        for chk in self.finished:
+            try:
+                self.returns_queue.put(chk)
+            except IOError, exp:
+                logger.error("[%d] Exiting: %s" % (self.id, exp))
+                sys.exit(2)
+            self.checks.remove(chk)
+        self.finished = []
+
+        if len(self.checks) == 0:
+            self._idletime += time.time() - begin
+
+
     # Check if our system time change. If so, change our
     def check_for_system_time_change(self):
         now = time.time()
@@ -248,6 +492,8 @@ class Worker:
         self.returns_queue = returns_queue
         self.s = s
         self.t_each_loop = time.time()
+        if self.use_events:
+            self.init_events()
         while True:
             begin = time.time()
             msg = None
@@ -261,7 +507,10 @@ class Worker:
                 # REF: doc/shinken-action-queues.png (4)
                 self.launch_new_checks()
             # REF: doc/shinken-action-queues.png (5)
-            self.manage_finished_checks()
+            if self.use_events:
+                self.wait_for_checks_events()
+            else:
+                self.manage_finished_checks()
 
             # Now get order from master
             try:
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file generates a big synthetic configuration, to bench the
+# loading of the configuration by the arbiter:
+#   python gen_big_config.py -d /tmp/big -H 60000 -s 10
+#   python ../bin/shinken-arbiter -v -c /tmp/big/shinken.cfg
+#
+# The hosts use templates and hostgroups, and a part of the services
+# are defined on the hostgroups, so all the loading phases have work.
+# The hosts are in trees of 10 (with parents), and are written by
+# files of 1000 hosts, in several directories.
+#
+
+import os
+import optparse
+
+HOSTS_BY_FILE = 1000
+HOSTS_BY_TREE = 10
+NB_HOSTGROUPS = 20
+
+
+def write(path, s):
+    d = os.path.dirname(path)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    f = open(path, 'w')
+    f.write(s)
+    f.close()
+
+
+def gen_main(nb_schedulers):
+    s = """
+define realm {
+    realm_name      All
+    default         1
+}
+
+define arbiter {
+    arbiter_name    arbiter-master
+    address         localhost
+    port            7770
+    spare           0
+}
+
+define poller {
+    poller_name     poller-master
+    address         localhost
+    port            7771
+}
+
+define reactionner {
+    reactionner_name    reactionner-master
+    address             localhost
+    port                7769
+}
+
+define broker {
+    broker_name     broker-master
+    address         localhost
+    port            7772
+}
+"""
+    for i in xrange(nb_schedulers):
+        s += """
+define scheduler {
+    scheduler_name  scheduler-%d
+    address         localhost
+    port            %d
+}
+""" % (i, 8000 + i)
+    return s
+
+
+def gen_common():
+    return """
+define command {
+    command_name    check-host-alive
+    command_line    $USER1$/check_ping -H $HOSTADDRESS$ -w 1000,100%% -c 3000,100%% -p 1
+}
+
+define command {
+    command_name    check_service
+    command_line    $USER1$/check_dummy $ARG1$ $ARG2$
+}
+
+define command {
+    command_name    notify-by-email
+    command_line    /usr/bin/printf "%%b" "$NOTIFICATIONTYPE$ $HOSTNAME$ $SERVICEDESC$ $SERVICESTATE$" | /bin/mail $CONTACTEMAIL$
+}
+
+define timeperiod {
+    timeperiod_name 24x7
+    alias           24x7
+    sunday          00:00-24:00
+    monday          00:00-24:00
+    tuesday         00:00-24:00
+    wednesday       00:00-24:00
+    thursday        00:00-24:00
+    friday          00:00-24:00
+    saturday        00:00-24:00
+}
+
+define timeperiod {
+    timeperiod_name holidays
+    alias           holidays
+    january 1       00:00-24:00
+    december 25     00:00-24:00
+}
+
+define timeperiod {
+    timeperiod_name workhours
+    alias           workhours
+    monday          08:00-18:00
+    tuesday         08:00-18:00
+    wednesday       08:00-18:00
+    thursday        08:00-18:00
+    friday          08:00-18:00
+    exclude         holidays
+}
+
+define contact {
+    contact_name                    admin
+    alias                           admin
+    email                           admin@localhost
+    service_notification_period     24x7
+    host_notification_period        24x7
+    service_notification_options    w,u,c,r
+    host_notification_options       d,u,r
+    service_notification_commands   notify-by-email
+    host_notification_commands      notify-by-email
+}
+
+define contactgroup {
+    contactgroup_name   admins
+    alias               admins
+    members             admin
+}
+
+define host {
+    name                    generic-host
+    check_command           check-host-alive
+    max_check_attempts      3
+    check_interval          5
+    retry_interval          1
+    check_period            24x7
+    notification_interval   60
+    notification_period     24x7
+    contact_groups          admins
+    register                0
+}
+
+define host {
+    name                    linux-server
+    use                     generic-host
+    _OS                     linux
+    register                0
+}
+
+define service {
+    name                    generic-service
+    max_check_attempts      3
+    check_interval          5
+    retry_interval          1
+    check_period            24x7
+    notification_interval   60
+    notification_period     workhours
+    contact_groups          admins
+    register                0
+}
+
+define service {
+    name                    linux-service
+    use                     generic-service
+    _WARN                   80
+    register                0
+}
+"""
+
+
+def gen_hostgroups():
+    s = ''
+    for i in xrange(NB_HOSTGROUPS):
+        s += """
+define hostgroup {
+    hostgroup_name  hg-%d
+    alias           Hostgroup %d
+}
+
+define service {
+    use                     linux-service
+    hostgroup_name          hg-%d
+    service_description     Hostgroup service %d
+    check_command           check_service!hg-%d!$_SERVICEWARN$
+}
+""" % (i, i, i, i, i)
+    return s
+
+
+def gen_hosts(first, last, services_by_host):
+    s = ''
+    for i in xrange(first, last):
+        name = 'host-%d' % i
+        parents = ''
+        if i % HOSTS_BY_TREE != 0:
+            parents = '\n    parents                 host-%d' % (i - i % HOSTS_BY_TREE)
+        s += """
+define host {
+    use                     linux-server
+    host_name               %s
+    address                 10.%d.%d.%d
+    hostgroups              hg-%d%s
+}
+""" % (name, i / 65536 % 256, i / 256 % 256, i % 256, i % NB_HOSTGROUPS, parents)
+        for j in xrange(services_by_host):
+            s += """
+define service {
+    use                     linux-service
+    host_name               %s
+    service_description     Service %d
+    check_command           check_service!%d!$_SERVICEWARN$
+}
+""" % (name, j, j)
+    return s
+
+
+# Write the configuration in the directory, and give the
+# path of its main file
+def gen_config(directory, nb_hosts, services_by_host, nb_schedulers=1):
+    main = os.path.join(directory, 'shinken.cfg')
+    # The distribution of the hosts is kept with the configuration
+    write(main, """
+cfg_file=shinken-specific.cfg
+cfg_file=common.cfg
+cfg_dir=hosts
+pack_distribution_file=%s
+$USER1$=/usr/lib/nagios/plugins
+""" % os.path.join(directory, 'pack_distribution.dat'))
+    write(os.path.join(directory, 'shinken-specific.cfg'), gen_main(nb_schedulers))
+    write(os.path.join(directory, 'common.cfg'), gen_common())
+    write(os.path.join(directory, 'hosts', 'hostgroups.cfg'), gen_hostgroups())
+    for first in xrange(0, nb_hosts, HOSTS_BY_FILE):
+        last = min(first + HOSTS_BY_FILE, nb_hosts)
+        # 10 files by directory
+        path = os.path.join(directory, 'hosts', 'dir-%d' % (first / HOSTS_BY_FILE / 10),
+                            'hosts-%d.cfg' % (first / HOSTS_BY_FILE))
+        write(path, gen_hosts(first, last, services_by_host))
+    return main
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(
+        "%prog [options]", version="%prog 1.0")
+    parser.add_option('-d', '--directory', dest='directory',
+                      help='Directory where to write the configuration')
+    parser.add_option('-H', '--hosts', dest='nb_hosts', type='int', default=60000,
+                      help='Number of hosts (default 60000)')
+    parser.add_option('-s', '--services', dest='services_by_host', type='int', default=10,
+                      help='Number of services by host, without the hostgroups ones (default 10)')
+    parser.add_option('-S', '--schedulers', dest='nb_schedulers', type='int', default=1,
+                      help='Number of schedulers (default 1)')
+    opts, args = parser.parse_args()
+    if not opts.directory:
+        parser.error('Please give a directory with -d')
+    print gen_config(opts.directory, opts.nb_hosts, opts.services_by_host, opts.nb_schedulers)
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# A python check for the python_checks module tests:
+# check_python_dummy.py <exit status> [sleep time]
+import os
+import sys
+import time
+
+# Entry point for the module: check_python_dummy:check
+def check(args):
+    return (int(args[0]), 'Entry point %s' % ' '.join(args[1:]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        time.sleep(float(sys.argv[2]))
+    print "Python check %s %s|pid=%d" % (sys.argv[1], os.environ.get('CHECK_VAR', ''), os.getpid())
+    sys.exit(int(sys.argv[1]))
@@ -13,6 +13,8 @@ import re
 import random
 import unittest
 import copy
+import socket
+import threading
 
 # import the shinken library from the parent directory
 import __import_shinken ; del __import_shinken
@@ -111,6 +113,36 @@ def time_warp(duration):
 # time.time = original_time_time
 # time.sleep = original_time_sleep
 
+
+# Start a (wsgiref) HTTP daemon on a free port, with obj registered
+# on it, and serve its requests in a thread until stop_http_daemon.
+# Return the daemon and its port
+def start_http_daemon(obj):
+    from shinken.http_daemon import HTTPDaemon
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    http_daemon = HTTPDaemon('127.0.0.1', port, 'wsgiref', False, None, None, None, False, 1)
+    http_daemon.register(obj)
+
+    def serve():
+        while http_daemon.serving:
+            for sock in http_daemon.get_socks_activity(0.05):
+                http_daemon.srv.handle_one_request_thread(sock)
+    http_daemon.serving = True
+    http_daemon.thread = threading.Thread(None, target=serve, name='http-test')
+    http_daemon.thread.daemon = True
+    http_daemon.thread.start()
+    return http_daemon, port
+
+
+def stop_http_daemon(http_daemon):
+    http_daemon.serving = False
+    http_daemon.thread.join()
+    http_daemon.shutdown()
+
+
 class Pluginconf(object):
     pass
 
@@ -127,43 +159,43 @@ class ShinkenTest(unittest.TestCase):
         self.log.load_obj(self)
         self.config_files = [path]
         self.conf = Config()
-        buf = self.conf.read_config(self.config_files)
-        raw_objects = self.conf.read_config_buf(buf)
+        buf = self.conf.run_phase('read_config', self.config_files)
+        raw_objects = self.conf.run_phase('read_config_buf', buf)
         self.conf.create_objects_for_type(raw_objects, 'arbiter')
         self.conf.create_objects_for_type(raw_objects, 'module')
         self.conf.early_arbiter_linking()
-        self.conf.create_objects(raw_objects)
+        self.conf.run_phase('create_objects', raw_objects)
         self.conf.old_properties_names_to_new()
         self.conf.instance_id = 0
         self.conf.instance_name = 'test'
         # Hack push_flavor, that is set by the dispatcher
         self.conf.push_flavor = 0
-        self.conf.load_triggers()
-        self.conf.linkify_templates()
-        self.conf.apply_inheritance()
-        self.conf.explode()
+        self.conf.run_phase('load_triggers')
+        self.conf.run_phase('linkify_templates')
+        self.conf.run_phase('apply_inheritance')
+        self.conf.run_phase('explode')
         #print "Aconf.services has %d elements" % len(self.conf.services)
-        self.conf.create_reversed_list()
-        self.conf.remove_twins()
-        self.conf.apply_implicit_inheritance()
-        self.conf.fill_default()
-        self.conf.remove_templates()
-        self.conf.compute_hash()
+        self.conf.run_phase('create_reversed_list')
+        self.conf.run_phase('remove_twins')
+        self.conf.run_phase('apply_implicit_inheritance')
+        self.conf.run_phase('fill_default')
+        self.conf.run_phase('remove_templates')
+        self.conf.run_phase('compute_hash')
         #print "conf.services has %d elements" % len(self.conf.services)
-        self.conf.create_reversed_list()
-        self.conf.pythonize()
-        self.conf.linkify()
-        self.conf.apply_dependencies()
+        self.conf.run_phase('create_reversed_list')
+        self.conf.run_phase('pythonize')
+        self.conf.run_phase('linkify')
+        self.conf.run_phase('apply_dependencies')
         self.conf.explode_global_conf()
         self.conf.propagate_timezone_option()
-        self.conf.create_business_rules()
-        self.conf.create_business_rules_dependencies()
-        self.conf.is_correct()
+        self.conf.run_phase('create_business_rules')
+        self.conf.run_phase('create_business_rules_dependencies')
+        self.conf.run_phase('is_correct')
         if not self.conf.conf_is_correct:
             print "The conf is not correct, I stop here"
             return
 
-        self.confs = self.conf.cut_into_parts()
+        self.confs = self.conf.run_phase('cut_into_parts')
         self.conf.prepare_for_sending()
         self.conf.show_errors()
         self.dispatcher = Dispatcher(self.conf, self.me)
@@ -184,6 +216,7 @@ class ShinkenTest(unittest.TestCase):
         e.load_scheduler(self.sched)
         e2 = ExternalCommandManager(self.conf, 'dispatcher')
         e2.load_arbiter(self)
+        e2.load_dispatcher(self.dispatcher)
         self.external_command_dispatcher = e2
 
         self.sched.schedule()
@@ -304,7 +337,7 @@ class ShinkenTest(unittest.TestCase):
             del self.sched.broks[id]
 
     def clear_actions(self):
-        self.sched.actions = {}
+        self.sched.actions.clear()
 
     def log_match(self, index, pattern):
         # log messages are counted 1...n, so index=1 for the first message
@@ -358,10 +391,11 @@ class ShinkenTest(unittest.TestCase):
 
     def update_broker(self, dodeepcopy=False):
         # The brok should be manage in the good order
-        ids = self.sched.brokers['Default-Broker']['broks'].keys()
+        broks = self.sched.get_broks('Default-Broker')
+        ids = broks.keys()
         ids.sort()
         for brok_id in ids:
-            brok = self.sched.brokers['Default-Broker']['broks'][brok_id]
+            brok = broks[brok_id]
             #print "Managing a brok type", brok.type, "of id", brok_id
             #if brok.type == 'update_service_status':
             #    print "Problem?", brok.data['is_problem']
@@ -369,7 +403,6 @@ class ShinkenTest(unittest.TestCase):
                 brok = copy.deepcopy(brok)
             brok.prepare()
             self.livestatus_broker.manage_brok(brok)
-        self.sched.brokers['Default-Broker']['broks'] = {}
 
 
     def init_livestatus(self, modconf=None, needcache=False):
@@ -253,6 +253,37 @@ class TestAction(ShinkenTest):
         self.assert_(a.perf_data == "")
 
 
+    # A plugin that write too much should not fill our memory: we only
+    # keep what we will use
+    def test_bounded_output(self):
+        if os.name == 'nt':
+            return
+        a = Action()
+        a.timeout = 5
+        a.env = {}
+        a.command = r"""python -u -c 'print "A"*1000000'"""
+        a.execute()
+        self.wait_finished(a, 1000)
+        self.assert_(a.status == 'done')
+        self.assert_(a.exit_status == 0)
+        self.assert_(a.output == "A" * 1000)
+        self.assert_(not hasattr(a, 'output_buffers'))
+
+    def test_get_outputs(self):
+        a = Action()
+        a.get_outputs("OK - all good \\| fine|a=1 b=2\nline 2\nline 3|c=3\nd=4 e=5\\|6", 8192)
+        self.assert_(a.output == 'OK - all good | fine')
+        self.assert_(a.long_output == 'line 2\nline 3')
+        self.assert_(a.perf_data == 'a=1 b=2 c=3 d=4 e=5|6')
+        a.get_outputs("OK - no perfdata\nline 2", 8192)
+        self.assert_(a.output == 'OK - no perfdata')
+        self.assert_(a.long_output == 'line 2')
+        self.assert_(a.perf_data == '')
+        # The output is cut before the parsing
+        a.get_outputs("OK - cut|a=1", 6)
+        self.assert_(a.output == 'OK - c')
+        self.assert_(a.perf_data == '')
+
 
     def test_execve_fail_with_utf8(self):
         if os.name == 'nt':
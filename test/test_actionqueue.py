@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the status indexed checks/actions queue
+#
+
+import cPickle
+
+from shinken_test import *
+from shinken.actionqueue import ActionQueue
+from shinken.eventhandler import EventHandler
+
+
+class TestActionQueue(ShinkenTest):
+    # setUp is inherited from ShinkenTest
+
+    def test_status_index(self):
+        q = ActionQueue('poller_tag')
+        c1 = Check('scheduled', 'check_ok', None, 0)
+        c2 = Check('scheduled', 'check_ok', None, 0, poller_tag='DMZ')
+        c3 = Check('inpoller', 'check_ok', None, 0)
+        for c in (c1, c2, c3):
+            q[c.id] = c
+        self.assert_(q.len_by_status('scheduled') == 2)
+        self.assert_(q.len_by_status('inpoller') == 1)
+        self.assert_(q.get_by_tags('scheduled', ['None'], ['fork']) == [c1])
+        self.assert_(q.get_by_tags('scheduled', ['DMZ'], ['fork']) == [c2])
+        self.assert_(q.get_by_tags('scheduled', ['DMZ'], ['nrpe_poller']) == [])
+
+        # A status change must be seen by the indexes
+        c1.status = 'inpoller'
+        self.assert_(q.len_by_status('scheduled') == 1)
+        self.assert_(q.len_by_status('inpoller') == 2)
+        self.assert_(q.get_by_tags('scheduled', ['None'], ['fork']) == [])
+        c1.status = 'zombie'
+        self.assert_(q.get_by_status('zombie') == [c1])
+
+        # And a deleted element is no more indexed nor linked
+        del q[c1.id]
+        self.assert_(q.len_by_status('zombie') == 0)
+        c1.status = 'scheduled'
+        self.assert_(q.len_by_status('scheduled') == 1)
+
+        q.clear()
+        self.assert_(q.len_by_status('scheduled') == 0)
+        self.assert_(q.len_by_status('inpoller') == 0)
+
+    def test_reactionner_tag_index(self):
+        q = ActionQueue('reactionner_tag')
+        e = EventHandler('eventhandler', reactionner_tag='runonwindows')
+        q[e.id] = e
+        self.assert_(q.get_by_tags('scheduled', ['runonwindows'], ['fork']) == [e])
+        self.assert_(q.get_by_tags('scheduled', ['None'], ['fork']) == [])
+        e.status = 'inpoller'
+        self.assert_(q.get_by_tags('inpoller', ['runonwindows'], ['fork']) == [e])
+
+    def test_launch_heap(self):
+        q = ActionQueue('poller_tag')
+        now = time.time()
+        c1 = Check('scheduled', 'check_ok', None, now - 10)
+        c2 = Check('scheduled', 'check_ok', None, now + 10)
+        c3 = Check('scheduled', 'check_ok', None, now - 20, poller_tag='DMZ')
+        c4 = Check('scheduled', '_internal_host_up', None, now - 30)
+        for c in (c1, c2, c3, c4):
+            q[c.id] = c
+        # Only the due checks of the good tags, never the internal ones,
+        # and only one time
+        self.assert_(q.pop_launchable(['None'], ['fork'], now) == [c1])
+        c1.status = 'inpoller'
+        self.assert_(q.pop_launchable(['None'], ['fork'], now) == [])
+        res = q.pop_launchable(['None', 'DMZ'], ['fork'], now + 20)
+        self.assert_(set(res) == set([c2, c3]))
+        c2.status = c3.status = 'inpoller'
+
+        # A rescheduled check must be given at its new time, and only at
+        # this time
+        c1.t_to_go = now + 100
+        c1.status = 'scheduled'
+        self.assert_(q.pop_launchable(['None'], ['fork'], now + 50) == [])
+        c1.t_to_go = now + 40
+        self.assert_(q.pop_launchable(['None'], ['fork'], now + 50) == [c1])
+        c1.status = 'inpoller'
+
+        # A back to scheduled check (like orphaned ones) is given again
+        c2.status = 'scheduled'
+        self.assert_(q.pop_launchable(['None'], ['fork'], now + 50) == [c2])
+
+        # Deleted checks are not given, and cleaning the heaps is safe
+        c2.status = 'scheduled'
+        del q[c2.id]
+        q.clean_heaps()
+        self.assert_(q.pop_launchable(['None'], ['fork'], now + 50) == [])
+
+    def test_pickle_without_queue(self):
+        q = ActionQueue('poller_tag')
+        c = Check('scheduled', 'check_ok', None, 0)
+        q[c.id] = c
+        c2 = cPickle.loads(cPickle.dumps(c))
+        self.assert_(c2.status == 'scheduled')
+        self.assert_('_queue' not in c2.__dict__)
+        self.assert_(c2.__dict__['status'] == 'scheduled')
+
+    def test_scheduler_indexes(self):
+        svc = self.sched.services.find_srv_by_name_and_hostname("test_host_0", "test_ok_0")
+        svc.checks_in_progress = []
+        svc.act_depend_of = []
+        self.scheduler_loop(1, [[svc, 0, 'OK']])
+        nb_scheduled = len([c for c in self.sched.checks.values() if c.status == 'scheduled'])
+        self.assert_(self.sched.checks.len_by_status('scheduled') == nb_scheduled)
+        # Consumed checks are zombies, and the zombie deletion only takes them
+        self.assert_(self.sched.checks.len_by_status('waitconsume') == 0)
+        self.sched.delete_zombie_checks()
+        self.assert_(self.sched.checks.len_by_status('zombie') == 0)
+        self.assert_(len([c for c in self.sched.checks.values() if c.status == 'zombie']) == 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
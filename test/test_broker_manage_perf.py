@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the number of broks per second the broker
+# can give to a module that do nothing, with the broks queue by source
+# and with the old sorted list
+#
+
+from shinken_test import *
+from shinken.modulesmanager import ModulesManager
+from shinken.util import sort_by_ids
+
+time.time = original_time_time
+time.sleep = original_time_sleep
+
+
+class NoopModule(object):
+    is_external = False
+    phases = [None]
+
+    def get_name(self):
+        return 'noop'
+
+    def manage_brok(self, b):
+        pass
+
+
+class TestBrokerManagePerf(ShinkenTest):
+
+    def setUp(self):
+        self.broker = Broker('', False, False, False, None)
+        self.broker.modules_manager = ModulesManager('broker', None, [])
+        self.broker.modules_manager.instances.append(NoopModule())
+
+    def get_broks(self, nb, nb_sources):
+        data = {'host_name': 'host-1', 'state': 'OK', 'output': 'OK - all is fine'}
+        res = {}
+        for i in xrange(nb):
+            res.setdefault(i % nb_sources, []).append(Brok('service_check_result', data))
+        return res
+
+    def bench(self, nb, nb_sources=10):
+        broker = self.broker
+        # The old way: one list, sorted and reversed, with a look
+        # at the arbiter after each brok
+        broks = []
+        for l in self.get_broks(nb, nb_sources).values():
+            broks.extend(l)
+        t0 = time.time()
+        broks.sort(sort_by_ids)
+        broks.reverse()
+        while len(broks) != 0:
+            b = broks.pop()
+            b.prepare()
+            broker.manage_brok(b)
+            broker.watch_for_new_conf(0.0)
+        old_time = time.time() - t0
+
+        # Now the queue by source
+        for (source, l) in self.get_broks(nb, nb_sources).items():
+            broker.add_broks_to_queue(l, ('scheduler', source))
+        t0 = time.time()
+        broker.broks.get_new()
+        broker.manage_broks(max_time=600)
+        new_time = time.time() - t0
+        self.assert_(len(broker.broks) == 0)
+
+        print "Broks: %7d, by source: %.3fs (%d broks/s) (old sorted list: %.3fs, %d broks/s)" % \
+            (nb, new_time, nb / new_time, old_time, nb / old_time)
+
+    def test_broker_manage_perf(self):
+        self.bench(20000)
+
+    def test_broker_manage_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_broker_manage_perf.py TestBrokerManagePerf.test_broker_manage_perf_big
+        return
+        self.bench(500000)
+
+
+if __name__ == '__main__':
+    unittest.main()
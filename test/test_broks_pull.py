@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the brokers getting broks page by page,
+# acknowledging them with a cursor
+#
+
+import copy
+import cPickle
+import socket
+import threading
+
+from shinken_test import *
+from shinken import wireformat
+from shinken.daemons.schedulerdaemon import IBroks
+from shinken.http_client import HTTPClient
+
+
+class TestBroksPull(ShinkenTest):
+    def setUp(self):
+        ShinkenTest.setUp(self)
+        self.sched.broks.clear()
+
+    def add_broks(self, nb):
+        for i in xrange(nb):
+            self.sched.add_Brok(Brok('log', {'log': 'line %d' % i}))
+
+    def test_cursor(self):
+        self.sched.brokers['Default-Broker'] = {'broks': {}, 'has_full_broks': False}
+        self.add_broks(25)
+
+        res = self.sched.get_broks('Default-Broker', 0, 10)
+        self.assert_(sorted(res) == range(1, 11))
+        # Not acknowledged, so still here, and given again
+        self.assert_(self.sched.get_broker_lag('Default-Broker') == 25)
+        res = self.sched.get_broks('Default-Broker', 0, 10)
+        self.assert_(sorted(res) == range(1, 11))
+
+        # Now we acknowledge them
+        res = self.sched.get_broks('Default-Broker', 10, 10)
+        self.assert_(sorted(res) == range(11, 21))
+        self.assert_(self.sched.get_broker_lag('Default-Broker') == 15)
+        res = self.sched.get_broks('Default-Broker', 20, 10)
+        self.assert_(sorted(res) == range(21, 26))
+        res = self.sched.get_broks('Default-Broker', 25, 10)
+        self.assert_(res == {})
+        self.assert_(self.sched.get_broker_lag('Default-Broker') == 0)
+
+        # A cursor from a previous run is not trusted
+        self.add_broks(5)
+        res = self.sched.get_broks('Default-Broker', 1000, 10)
+        self.assert_(sorted(res) == range(26, 31))
+
+        # And old brokers still get all, and clean them
+        res = self.sched.get_broks('Default-Broker')
+        self.assert_(len(res) == 5)
+        self.assert_(self.sched.get_broker_lag('Default-Broker') == 0)
+
+    def test_slow_broker_no_drop(self):
+        self.sched.brokers['Default-Broker'] = {'broks': {}, 'has_full_broks': False}
+        self.sched.brokers['Dead-Broker'] = {'broks': {}, 'has_full_broks': False}
+        self.sched.get_broks('Default-Broker', 0, 1)
+        max_broks = 5 * (len(self.sched.hosts) + len(self.sched.services))
+        self.add_broks(max_broks + 100)
+        nb_broks = self.sched.get_broker_lag('Default-Broker')
+        self.sched.clean_queues()
+        # The broker that is paging its broks lost nothing, the other one yes
+        # (the drop warning is also a log brok)
+        self.assert_(self.sched.get_broker_lag('Default-Broker') >= nb_broks)
+        self.assert_(self.sched.get_broker_lag('Dead-Broker') < max_broks + 100)
+
+    def test_shared_log(self):
+        self.sched.brokers['broker-1'] = {'broks': {}, 'has_full_broks': False}
+        self.sched.brokers['broker-2'] = {'broks': {}, 'has_full_broks': False}
+        self.sched.fill_initial_broks('broker-2')
+        nb_initial = len(self.sched.brokers['broker-2']['broks'])
+        # broker-1 already got its initial broks
+        self.sched.get_broks('broker-1')
+        nb_log = len(self.sched.broks_log)
+        # (with the log of the initial broks creation)
+        lag_2 = self.sched.get_broker_lag('broker-2')
+        self.assert_(lag_2 >= nb_initial)
+        self.add_broks(100)
+        # The broks are only one time in memory
+        self.assert_(len(self.sched.broks_log) == nb_log + 100)
+        self.assert_(self.sched.brokers['broker-1']['broks'] == {})
+        self.assert_(self.sched.get_broker_lag('broker-1') == 100)
+        self.assert_(self.sched.get_broker_lag('broker-2') == lag_2 + 100)
+
+        # broker-2 got its initial broks first, then the others
+        res = self.sched.get_broks('broker-2', 0, nb_initial)
+        self.assert_(sorted(res.values(), key=lambda b: b.id)[0].type == 'clean_all_my_instance_id')
+        self.assert_(all(b.type != 'log' for b in res.values()))
+        res = self.sched.get_broks('broker-2', max(res), 1000)
+        self.assert_(len(res) == lag_2 + 100 - nb_initial)
+
+        # The log is trimmed by the slowest broker
+        res1 = self.sched.get_broks('broker-1', 0, 50)
+        self.sched.get_broks('broker-1', max(res1), 50)
+        self.sched.get_broks('broker-2', max(res), 50)
+        self.assert_(self.sched.trim_broks_log(1000) == 0)
+        self.assert_(len(self.sched.broks_log) - self.sched.broks_log_start == 50)
+        self.assert_(self.sched.get_broker_lag('broker-1') == 50)
+        self.assert_(self.sched.get_broker_lag('broker-2') == 0)
+
+        # or by our memory budget
+        self.sched.broks_log_max_size = self.sched.broks_log_size / 2
+        self.assert_(self.sched.trim_broks_log(1000) == 25)
+        self.assert_(self.sched.get_broker_lag('broker-1') == 25)
+        res = self.sched.get_broks('broker-1', max(res1), 1000)
+        self.assert_(len(res) == 25)
+
+    def test_shared_frames(self):
+        self.sched.brokers['broker-1'] = {'broks': {}, 'has_full_broks': False}
+        self.sched.brokers['broker-2'] = {'broks': {}, 'has_full_broks': False}
+        self.sched.broks_frames_block = 100
+        for bname in ('broker-1', 'broker-2'):
+            self.sched.get_broks(bname)
+        self.add_broks(450)
+        # broker-2 got a private brok too
+        b = Brok('log', {'log': 'only for broker-2'})
+        self.sched.add_Brok(b, 'broker-2')
+
+        res1 = self.sched.get_broks_frames('broker-1', 0, 1000)
+        res2 = self.sched.get_broks_frames('broker-2', 0, 1000)
+        self.assert_(len(res1.value) == 450)
+        self.assert_(len(res2.value) == 451)
+        # The full blocks were serialized only one time, for both brokers
+        shared = set(id(f) for f in res1.frames) & set(id(f) for f in res2.frames)
+        self.assert_(len(shared) >= 2 * 3)
+        # and the frames are the same as the broks
+        for res in (res1, res2):
+            loaded = wireformat.loads(wireformat.dumps(res))
+            self.assert_(sorted(loaded) == sorted(res.value))
+            self.assert_(sorted(wireformat.loads_legacy(wireformat.dumps_legacy(res))) == sorted(res.value))
+
+        # A trimmed log do not change the blocks
+        self.sched.get_broks('broker-1', max(res1.value), 1000)
+        self.sched.get_broks('broker-2', max(res2.value), 1000)
+        self.add_broks(10)
+        self.sched.trim_broks_log(1000)
+        self.assert_(self.sched.broks_frames == {})
+        res1 = self.sched.get_broks_frames('broker-1', max(res1.value), 1000)
+        self.assert_(sorted(wireformat.loads(wireformat.dumps(res1))) == sorted(res1.value))
+        self.assert_(len(res1.value) == 10)
+        # Nothing to give is still a value
+        res1 = self.sched.get_broks_frames('broker-1', max(res1.value), 1000)
+        self.assert_(wireformat.loads(wireformat.dumps(res1)) == {})
+
+    def test_lazy_prepare(self):
+        b = Brok('log', {'log': 'line'})
+        b.instance_id = 3
+        b.prepare()
+        # Not unserialized for now
+        self.assert_('data' not in b.__dict__)
+        # But still ok after a copy (like in the modules queues)
+        b2 = cPickle.loads(cPickle.dumps(b, cPickle.HIGHEST_PROTOCOL))
+        b3 = copy.deepcopy(b)
+        for brok in (b, b2, b3):
+            self.assert_(brok.data == {'log': 'line', 'instance_id': 3})
+        self.assertRaises(AttributeError, getattr, b, 'other')
+        # And prepare again do nothing
+        b.prepare()
+        self.assert_(b.data['log'] == 'line')
+
+    def get_link(self, port, name='scheduler-1'):
+        return {'con': HTTPClient(address='127.0.0.1', port=port), 'broks_cursor': 0,
+                'instance_id': 0, 'name': name}
+
+    def test_broker_pages(self):
+        self.sched.brokers.clear()
+        self.sched.broks.clear()
+        http_daemon, port = start_http_daemon(IBroks(self.sched))
+        try:
+            broker = Broker('', False, False, False, None)
+            broker.broks_page_size = 100
+            broker.max_broks_pages = 3
+            broker.schedulers[0] = self.get_link(port)
+            # Register the broker, and get its initial broks
+            broker.get_new_broks(['scheduler'])
+            nb_initial = len(broker.broks)
+            self.assert_(nb_initial > 0)
+            broker.broks.clear()
+
+            self.add_broks(1000)
+            # We stop when we got enough broks to manage
+            broker.get_new_broks(['scheduler'])
+            self.assert_(len(broker.broks) == 300)
+            # Only the last page is not acknowledged for now
+            self.assert_(self.sched.get_broker_lag(broker.name) == 800)
+            logs = [b.data for b in broker.broks]
+            broker.broks.clear()
+            for i in xrange(3):
+                broker.get_new_broks(['scheduler'])
+                logs.extend([b.data for b in broker.broks])
+                broker.broks.clear()
+            # All was given, and only one time
+            self.assert_(len(logs) == 1000)
+            self.assert_(len(set(logs)) == 1000)
+            broker.get_new_broks(['scheduler'])
+            self.assert_(self.sched.get_broker_lag(broker.name) == 0)
+        finally:
+            stop_http_daemon(http_daemon)
+
+    def test_broker_wait(self):
+        self.sched.brokers.clear()
+        self.sched.broks.clear()
+        http_daemon, port = start_http_daemon(IBroks(self.sched))
+        self.sched.set_broks_lock(http_daemon.lock)
+        try:
+            broker = Broker('', False, False, False, None)
+            broker.schedulers[0] = self.get_link(port)
+            broker.get_new_broks(['scheduler'])
+            broker.broks.clear()
+
+            # Nothing new: the scheduler keep us until the end of the wait
+            t0 = time.time()
+            broker.get_new_broks(['scheduler'], 0.3)
+            self.assert_(time.time() - t0 >= 0.3)
+            self.assert_(len(broker.broks) == 0)
+            # Our call is still waiting, it will end soon
+            original_time_sleep(0.1)
+
+            # But we got a new brok as soon as it is here
+            def add_brok():
+                original_time_sleep(0.1)
+                # Like the scheduler loop, we have the lock
+                with http_daemon.lock:
+                    self.sched.add_Brok(Brok('log', {'log': 'new state'}))
+            t = threading.Thread(target=add_brok)
+            t0 = time.time()
+            t.start()
+            broker.get_new_broks(['scheduler'], 5)
+            elapsed = time.time() - t0
+            t.join()
+            self.assert_(len(broker.broks) == 1)
+            print "Brok got after %.3fs" % elapsed
+            self.assert_(elapsed < 1)
+            self.assert_(self.sched.nb_broks_waiters == 0)
+        finally:
+            stop_http_daemon(http_daemon)
+
+    def test_broker_parallel(self):
+        # A slow scheduler, that answer only when we want
+        slow = socket.socket()
+        slow.bind(('127.0.0.1', 0))
+        slow.listen(1)
+        self.sched.brokers.clear()
+        self.sched.broks.clear()
+        http_daemon, port = start_http_daemon(IBroks(self.sched))
+        try:
+            broker = Broker('', False, False, False, None)
+            broker.schedulers[0] = self.get_link(port)
+            broker.get_new_broks(['scheduler'])
+            broker.broks.clear()
+            broker.schedulers[1] = self.get_link(slow.getsockname()[1], 'scheduler-slow')
+            broker.broks_fetch_timeout = 0.3
+
+            self.add_broks(10)
+            # The slow one do not stall the other more than the fetch timeout
+            t0 = time.time()
+            broker.get_new_broks(['scheduler'])
+            self.assert_(time.time() - t0 < 1)
+            self.assert_(len(broker.broks) == 10)
+            broker.broks.clear()
+            # but its call is still running, and we got its broks later
+            self.assert_(len(broker.broks_fetches) == 1)
+            s, _ = slow.accept()
+            s.recv(4096)
+            data = wireformat.dumps({1: Brok('log', {'log': 'slow one'})})
+            s.sendall('HTTP/1.1 200 OK\r\nContent-Length: %d\r\n%s: 1\r\n\r\n%s' % (len(data), wireformat.HEADER, data))
+            broker.get_new_broks(['scheduler'], 0.2)
+            self.assert_(len(broker.broks) == 1)
+            s.close()
+
+            stats = broker.get_broks_fetch_stats()['scheduler']
+            self.assert_(sorted(stats) == ['scheduler-1', 'scheduler-slow'])
+            self.assert_(stats['scheduler-slow']['nb_broks'] == 1)
+            self.assert_(stats['scheduler-slow']['time'] > stats['scheduler-1']['time'])
+            self.assert_(stats['scheduler-1']['size'] > 0)
+        finally:
+            broker.cancel_broks_fetches()
+            stop_http_daemon(http_daemon)
+            slow.close()
+
+if __name__ == '__main__':
+    unittest.main()
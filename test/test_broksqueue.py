@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the broker queue of broks, by source
+#
+
+from shinken_test import *
+from shinken.broksqueue import BroksQueue
+from shinken.modulesmanager import ModulesManager
+
+
+# An internal module that just keep the broks
+class RecordModule(object):
+    is_external = False
+    phases = [None]
+
+    def __init__(self):
+        self.broks = []
+
+    def get_name(self):
+        return 'record'
+
+    def manage_brok(self, b):
+        self.broks.append(b)
+
+
+class TestBroksQueue(ShinkenTest):
+
+    def setUp(self):
+        pass
+
+    def test_sources(self):
+        q = BroksQueue()
+        sched_1 = [Brok('log', {'log': 'sched-1 %d' % i}) for i in xrange(5)]
+        sched_2 = [Brok('log', {'log': 'sched-2 %d' % i}) for i in xrange(2)]
+        q.extend(sched_1[:3], 'sched-1')
+        q.extend(sched_2, 'sched-2')
+        q.extend(sched_1[3:], 'sched-1')
+        self.assert_(len(q) == 7)
+        self.assert_(q.get_new() == sched_1[:3] + sched_2 + sched_1[3:])
+        self.assert_(q.get_new() == [])
+
+        # The sources are given in turn, and each one stay in order
+        res = [q.popleft() for i in xrange(7)]
+        self.assert_(res == [sched_1[0], sched_2[0], sched_1[1], sched_2[1], sched_1[2], sched_1[3], sched_1[4]])
+        self.assert_(len(q) == 0)
+        self.assertRaises(IndexError, q.popleft)
+
+        # Like a list for the retention
+        q.extend(sched_2, 'sched-2')
+        self.assert_(list(q) == sched_2)
+        q.clear()
+        self.assert_(len(q) == 0 and list(q) == [])
+
+    def test_manage_broks(self):
+        broker = Broker('', False, False, False, None)
+        broker.modules_manager = ModulesManager('broker', None, [])
+        mod = RecordModule()
+        broker.modules_manager.instances.append(mod)
+        broker.add_broks_to_queue([Brok('log', {'log': 'sched-1 %d' % i}) for i in xrange(3)], ('scheduler', 'sched-1'))
+        broker.add_broks_to_queue([Brok('log', {'log': 'sched-2 %d' % i}) for i in xrange(3)], ('scheduler', 'sched-2'))
+        broker.manage_broks()
+        logs = [b.data['log'] for b in mod.broks]
+        self.assert_(logs == ['sched-1 0', 'sched-2 0', 'sched-1 1', 'sched-2 1', 'sched-1 2', 'sched-2 2'])
+        self.assert_(len(broker.broks) == 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the reload of the configuration with
+# diffs sent to the schedulers, and applied in place
+#
+
+import os
+import shutil
+import tempfile
+
+from shinken_test import *
+from gen_big_config import gen_config, gen_hosts
+from shinken.confstream import loads_conf
+from shinken.confdiff import get_conf_incompatibility, get_conf_diff
+from shinken.daemons.schedulerdaemon import IForArbiter
+
+
+class TestConfDiff(ShinkenTest):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.main = gen_config(self.tmp, 30, 2)
+        self.setup_with_file(self.main)
+        self.assert_(self.conf.conf_is_correct)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # A scheduler with the configuration the dispatcher sent it
+    def get_scheduler(self):
+        conf = loads_conf(list(self.conf.realms.find_by_name("All").serialized_confs[0]))
+        conf.push_flavor = 1234
+        conf.instance_name = 'scheduler-0'
+        conf.skip_initial_broks = False
+        scheddaemon = Shinken(None, False, False, False, None, None)
+        sched = Scheduler(scheddaemon)
+        scheddaemon.sched = sched
+        scheddaemon.conf = conf
+        scheddaemon.modulesdir = modulesdir
+        scheddaemon.load_modules_manager()
+        conf.explode_global_conf()
+        m = MacroResolver()
+        m.init(conf)
+        sched.load_conf(conf)
+        sched.schedule()
+        sched.get_new_actions()
+
+        # The dispatcher gave it the configuration
+        cfg = self.conf.confs[0]
+        cfg.is_assigned = True
+        cfg.push_flavor = 1234
+        cfg.assigned_to = self.conf.schedulers.find_by_name("scheduler-0")
+        cfg.assigned_to.alive = True
+        cfg.assigned_to.put_conf_diff = IForArbiter(scheddaemon).put_conf_diff
+        return scheddaemon
+
+    def change_file(self, name, old, new):
+        path = os.path.join(self.tmp, name)
+        buf = open(path).read()
+        self.assert_(old in buf)
+        f = open(path, 'w')
+        f.write(buf.replace(old, new))
+        f.close()
+
+    # Change the hosts and services, commands and timeperiods of the
+    # configuration, and load it again
+    def reload_conf(self):
+        self.change_file('common.cfg', '-p 1', '-p 2')
+        self.change_file('common.cfg', 'monday          08:00-18:00', 'monday          08:00-19:00')
+        # No more host-24, but a new host-30, and a new service on host-3
+        hosts = gen_hosts(0, 24, 2) + gen_hosts(25, 31, 2) + """
+define service {
+    use                     linux-service
+    host_name               host-3
+    service_description     New service
+    check_command           check_service!new!$_SERVICEWARN$
+}
+"""
+        f = open(os.path.join(self.tmp, 'hosts', 'dir-0', 'hosts-0.cfg'), 'w')
+        f.write(hosts.replace('check_service!1!', 'check_service!11!'))
+        f.close()
+
+        old_conf = self.conf
+        old_dispatcher = self.dispatcher
+        self.setup_with_file(self.main)
+        self.assert_(self.conf.conf_is_correct)
+        return (old_conf, old_dispatcher)
+
+    def test_same_conf(self):
+        old_conf = self.conf
+        # A scheduler is there, like with a reload
+        self.get_scheduler()
+        self.setup_with_file(self.main)
+        self.assert_(get_conf_incompatibility(old_conf, self.conf) is None)
+        self.assertEqual(([], []), get_conf_diff(old_conf.confs[0], self.conf.confs[0]))
+
+    def test_conf_diff(self):
+        old_cfg = self.conf.confs[0]
+        (old_conf, old_dispatcher) = self.reload_conf()
+        self.assert_(get_conf_incompatibility(old_conf, self.conf) is None)
+
+        (changed, deleted) = get_conf_diff(old_cfg, self.conf.confs[0])
+        changed = set([(t, k) for (t, k, o) in changed])
+        self.assert_(('command', 'check-host-alive') in changed)
+        self.assert_(('command', 'check_service') not in changed)
+        self.assert_(('timeperiod', 'workhours') in changed)
+        self.assert_(('timeperiod', '24x7') not in changed)
+        self.assert_(('host', 'host-30') in changed)
+        # The new service changes its host, and host-24 its parent
+        self.assert_(('host', 'host-3') in changed)
+        self.assert_(('host', 'host-20') in changed)
+        self.assert_(('host', 'host-5') not in changed)
+        self.assert_(('service', ('host-3', 'New service')) in changed)
+        self.assert_(('service', ('host-5', 'Service 1')) in changed)
+        self.assert_(('service', ('host-5', 'Service 0')) not in changed)
+        self.assert_(('host', 'host-24') in deleted)
+        self.assert_(('service', ('host-24', 'Service 0')) in deleted)
+
+    def test_apply_conf_diff(self):
+        scheddaemon = self.get_scheduler()
+        sched = scheddaemon.sched
+        h3 = sched.hosts.find_by_name('host-3')
+        h3.output = 'Still there'
+        h24 = sched.hosts.find_by_name('host-24')
+        self.assert_(len([c for c in sched.checks.values() if c.ref is h24]) > 0)
+        svc = sched.services.find_srv_by_name_and_hostname('host-5', 'Service 1')
+        svc.output = 'Still there too'
+        cmd = sched.commands.find_by_name('check-host-alive')
+        tp = sched.timeperiods.find_by_name('workhours')
+        # A monday at 18:30, the state of the tick say it's not valid
+        t = time.mktime((2012, 1, 2, 18, 30, 0, 0, 0, -1))
+        tp.update_state(t)
+        self.assert_(not tp.is_time_valid(t))
+
+        # A broker got all our broks, but not the last log
+        sched.brokers['broker-1'] = {'broks': {}, 'has_full_broks': False}
+        sched.fill_initial_broks('broker-1')
+        last = max(sched.get_broks('broker-1', 0, 100000))
+        sched.add(Brok('log', {'log': 'Just before the reload'}))
+
+        (old_conf, old_dispatcher) = self.reload_conf()
+        self.assert_(old_dispatcher.push_conf_diffs(self.conf))
+        # The dispatcher keeps its links, and the scheduler its configuration
+        self.assert_(old_dispatcher.conf is self.conf)
+        self.assert_(self.conf.schedulers is old_conf.schedulers)
+        self.assert_(self.conf.confs[0].is_assigned)
+        self.assertEqual(1234, self.conf.confs[0].push_flavor)
+        self.assertEqual(1, len(sched.conf_diffs))
+
+        sched.apply_conf_diffs()
+        self.assertEqual({0: 1234}, scheddaemon.what_i_managed())
+
+        # The objects are the same, with their states
+        self.assert_(sched.hosts.find_by_name('host-3') is h3)
+        self.assertEqual('Still there', h3.output)
+        self.assert_(sched.services.find_srv_by_name_and_hostname('host-5', 'Service 1') is svc)
+        self.assertEqual('Still there too', svc.output)
+        self.assert_('check_service!11!' in svc.check_command.call)
+        self.assert_(svc.check_command.command is sched.commands.find_by_name('check_service'))
+
+        # The new service is linked to its host
+        new = sched.services.find_srv_by_name_and_hostname('host-3', 'New service')
+        self.assert_(new is not None)
+        self.assert_(new.host is h3)
+        self.assert_(new in h3.services)
+        self.assertEqual(sched.instance_id, new.instance_id)
+        self.assert_(sched.hosts.find_by_name('host-30') is not None)
+        self.assert_(sched.hosts.find_by_name('host-30') in sched.hostgroups.find_by_name('hg-10').members)
+
+        # host-24 is gone, and its checks too
+        self.assert_(sched.hosts.find_by_name('host-24') is None)
+        self.assert_(h24 not in sched.hostgroups.find_by_name('hg-4').members)
+        for c in sched.checks.values():
+            if c.ref is h24:
+                self.assertEqual('zombie', c.status)
+
+        # The command and the timeperiod are changed in place
+        self.assert_(sched.commands.find_by_name('check-host-alive') is cmd)
+        self.assert_('-p 2' in cmd.command_line)
+        self.assert_(h3.check_command.command is cmd)
+        self.assert_(sched.timeperiods.find_by_name('workhours') is tp)
+        self.assert_(tp.is_time_valid(t))
+        self.assert_(svc.notification_period is tp)
+
+        # The broker gets the log, then all the objects again
+        broks = sched.get_broks('broker-1', last, 100000)
+        types = [broks[seq].type for seq in sorted(broks)]
+        self.assertEqual(['log', 'clean_all_my_instance_id'], types[:2])
+        self.assertEqual('initial_broks_done', types[-1])
+        # The scheduled checks of host-24 are zombies only one time
+        for c in sched.checks.values():
+            if c.ref is h24:
+                self.assert_(c not in sched.checks.get_by_status('scheduled'))
+
+    def test_incompatible_conf(self):
+        self.change_file('common.cfg', 'admin@localhost', 'root@localhost')
+        (old_conf, old_dispatcher) = self.reload_conf()
+        self.assertEqual('the contacts changed', get_conf_incompatibility(old_conf, self.conf))
+        self.assert_(not old_dispatcher.push_conf_diffs(self.conf))
+        self.assert_(old_dispatcher.conf is old_conf)
+
+    def test_bad_conf_diff(self):
+        scheddaemon = self.get_scheduler()
+        sched = scheddaemon.sched
+        (old_conf, old_dispatcher) = self.reload_conf()
+        self.assert_(old_dispatcher.push_conf_diffs(self.conf))
+
+        # The scheduler does not have the contact of the diff any more
+        admin = sched.contacts.find_by_name('admin')
+        del sched.contacts[admin.id]
+        h3 = sched.hosts.find_by_name('host-3')
+        sched.apply_conf_diffs()
+        # So it asks for a whole new configuration, and its objects
+        # did not change
+        self.assertEqual({0: 0}, scheddaemon.what_i_managed())
+        self.assert_(sched.services.find_srv_by_name_and_hostname('host-3', 'New service') is None)
+        self.assert_(sched.hosts.find_by_name('host-3') is h3)
+        self.assert_(sched.hosts.find_by_name('host-24') is not None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the parallel parsing of the configuration
+# files, and the loading of a generated configuration
+#
+
+import shutil
+import tempfile
+
+from shinken_test import *
+# we have a process pool, so we must un-fake time functions
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.objects.config import Config, split_config_buf
+from gen_big_config import gen_config
+
+
+class TestConfigLoad(ShinkenTest):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.setup_with_file(gen_config(self.tmp_dir, 25, 2, 2))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_generated_config(self):
+        self.assert_(self.conf.conf_is_correct)
+        self.assert_(len(self.conf.hosts) == 25)
+        # 2 services by host and one by hostgroup, each host is in one
+        self.assert_(len(self.conf.services) == 25 * 3)
+        host = self.conf.hosts.find_by_name('host-13')
+        self.assert_(host.parents[0].get_name() == 'host-10')
+        svc = self.conf.services.find_srv_by_name_and_hostname('host-13', 'Hostgroup service 13')
+        self.assert_(svc is not None)
+        self.assert_(svc.notification_period.get_name() == 'workhours')
+        # The hosts trees are in the same pack
+        self.assert_(len(self.conf.confs) == 2)
+
+    def test_phases_times(self):
+        names = [name for (name, t) in self.conf.phases_times]
+        for name in ('read_config', 'read_config_buf', 'explode', 'apply_inheritance', 'linkify', 'cut_into_parts'):
+            self.assert_(name in names)
+        self.conf.log_phases_times()
+
+    def test_parallel_parse(self):
+        conf = Config()
+        buf = conf.read_config([os.path.join(self.tmp_dir, 'shinken.cfg')])
+        # One part by file: main, shinken-specific, common, hostgroups and 1 hosts
+        # file, and the (empty) beginning of the buffer
+        self.assert_(len(split_config_buf(buf)) == 6)
+        seq = Config().read_config_buf(buf, 1)
+        par = Config().read_config_buf(buf, 2)
+        self.assert_(seq == par)
+        self.assert_(len(par['host']) == 27)
+        self.assert_(par['host'][2]['host_name'] == 'host-0')
+
+    def test_parse_processes(self):
+        conf = Config()
+        self.assert_(conf.get_parse_processes('x' * 10) == 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
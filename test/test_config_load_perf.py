@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the loading of a big generated
+# configuration, phase by phase, like the arbiter does
+#
+
+import shutil
+import tempfile
+
+from shinken_test import *
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.objects.config import Config
+from gen_big_config import gen_config
+
+
+class TestConfigLoadPerf(ShinkenTest):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def bench(self, nb_hosts, services_by_host):
+        path = gen_config(self.tmp_dir, nb_hosts, services_by_host, 4)
+        # The parsing alone, with one process and with the pool
+        conf = Config()
+        buf = conf.read_config([path])
+        for processes in (1, max(2, conf.get_parse_processes(buf))):
+            t0 = time.time()
+            Config().read_config_buf(buf, processes)
+            t = time.time() - t0
+            print "Parsing of %d chars with %d processes in %.2fs" % (len(buf), processes, t)
+
+        t0 = time.time()
+        self.setup_with_file(path)
+        t = time.time() - t0
+        self.assert_(self.conf.conf_is_correct)
+        nb_services = len(self.conf.services)
+        print "Hosts: %d, services: %d, loaded in %.2fs" % (nb_hosts, nb_services, t)
+        self.conf.log_phases_times()
+
+    def test_config_load_perf(self):
+        self.bench(1000, 5)
+
+    def test_config_load_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_config_load_perf.py TestConfigLoadPerf.test_config_load_perf_big
+        return
+        self.bench(60000, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the configuration stream the arbiter
+# sends to the schedulers
+#
+
+import cPickle
+
+from shinken_test import *
+from shinken.confstream import ConfStreamWriter, dumps_conf, loads_conf
+
+
+class TestConfStream(ShinkenTest):
+
+    def setUp(self):
+        self.setup_with_file('etc/nagios_1r_1h_1s.cfg')
+        self.cfg = self.conf.realms.find_by_name("Default").confs[0]
+
+    def check_conf(self, conf):
+        host = conf.hosts.find_by_name("test_host_0")
+        self.assert_(host is not None)
+        svc = conf.services.find_srv_by_name_and_hostname("test_host_0", "test_ok_0")
+        self.assert_(svc is not None)
+        # The links are the objects of the configuration lists
+        self.assert_(svc.host is host)
+        self.assert_(svc in host.services)
+        self.assert_(svc.check_period is conf.timeperiods.find_by_name(svc.check_period.get_name()))
+        # The command calls only keep the name of their command, like with pickle
+        self.assertEqual('check-host-alive-parent', host.check_command.command)
+        self.assert_(conf.commands.find_by_name('check-host-alive-parent') is not None)
+        self.assertEqual(len(self.cfg.hosts), len(conf.hosts))
+        self.assertEqual(len(self.cfg.services), len(conf.services))
+
+    def test_round_trip(self):
+        (chunks, w) = dumps_conf(self.cfg)
+        self.assertEqual(len(chunks), w.nb_chunks)
+        self.assertEqual(sum([len(c) for c in chunks]), w.size)
+        self.assert_(w.raw_size > w.size)
+        self.assert_(w.nb_objects >= len(self.cfg.hosts) + len(self.cfg.services))
+        conf = loads_conf(chunks)
+        # The chunks are freed while they are loaded
+        self.assertEqual([], chunks)
+        self.check_conf(conf)
+
+    def test_serialized_confs(self):
+        # The arbiter keeps the chunks of the configurations to send
+        chunks = self.conf.realms.find_by_name("Default").serialized_confs[0]
+        self.assert_(isinstance(chunks, list))
+        self.check_conf(loads_conf(list(chunks)))
+
+    def test_multiprocesses_serializer(self):
+        time.time = original_time_time
+        time.sleep = original_time_sleep
+        r = self.conf.realms.find_by_name("Default")
+        r.serialized_confs = {}
+        self.conf.use_multiprocesses_serializer = True
+        self.conf.prepare_for_sending()
+        self.check_conf(loads_conf(list(r.serialized_confs[0])))
+        self.assert_(cPickle.loads(self.conf.whole_conf_pack) is not None)
+
+    def test_old_arbiter(self):
+        # An old arbiter sends a whole pickle of the configuration
+        self.check_conf(loads_conf(cPickle.dumps(self.cfg, cPickle.HIGHEST_PROTOCOL)))
+
+    def test_truncated_stream(self):
+        chunks = list(ConfStreamWriter(self.cfg).chunks())
+        self.assertRaises(ValueError, loads_conf, chunks[:1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the configuration stream the arbiter sends
+# to the schedulers, against a whole pickle of the configuration
+#
+
+import shutil
+import tempfile
+import zlib
+import cPickle
+
+from shinken_test import *
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.confstream import dumps_conf, loads_conf
+from gen_big_config import gen_config
+
+
+class TestConfStreamPerf(ShinkenTest):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def bench(self, nb_hosts, services_by_host):
+        self.setup_with_file(gen_config(self.tmp_dir, nb_hosts, services_by_host))
+        self.assert_(self.conf.conf_is_correct)
+        conf = self.conf.confs[0]
+        # The test scheduled the arbiter objects, a real one does not
+        for o in list(conf.hosts) + list(conf.services):
+            o.actions = []
+            o.checks_in_progress = []
+
+        t0 = time.time()
+        raw = cPickle.dumps(conf, cPickle.HIGHEST_PROTOCOL)
+        t1 = time.time()
+        size = len(zlib.compress(raw, 2))
+        t2 = time.time()
+        cPickle.loads(raw)
+        t3 = time.time()
+        print "Pickle: %d bytes (%d compressed), dumped in %.2fs (compressed in %.2fs), loaded in %.2fs" % (len(raw), size, t1 - t0, t2 - t1, t3 - t2)
+
+        t0 = time.time()
+        (chunks, w) = dumps_conf(conf)
+        t1 = time.time()
+        new = loads_conf(chunks)
+        t2 = time.time()
+        print "Stream: %d objects in %d chunks, %d bytes (%d uncompressed), dumped in %.2fs, loaded in %.2fs" % (w.nb_objects, w.nb_chunks, w.size, w.raw_size, t1 - t0, t2 - t1)
+        self.assertEqual(len(conf.services), len(new.services))
+
+    def test_confstream_perf(self):
+        self.bench(500, 5)
+
+    def test_confstream_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_confstream_perf.py TestConfStreamPerf.test_confstream_perf_big
+        return
+        self.bench(10000, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
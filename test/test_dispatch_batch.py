@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the batch size and the sharing of the
+# checks between pollers
+#
+
+from shinken_test import *
+from shinken.daemons.schedulerdaemon import IChecks
+
+
+class TestDispatchBatch(ShinkenTest):
+    # setUp is inherited from ShinkenTest
+
+    def add_due_checks(self, nb, poller_tag='None'):
+        self.sched.checks.clear()
+        now = time.time()
+        for i in xrange(nb):
+            c = Check('scheduled', 'check_ok', None, now - 10, poller_tag=poller_tag)
+            self.sched.checks[c.id] = c
+
+    def test_max_actions(self):
+        self.add_due_checks(100)
+        res = self.sched.get_to_run_checks(True, False, worker_name='poller-1', max_actions=30)
+        self.assert_(len(res) == 30)
+        # No limit for older pollers
+        res = self.sched.get_to_run_checks(True, False, worker_name='poller-1')
+        self.assert_(len(res) == 70)
+        self.assert_(self.sched.dispatch_by_worker['checks']['poller-1']['dispatched'] == 100)
+
+    def test_fair_share(self):
+        self.add_due_checks(100)
+        # poller-2 is here, but did not have free slots for now
+        res = self.sched.get_to_run_checks(True, False, worker_name='poller-2', max_actions=0)
+        self.assert_(len(res) == 0)
+        # poller-1 only got its half, even if it can take all of them
+        res = self.sched.get_to_run_checks(True, False, worker_name='poller-1', max_actions=1000)
+        self.assert_(len(res) == 50)
+        res = self.sched.get_to_run_checks(True, False, worker_name='poller-2', max_actions=1000)
+        self.assert_(len(res) == 25)
+        by_worker = self.sched.dispatch_by_worker['checks']
+        self.assert_(by_worker['poller-1']['dispatched'] == 50)
+        self.assert_(by_worker['poller-2']['dispatched'] == 25)
+
+        # A poller of another tag do not share with them
+        self.add_due_checks(10, poller_tag='DMZ')
+        res = self.sched.get_to_run_checks(True, False, poller_tags=['DMZ'], worker_name='poller-dmz', max_actions=1000)
+        self.assert_(len(res) == 10)
+
+        # And a poller that did not come since a long time is no more
+        # taken into account
+        self.add_due_checks(10)
+        by_worker['poller-2']['last_request'] -= self.sched.dispatch_fairness_window + 1
+        res = self.sched.get_to_run_checks(True, False, worker_name='poller-1', max_actions=1000)
+        self.assert_(len(res) == 10)
+
+    def test_http_args(self):
+        self.add_due_checks(20)
+        i = IChecks(self.sched)
+        res = i.get_checks(do_checks='True', do_actions='False', poller_tags="['None', 'DMZ']",
+                           reactionner_tags="['None']", worker_name='poller-1',
+                           module_types="['fork']", max_actions='5')
+        self.assert_(len(res) == 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
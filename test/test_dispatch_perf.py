@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the scheduler checks dispatch to pollers
+# with a lot of pending checks
+#
+
+from shinken_test import *
+
+time.time = original_time_time
+time.sleep = original_time_sleep
+
+
+class TestDispatchPerf(ShinkenTest):
+    # setUp is inherited from ShinkenTest
+
+    # Fill the scheduler with nb pending checks, all in the future
+    def fill_checks(self, nb):
+        self.sched.checks.clear()
+        now = time.time()
+        checks = []
+        for i in xrange(nb):
+            c = Check('scheduled', 'check_ok', None, now + 3600 + i % 300)
+            self.sched.checks[c.id] = c
+            checks.append(c)
+        return checks
+
+    # Time of a poller request with nb_due checks to launch, and the
+    # time of the old "look at all checks" loop for the same request
+    def bench(self, nb, nb_due=100, nb_requests=20):
+        checks = self.fill_checks(nb)
+        dispatch_time = 0.0
+        for r in xrange(nb_requests):
+            # Some checks are now due
+            now = time.time()
+            due = checks[r * nb_due:(r + 1) * nb_due]
+            for c in due:
+                c.t_to_go = now - 1
+            t0 = time.time()
+            res = self.sched.get_to_run_checks(True, False, worker_name='bench')
+            dispatch_time += time.time() - t0
+            self.assert_(len(res) == nb_due)
+
+        t0 = time.time()
+        for r in xrange(nb_requests):
+            now = time.time()
+            res = [c for c in self.sched.checks.values()
+                   if c.poller_tag in ['None'] and c.module_type in ['fork']
+                   and c.status == 'scheduled' and c.is_launchable(now) and not c.internal]
+        scan_time = time.time() - t0
+        print "Pending checks: %8d, dispatch per request: %.6fs (full scan was: %.6fs)" % \
+            (nb, dispatch_time / nb_requests, scan_time / nb_requests)
+        self.sched.checks.clear()
+        return dispatch_time / nb_requests
+
+    def test_dispatch_perf(self):
+        self.bench(10000)
+
+    def test_dispatch_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_dispatch_perf.py TestDispatchPerf.test_dispatch_perf_big
+        return
+        for nb in (10000, 100000, 1000000):
+            self.bench(nb)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the routing of the external commands by
+# the arbiter to the schedulers of the hosts
+#
+
+import shutil
+import tempfile
+
+from shinken_test import *
+from gen_big_config import gen_config
+
+
+class TestExternalCommandsRouting(ShinkenTest):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.setup_with_file(gen_config(self.tmp, 40, 1, 2))
+        self.assert_(self.conf.conf_is_correct)
+        # The dispatcher gave the configurations to the schedulers
+        for cfg in self.conf.confs.values():
+            sched = self.conf.schedulers.find_by_name(cfg.planned_scheduler)
+            sched.alive = True
+            sched.external_commands = []
+            cfg.is_assigned = True
+            cfg.assigned_to = sched
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def get_commands(self, sched_name):
+        return self.conf.schedulers.find_by_name(sched_name).external_commands
+
+    def get_hosts(self, sched_name):
+        cfg = [cfg for cfg in self.conf.confs.values() if cfg.planned_scheduler == sched_name][0]
+        return [h.get_name() for h in cfg.hosts]
+
+    def resolve(self, cmds):
+        now = int(time.time())
+        self.external_command_dispatcher.resolve_commands([ExternalCommand('[%d] %s' % (now, cmd)) for cmd in cmds])
+
+    def test_routing(self):
+        cmds = []
+        for i in xrange(40):
+            cmds.append('PROCESS_HOST_CHECK_RESULT;host-%d;0;Host is UP' % i)
+            cmds.append('PROCESS_SERVICE_CHECK_RESULT;host-%d;Service 0;2;Service is CRITICAL' % i)
+        cmds.append('PROCESS_HOST_CHECK_RESULT;unknown-host;0;Host is UP')
+        self.resolve(cmds)
+
+        # Each scheduler got the commands of its hosts, in one list
+        nb = 0
+        for sched_name in ('scheduler-0', 'scheduler-1'):
+            hosts = self.get_hosts(sched_name)
+            sched_cmds = self.get_commands(sched_name)
+            self.assertEqual(2 * len(hosts), len(sched_cmds))
+            for cmd in sched_cmds:
+                self.assert_(cmd.split(';')[1] in hosts)
+            nb += len(sched_cmds)
+        self.assertEqual(80, nb)
+
+    def test_one_lookup_by_host(self):
+        looked = []
+        get_host_conf = self.dispatcher.get_host_conf
+        def counted_get_host_conf(host_name):
+            looked.append(host_name)
+            return get_host_conf(host_name)
+        self.dispatcher.get_host_conf = counted_get_host_conf
+        host = self.get_hosts('scheduler-0')[0]
+        cmds = ['PROCESS_HOST_CHECK_RESULT;%s;0;Host is UP' % host,
+                'DISABLE_NOTIFICATIONS',
+                'PROCESS_SERVICE_CHECK_RESULT;%s;Service 0;2;Service is CRITICAL' % host,
+                'PROCESS_HOST_CHECK_RESULT;%s;1;Host is DOWN' % host]
+        self.resolve(cmds)
+        self.assertEqual([host], looked)
+        # The commands are still in their order
+        self.assertEqual(cmds, [cmd.split(' ', 1)[1] for cmd in self.get_commands('scheduler-0')])
+        self.assertEqual(['DISABLE_NOTIFICATIONS'], [cmd.split(' ', 1)[1] for cmd in self.get_commands('scheduler-1')])
+
+    def test_reassigned_conf(self):
+        host = self.get_hosts('scheduler-0')[0]
+        # scheduler-0 is dead, and its configuration goes to scheduler-1
+        cfg = self.dispatcher.get_host_conf(host)
+        cfg.assigned_to = self.conf.schedulers.find_by_name('scheduler-1')
+        self.resolve(['PROCESS_HOST_CHECK_RESULT;%s;0;Host is UP' % host])
+        self.assertEqual([], self.get_commands('scheduler-0'))
+        self.assertEqual(1, len(self.get_commands('scheduler-1')))
+
+        # Nobody got it now
+        cfg.is_assigned = False
+        cfg.assigned_to = None
+        self.resolve(['PROCESS_HOST_CHECK_RESULT;%s;0;Host is UP' % host])
+        self.assertEqual(1, len(self.get_commands('scheduler-1')))
+
+    def test_global_command(self):
+        self.resolve(['DISABLE_NOTIFICATIONS'])
+        self.assertEqual(1, len(self.get_commands('scheduler-0')))
+        self.assertEqual(1, len(self.get_commands('scheduler-1')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the Graph class, used for the packs of
+# hosts and the loops in the parents
+#
+
+from shinken_test import *
+from shinken.graph import Graph
+
+
+class TestGraph(ShinkenTest):
+
+    def setUp(self):
+        pass
+
+    def get_graph(self, edges):
+        g = Graph()
+        for (a, b) in edges:
+            g.add_edge(a, b)
+        return g
+
+    def test_loop_check(self):
+        # a -> b -> c -> b is a loop, a and d are just linked to it
+        g = self.get_graph([('a', 'b'), ('b', 'c'), ('c', 'b'), ('c', 'd'), ('e', 'f')])
+        self.assertEqual(['b', 'c'], g.loop_check())
+        # A node that is its own son is a loop too
+        g.add_edge('f', 'f')
+        self.assertEqual(['b', 'c', 'f'], g.loop_check())
+        self.assertEqual([], self.get_graph([('a', 'b'), ('a', 'c'), ('b', 'c')]).loop_check())
+
+    def test_accessibility_packs(self):
+        g = self.get_graph([('a', 'b'), ('c', 'b'), ('d', 'e')])
+        g.add_node('f')
+        # The direction of the edges do not matter
+        self.assertEqual([['a', 'b', 'c'], ['d', 'e'], ['f']], g.get_accessibility_packs())
+
+    def test_dfs_get_all_childs(self):
+        g = self.get_graph([('a', 'b'), ('b', 'c'), ('c', 'a'), ('d', 'a')])
+        self.assertEqual(['a', 'b', 'c'], g.dfs_get_all_childs('b'))
+        self.assertEqual(['a', 'b', 'c', 'd'], g.dfs_get_all_childs('d'))
+        # An unknown node is not added to the graph
+        self.assertEqual(['z'], g.dfs_get_all_childs('z'))
+        self.assert_('z' not in g.nodes)
+
+    def test_long_chain(self):
+        # A chain longer than the recursion limit, with a loop at its end
+        nb = sys.getrecursionlimit() * 3
+        g = Graph()
+        for i in xrange(nb):
+            g.add_edge(i, i + 1)
+        self.assertEqual([], g.loop_check())
+        self.assertEqual(1, len(g.get_accessibility_packs()))
+        self.assertEqual(nb + 1, len(g.dfs_get_all_childs(0)))
+        g.add_edge(nb, nb - 10)
+        self.assertEqual(range(nb - 10, nb + 1), g.loop_check())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the Graph class on big synthetic
+# topologies, like the packs and the parents loops of huge configurations
+#
+
+import random
+
+from shinken_test import *
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.graph import Graph
+
+
+class Node(object):
+    pass
+
+
+class TestGraphPerf(ShinkenTest):
+
+    def setUp(self):
+        pass
+
+    # The network paths: trees of 50000 nodes, with chains of parents of
+    # 1000 nodes, and some random links in them (like the dependencies).
+    # All the edges go to a bigger node, so there is no loop
+    def get_graph(self, nb_edges):
+        r = random.Random(0)
+        nb_nodes = nb_edges * 9 / 10
+        nodes = [Node() for i in xrange(nb_nodes)]
+        t0 = time.time()
+        g = Graph()
+        g.add_nodes(nodes)
+        nb = 0
+        for i in xrange(1, nb_nodes):
+            if i % 50000 == 0:
+                continue
+            father = i - 1
+            if i % 1000 == 0:
+                father -= r.randint(0, min(999, i % 50000 - 1))
+            g.add_edge(nodes[father], nodes[i])
+            nb += 1
+        for i in xrange(nb_edges - nb):
+            a = r.randint(0, nb_nodes - 2)
+            g.add_edge(nodes[a], nodes[min(a + r.randint(1, 100), nb_nodes - 1)])
+        print "Graph of %d nodes and %d edges created in %.2fs" % (nb_nodes, nb_edges, time.time() - t0)
+        return g
+
+    def bench(self, nb_edges):
+        g = self.get_graph(nb_edges)
+        t0 = time.time()
+        packs = g.get_accessibility_packs()
+        print "%d packs in %.2fs" % (len(packs), time.time() - t0)
+        t0 = time.time()
+        in_loop = g.loop_check()
+        print "%d nodes in loops in %.2fs" % (len(in_loop), time.time() - t0)
+        self.assertEqual([], in_loop)
+
+        # Close a long chain
+        g.add_edge(g.nodes[999], g.nodes[1])
+        t0 = time.time()
+        in_loop = g.loop_check()
+        print "%d nodes in loops in %.2fs" % (len(in_loop), time.time() - t0)
+        self.assert_(len(in_loop) >= 999)
+
+    def test_graph_perf(self):
+        self.bench(100000)
+
+    def test_graph_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_graph_perf.py TestGraphPerf.test_graph_perf_big
+        return
+        self.bench(1000000)
+
+
+if __name__ == '__main__':
+    unittest.main()
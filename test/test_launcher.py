@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the launcher process that fork the
+# plugins for the workers
+#
+
+import select
+import signal
+
+from shinken_test import *
+# we have an external process, so we must un-fake time functions
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.launcher import Launcher
+from shinken.worker import Worker
+from multiprocessing import Queue
+from Queue import Empty
+
+
+class TestLauncher(ShinkenTest):
+
+    def setUp(self):
+        pass
+
+    # Wait for nb results of the launcher
+    def get_results(self, launcher, nb, max_time=10):
+        res = {}
+        end = time.time() + max_time
+        while len(res) < nb and time.time() < end:
+            select.select([launcher.get_fd()], [], [], 0.1)
+            for (a, r) in launcher.read():
+                res[a] = r
+        return res
+
+    def test_launcher(self):
+        if os.name == 'nt':
+            return
+        l = Launcher()
+        l.start()
+        try:
+            l.launch('echo', ['/bin/echo', 'hello'], {}, 10)
+            l.launch('env', ['/bin/sh', '-c', 'echo $SHINKEN_TEST_VAR >&2; exit 2'], {'SHINKEN_TEST_VAR': 'world'}, 10)
+            l.launch('missing', ['/doesnotexist/check_nothing'], {}, 10)
+            l.launch('sleep', ['/bin/sleep', '7'], {}, 1)
+            # A script without #! is given to the shell
+            l.launch('nobang', ['libexec/dummy_command_nobang.sh'], {}, 10)
+            # We only get back the start of a big output
+            l.launch('big', ['/bin/sh', '-c', 'head -c 1000000 /dev/zero | tr "\\0" A'], {}, 10, 1000)
+            t0 = time.time()
+            res = self.get_results(l, 6)
+            self.assert_(time.time() - t0 < 3)
+            self.assert_(res['echo'][:4] == ('done', 0, 'hello\n', ''))
+            self.assert_(res['env'][:4] == ('done', 2, '', 'world\n'))
+            self.assert_(res['missing'][0:2] == ('done', 2))
+            self.assert_('No such file' in res['missing'][2])
+            self.assert_(res['sleep'][0] == 'timeout')
+            self.assert_(res['nobang'][:2] == ('done', 0))
+            self.assert_(res['nobang'][2].startswith("Hi, I'm for testing only."))
+            self.assert_(res['big'][:3] == ('done', 0, 'A' * 1000))
+            self.assert_(l.actions == {})
+        finally:
+            l.stop()
+        # The launcher exit with its worker
+        self.assert_(l.process.returncode == 0)
+
+    def test_worker(self):
+        if os.name == 'nt':
+            return
+        to_queue = Queue()
+        from_queue = Queue()
+        w = Worker(1, to_queue, from_queue, 10, use_launcher=True)
+        w.i_am_dying = False
+        w.checks = []
+        w.returns_queue = from_queue
+        w.s = to_queue
+        w.init_events()
+        try:
+            self.assert_(w.launcher is not None)
+            for i in xrange(5):
+                c = Check('queue', '/bin/echo "OK - fine %d|a=%d"' % (i, i), None, time.time(), env={'A': 'a'})
+                to_queue.put(Message(id=0, type='Do', data=c))
+            c = Check('queue', 'libexec/sleep_command.sh 7', None, time.time(), timeout=1)
+            to_queue.put(Message(id=0, type='Do', data=c))
+
+            res = []
+            end = time.time() + 10
+            while len(res) < 6 and time.time() < end:
+                w.get_new_checks()
+                w.launch_new_checks()
+                w.wait_for_checks_events()
+                try:
+                    while True:
+                        res.append(from_queue.get(timeout=0.01))
+                except Empty:
+                    pass
+            self.assert_(len(res) == 6)
+            done = sorted(c.output for c in res if c.status == 'done')
+            self.assert_(done == ['OK - fine %d' % i for i in xrange(5)])
+            self.assert_([c for c in res if c.perf_data == 'a=0'])
+            timeout = [c for c in res if c.status == 'timeout']
+            self.assert_(len(timeout) == 1 and timeout[0].exit_status == 3)
+
+            # If the launcher die, the worker launch the checks itself
+            w.launcher.process.kill()
+            c = Check('queue', '/bin/echo "OK - alone"', None, time.time())
+            to_queue.put(Message(id=0, type='Do', data=c))
+            res = []
+            end = time.time() + 10
+            while not res and time.time() < end:
+                w.get_new_checks()
+                w.launch_new_checks()
+                w.wait_for_checks_events()
+                try:
+                    res.append(from_queue.get(timeout=0.01))
+                except Empty:
+                    pass
+            self.assert_(w.launcher is None)
+            self.assert_(len(res) == 1 and res[0].output == 'OK - alone')
+        finally:
+            if w.launcher is not None:
+                w.launcher.stop()
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            os.close(w.wake_r)
+            os.close(w.wake_w)
+            os.close(w.sigchld_r)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the fork/exec of the plugins by the worker
+# itself and by the launcher process, with a worker that got a big memory
+# like on a big poller
+#
+
+from shinken_test import *
+# we have an external process, so we must un-fake time functions
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.worker import Worker
+from multiprocessing import Queue
+
+
+class TestLauncherPerf(ShinkenTest):
+
+    def setUp(self):
+        pass
+
+    def run_checks(self, nb, use_launcher):
+        to_queue = Queue()
+        from_queue = Queue()
+        w = Worker(1, to_queue, from_queue, 100, use_launcher=use_launcher)
+        for i in xrange(nb):
+            c = Check('queue', '/bin/true', None, time.time(), timeout=30)
+            to_queue.put(Message(id=0, type='Do', data=c))
+        t0 = time.time()
+        w.start()
+        try:
+            for i in xrange(nb):
+                c = from_queue.get(timeout=120)
+                self.assert_(c.status == 'done')
+            return time.time() - t0
+        finally:
+            w.terminate()
+            w.join()
+
+    # ballast: number of objects the worker got in memory
+    def bench(self, nb, ballast):
+        if os.name == 'nt':
+            return
+        objs = [{'i': i} for i in xrange(ballast)]
+        new_time = self.run_checks(nb, True)
+        old_time = self.run_checks(nb, False)
+        print "Checks: %6d, worker objects: %8d, launcher: %.2fs (%6.0f checks/s), fork: %.2fs (%6.0f checks/s)" % \
+            (nb, ballast, new_time, nb / new_time, old_time, nb / old_time)
+        del objs
+
+    def test_launcher_perf(self):
+        self.bench(300, 0)
+
+    def test_launcher_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_launcher_perf.py TestLauncherPerf.test_launcher_perf_big
+        return
+        self.bench(2000, 0)
+        self.bench(2000, 1000000)
+        self.bench(2000, 3000000)
+
+
+if __name__ == '__main__':
+    unittest.main()
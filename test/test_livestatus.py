@@ -58,10 +58,11 @@ class TestConfig(ShinkenTest):
 
     def update_broker(self, dodeepcopy=False):
         # The brok should be manage in the good order
-        ids = self.sched.brokers['Default-Broker']['broks'].keys()
+        broks = self.sched.get_broks('Default-Broker')
+        ids = broks.keys()
         ids.sort()
         for brok_id in ids:
-            brok = self.sched.brokers['Default-Broker']['broks'][brok_id]
+            brok = broks[brok_id]
             #print "Managing a brok type", brok.type, "of id", brok_id
             #if brok.type == 'update_service_status':
             #    print "Problem?", brok.data['is_problem']
@@ -69,7 +70,6 @@ class TestConfig(ShinkenTest):
                 brok = copy.deepcopy(brok)
             brok.prepare()
             self.livestatus_broker.manage_brok(brok)
-        self.sched.brokers['Default-Broker']['broks'] = {}
 
     def lines_equal(self, text1, text2):
         # gets two multiline strings and compares the contents
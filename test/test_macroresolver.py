@@ -116,6 +116,18 @@ class TestMacroResolver(ShinkenTest):
         self.assert_(env['NAGIOS__HOSTOSTYPE'] == 'gnulinux')
         self.assert_('NAGIOS_USER1' not in env)
 
+    # The checks get the global macros in their environment too
+    def test_env_global_macros(self):
+        (svc, hst) = self.get_hst_svc()
+        svc.checks_in_progress = []
+        svc.in_checking = False
+        svc.launch_check(time.time())
+        c = svc.checks_in_progress[0]
+        self.assert_(c.env != {})
+        self.assert_(c.env['NAGIOS_HOSTNAME'] == 'test_host_0')
+        self.assert_('NAGIOS_TOTALHOSTSUP' in c.env)
+        self.assert_('NAGIOS_TOTALSERVICESCRITICAL' in c.env)
+
 
     def test_resource_file(self):
         mr = self.get_mr()
@@ -217,7 +229,69 @@ class TestMacroResolver(ShinkenTest):
         print com
         self.assert_(com == 'plugins/nothing ::1')
 
+
+    # A $$ is a $, not a macro, unknown macros are void, and the macros
+    # in the values of the macros are resolved too
+    def test_dollars_and_nested_macros(self):
+        mr = self.get_mr()
+        (svc, hst) = self.get_hst_svc()
+        data = svc.get_data_for_checks()
+        svc.customs['_PRICE'] = '$$10 $_HOSTOSTYPE$'
+        dummy_call = "special_macro!$$HOSTNAME$$ $NOTAMACRO$$HOSTNAME$ $_SERVICEPRICE$ $USER1$$"
+        cc = CommandCall(self.conf.commands, dummy_call)
+        com = mr.resolve_command(cc, data)
+        print com
+        self.assert_(com == 'plugins/nothing $HOSTNAME$ test_host_0 $10 gnulinux plugins$')
+        # The caller data are not changed
+        self.assert_(data == svc.get_data_for_checks())
+        # Same result with the template we already got
+        com = mr.resolve_command(cc, data)
+        self.assert_(com == 'plugins/nothing $HOSTNAME$ test_host_0 $10 gnulinux plugins$')
+
         
+    # The global totals macros are computed once by scheduler tick
+    def test_totals_macros(self):
+        mr = self.get_mr()
+        (svc, hst) = self.get_hst_svc()
+        data = svc.get_data_for_checks()
+        for h in self.sched.hosts:
+            h.state = 'UP'
+        for s in self.sched.services:
+            s.state = 'OK'
+        hst.state = 'DOWN'
+        hst.is_problem = True
+        svc.state = 'CRITICAL'
+        svc2 = self.sched.services.find_srv_by_name_and_hostname("test_host_0", "test_another_service")
+        svc2.state = 'CRITICAL'
+        svc2.problem_has_been_acknowledged = True
+        dummy_call = "special_macro!$TOTALHOSTSDOWN$ $TOTALHOSTSDOWNUNHANDLED$ $TOTALHOSTPROBLEMS$ $TOTALSERVICESCRITICAL$ $TOTALSERVICESCRITICALUNHANDLED$"
+        cc = CommandCall(self.conf.commands, dummy_call)
+        com = mr.resolve_command(cc, data)
+        print com
+        # svc is not unhandled: its host is down
+        self.assert_(com == 'plugins/nothing 1 1 1 2 0')
+
+        # Same tick: same totals
+        hst.state = 'UP'
+        com = mr.resolve_command(cc, data)
+        self.assert_(com == 'plugins/nothing 1 1 1 2 0')
+        # New tick, new totals
+        hst.is_problem = False
+        mr.reset_totals()
+        com = mr.resolve_command(cc, data)
+        print com
+        self.assert_(com == 'plugins/nothing 0 0 0 2 1')
+
+    # The on demand macros of unknown elements are void
+    def test_ondemand_unknown(self):
+        mr = self.get_mr()
+        (svc, hst) = self.get_hst_svc()
+        data = svc.get_data_for_checks()
+        dummy_call = "special_macro!x$HOSTSTATE:nothere$x$SERVICESTATE:test_host_0:nothere$x$HOSTGROUPALIAS:nothere$x"
+        cc = CommandCall(self.conf.commands, dummy_call)
+        com = mr.resolve_command(cc, data)
+        self.assert_(com == 'plugins/nothing xxxx')
+
 
 if __name__ == '__main__':
     unittest.main()
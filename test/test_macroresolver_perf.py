@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the macro resolution of the check commands,
+# like the scheduler does for each check of each service
+#
+
+from shinken_test import *
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.macroresolver import MacroResolver
+from shinken.commandcall import CommandCall
+
+
+class TestMacroResolverPerf(ShinkenTest):
+
+    def setUp(self):
+        self.setup_with_file('etc/nagios_macroresolver.cfg')
+
+    def bench(self, nb):
+        mr = MacroResolver()
+        mr.init(self.conf)
+        svc = self.sched.services.find_srv_by_name_and_hostname("test_host_0", "test_ok_0")
+        hst = self.sched.hosts.find_by_name("test_host_0")
+        svc.customs['_PORT'] = '8080'
+        hst.customs['_COMMUNITY'] = 'public'
+        # Each service got its own command call, with args and custom macros
+        calls = []
+        for i in xrange(nb):
+            calls.append(CommandCall(self.conf.commands, 'check_service!ok_%d' % i))
+            calls.append(CommandCall(self.conf.commands,
+                                     'special_macro!-H $HOSTADDRESS$ -p $_SERVICEPORT$ -C $_HOSTCOMMUNITY$ -n %d' % i))
+        t0 = time.time()
+        for cc in calls:
+            com = mr.resolve_command(cc, svc.get_data_for_checks())
+        t = time.time() - t0
+        self.assert_(com == 'plugins/nothing -H 127.0.0.1 -p 8080 -C public -n %d' % (nb - 1))
+        print "Services: %d, commands resolved: %d in %.2fs (%.0f commands/s)" % (nb, len(calls), t, len(calls) / t)
+
+    def test_macroresolver_perf(self):
+        self.bench(2000)
+
+    def test_macroresolver_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_macroresolver_perf.py TestMacroResolverPerf.test_macroresolver_perf_big
+        return
+        self.bench(100000)
+
+
+if __name__ == '__main__':
+    unittest.main()
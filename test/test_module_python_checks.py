@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the python_checks poller module, that run
+# the python checks in python interpreters that stay up
+#
+
+import os
+import sys
+from Queue import Empty
+from multiprocessing import Queue
+
+from shinken_test import *
+# we have an external process, so we must un-fake time functions
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.objects.module import Module
+from shinken.modulesctx import modulesctx
+python_checks = modulesctx.get_module('python_checks')
+get_instance = python_checks.get_instance
+
+# For the entry points of the checks
+sys.path.append(os.path.abspath('libexec'))
+
+modconf = Module()
+modconf.module_name = "PythonChecks"
+modconf.module_type = python_checks.properties['type']
+modconf.properties = python_checks.properties.copy()
+modconf.processes = '2'
+
+
+class TestModulePythonChecks(ShinkenTest):
+
+    def setUp(self):
+        self.sl = get_instance(modconf)
+        self.sl.id = 1
+        self.sl.init()
+        self.sl.checks = []
+        self.sl.s = Queue()
+        self.sl.returns_queue = Queue()
+
+    def tearDown(self):
+        self.sl.stop_runners()
+
+    def run_checks(self, checks, max_time=10):
+        for c in checks:
+            self.sl.s.put(Message(id=0, type='Do', data=c))
+        res = []
+        end = time.time() + max_time
+        while len(res) < len(checks) and time.time() < end:
+            self.sl.get_new_checks()
+            self.sl.launch_new_checks()
+            self.sl.manage_finished_checks()
+            try:
+                while True:
+                    res.append(self.sl.returns_queue.get(timeout=0.01))
+            except Empty:
+                pass
+        return res
+
+    def test_python_checks(self):
+        if os.name == 'nt':
+            return
+        c1 = Check('queue', 'libexec/check_python_dummy.py 2', None, time.time(), env={'CHECK_VAR': 'hello'})
+        c2 = Check('queue', 'check_python_dummy:check 1 a b', None, time.time())
+        c3 = Check('queue', 'libexec/check_not_here.py', None, time.time())
+        res = self.run_checks([c1, c2, c3])
+        self.assert_(len(res) == 3)
+        res = dict((c.command, c) for c in res)
+
+        c = res[c1.command]
+        self.assert_(c.status == 'done')
+        self.assert_(c.exit_status == 2)
+        self.assert_(c.output == 'Python check 2 hello')
+        c = res[c2.command]
+        self.assert_(c.exit_status == 1)
+        self.assert_(c.output == 'Entry point a b')
+        c = res[c3.command]
+        self.assert_(c.exit_status == 3)
+        self.assert_(c.output.startswith('UNKNOWN - OSError'))
+
+    def test_warm_runners(self):
+        if os.name == 'nt':
+            return
+        checks = [Check('queue', 'libexec/check_python_dummy.py 0', None, time.time()) for i in xrange(6)]
+        res = self.run_checks(checks)
+        self.assert_(len(res) == 6)
+        # Only our 2 interpreters ran them
+        pids = set(c.perf_data for c in res)
+        self.assert_(len(pids) <= 2)
+        self.assert_('pid=%d' % os.getpid() not in pids)
+        for c in res:
+            self.assert_(c.exit_status == 0)
+
+    def test_timeout(self):
+        if os.name == 'nt':
+            return
+        t0 = time.time()
+        c1 = Check('queue', 'libexec/check_python_dummy.py 0 5', None, time.time(), timeout=1)
+        res = self.run_checks([c1])
+        # (the module may sleep 1s before it sees the check)
+        self.assert_(time.time() - t0 < 3)
+        self.assert_(len(res) == 1)
+        self.assert_(res[0].status == 'timeout')
+        self.assert_(res[0].exit_status == 3)
+        # Its runner was killed, another one will be started for the next checks
+        res = self.run_checks([Check('queue', 'libexec/check_python_dummy.py 0', None, time.time()) for i in xrange(2)])
+        self.assert_([c.exit_status for c in res] == [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
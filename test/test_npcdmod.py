@@ -101,10 +101,11 @@ class TestNpcd(ShinkenTest):
 
     def update_broker(self):
         self.sched.get_new_broks()
-        ids = self.sched.brokers['Default-Broker']['broks'].keys()
+        broks = self.sched.get_broks('Default-Broker')
+        ids = broks.keys()
         ids.sort()
         for i in ids:
-            brok = self.sched.brokers['Default-Broker']['broks'][i]
+            brok = broks[i]
             brok.prepare()
             self.npcdmod_broker.manage_brok(brok)
         self.sched.broks = {}
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the distribution of the packs of hosts
+# between the schedulers, with their load and weight
+#
+
+import os
+import shutil
+import tempfile
+
+from shinken_test import *
+from gen_big_config import gen_config
+
+
+class TestPacksLoad(ShinkenTest):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        # 10 packs of 10 hosts, with the same load. The distribution
+        # file is in self.tmp too
+        self.main = gen_config(self.tmp, 100, 2, 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def change_file(self, name, old, new):
+        path = os.path.join(self.tmp, name)
+        buf = open(path).read()
+        self.assert_(old in buf)
+        f = open(path, 'w')
+        f.write(buf.replace(old, new))
+        f.close()
+
+    def set_weight(self, sched_name, weight):
+        self.change_file('shinken-specific.cfg', 'scheduler_name  %s\n' % sched_name,
+                         'scheduler_name  %s\n    weight          %d\n' % (sched_name, weight))
+
+    def load(self):
+        self.setup_with_file(self.main)
+        self.assert_(self.conf.conf_is_correct)
+        res = {}
+        for cfg in self.conf.confs.values():
+            # The projected load is the one of the hosts and services the configuration got
+            load = sum([h.get_checks_load() for h in cfg.hosts]) + sum([s.get_checks_load() for s in cfg.services])
+            self.assertAlmostEqual(load, cfg.projected_load)
+            res[cfg.planned_scheduler] = cfg
+        self.assertEqual(['scheduler-0', 'scheduler-1'], sorted(res.keys()))
+        return res
+
+    def test_same_weights(self):
+        confs = self.load()
+        self.assertEqual(50, len(confs['scheduler-0'].hosts))
+        self.assertEqual(50, len(confs['scheduler-1'].hosts))
+
+    def test_weights(self):
+        self.set_weight('scheduler-1', 3)
+        confs = self.load()
+        self.assertEqual(20, len(confs['scheduler-0'].hosts))
+        self.assertEqual(80, len(confs['scheduler-1'].hosts))
+
+    def test_checks_load(self):
+        # The pack of host-0 got 10 services more, checked every minute
+        services = ''
+        for i in xrange(10):
+            services += """
+define service {
+    use                     linux-service
+    host_name               host-0
+    service_description     Fast service %d
+    check_command           check_service!%d!$_SERVICEWARN$
+    check_interval          1
+}
+""" % (i, i)
+        f = open(os.path.join(self.tmp, 'hosts', 'fast.cfg'), 'w')
+        f.write(services)
+        f.close()
+        confs = self.load().values()
+        confs.sort(key=lambda cfg: cfg.hosts.find_by_name('host-0') is None)
+        # So the scheduler that got it has less hosts, but near the same load
+        self.assert_(len(confs[0].hosts) < len(confs[1].hosts))
+        self.assert_(abs(confs[0].projected_load - confs[1].projected_load) < confs[1].projected_load / 5)
+
+    def test_distribution_file(self):
+        old = dict([(name, set([h.get_name() for h in cfg.hosts])) for (name, cfg) in self.load().items()])
+        # The hosts stay in their scheduler, even with another weight
+        self.set_weight('scheduler-1', 3)
+        new = dict([(name, set([h.get_name() for h in cfg.hosts])) for (name, cfg) in self.load().items()])
+        self.assertEqual(old, new)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -127,7 +127,8 @@ class TestTimeperiods(ShinkenTest):
         t_next_inv = t.get_next_invalid_time_from_t(july_the_12)
         t_next_inv = time.asctime(time.localtime(t_next_inv))
         print "RES:", t_next_inv #, t.is_time_valid(july_the_12)
-        self.assert_(t_next_inv == "Tue Jul 13 07:01:00 2010")
+        # 07:00 is still valid, so the first invalid second is just after
+        self.assert_(t_next_inv == "Tue Jul 13 07:00:01 2010")
 
         # Now ask about at 00:00 time?
         july_the_12 = time.mktime(time.strptime("12 Jul 2010 00:00:00", "%d %b %Y %H:%M:%S"))
@@ -413,5 +414,93 @@ class TestTimeperiods(ShinkenTest):
         print "T next", t_next
         self.assert_(t_next == "Wed Jul 14 00:00:00 2010")
 
+    # The next weeks are looked in the table of the valid intervals,
+    # it must give the same results than the dateranges
+    def test_table_with_multiple_excludes(self):
+        self.print_header()
+        lunch = Timeperiod()
+        lunch.timeperiod_name = 'lunch'
+        lunch.resolve_daterange(lunch.dateranges, 'tuesday 12:00-14:00')
+        lunch.resolve_daterange(lunch.dateranges, 'thursday 12:00-14:00')
+        holidays = Timeperiod()
+        holidays.timeperiod_name = 'holidays'
+        holidays.resolve_daterange(holidays.dateranges, 'day 15 00:00-24:00')
+        holidays.resolve_daterange(holidays.dateranges, 'december 25 00:00-24:00')
+        t = Timeperiod()
+        t.timeperiod_name = 'workhours'
+        for day in ('monday', 'tuesday', 'wednesday', 'thursday', 'friday'):
+            t.resolve_daterange(t.dateranges, '%s 08:00-12:00,13:30-18:00' % day)
+        t.resolve_daterange(t.dateranges, 'saturday 09:00-12:00')
+        t.exclude = [holidays, lunch]
+
+        def is_valid(t1):
+            for dr in lunch.dateranges + holidays.dateranges:
+                if dr.is_time_valid(t1):
+                    return False
+            for dr in t.dateranges:
+                if dr.is_time_valid(t1):
+                    return True
+            return False
+
+        now = int(time.time())
+        for t1 in xrange(now, now + 86400 * 40, 7 * 60 + 13):
+            self.assert_(t.is_time_valid(t1) == is_valid(t1))
+            t_next = t.get_next_valid_time_from_t(t1)
+            self.assert_(is_valid(t_next))
+            self.assert_(t_next == t1 or not is_valid(t_next - 1))
+            t_next_inv = t.get_next_invalid_time_from_t(t1)
+            self.assert_(not is_valid(t_next_inv))
+            self.assert_(t_next_inv == t1 or is_valid(t_next_inv - 1))
+        self.assert_(t.table_start <= now < t.table_end)
+
+        # The table is computed again before we reach its end
+        table_end = t.table_end
+        t.clean_cache()
+        self.assert_(t.table_end == table_end)
+        time_warp(86400 * 40)
+        t.clean_cache()
+        self.assert_(t.table_end > table_end)
+        self.assert_(t.table_start <= time.time() < t.table_end)
+
+    # The state of the timeperiod is computed once for the tick, and it's
+    # read until the next transition
+    def test_state_snapshot(self):
+        self.print_header()
+        t = Timeperiod()
+        t.timeperiod_name = 'T1'
+        t.resolve_daterange(t.dateranges, 'monday 08:00-18:00')
+        july_the_12 = time.mktime(time.strptime("12 Jul 2010 07:00:00", "%d %b %Y %H:%M:%S"))
+        eight = july_the_12 + 3600
+        t.update_state(july_the_12)
+        self.assert_(t.state_active is False)
+        self.assert_(t.state_next == eight)
+        self.assert_(t.get_next_valid_time_from_t(july_the_12 + 60) == eight)
+        self.assert_(not t.is_time_valid(eight - 1))
+        # Nothing to compute before the transition
+        t.update_state(july_the_12 + 60)
+        self.assert_(t.state_start == july_the_12)
+
+        t.update_state(eight)
+        self.assert_(t.state_active is True)
+        self.assert_(time.asctime(time.localtime(t.state_next)) == "Mon Jul 12 18:00:01 2010")
+        self.assert_(t.is_time_valid(eight + 600))
+        self.assert_(t.get_next_invalid_time_from_t(eight + 600) == t.state_next)
+
+        # If the timeperiod changed, the state is computed again
+        t.dateranges = []
+        t.update_state(eight)
+        self.assert_(t.state_active is False)
+        self.assert_(t.state_next is None)
+        self.assert_(t.get_next_valid_time_from_t(eight) is None)
+
+        # The scheduler computes it for all its timeperiods at each tick
+        now = time.time()
+        self.sched.update_timeperiods_state()
+        for tp in self.sched.timeperiods:
+            self.assert_(tp.state_start <= now < tp.state_end)
+        t = self.sched.timeperiods.find_by_name('24x7')
+        self.assert_(t.state_active is True)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the scheduling of the checks with
+# complex check periods, with exclusions
+#
+
+from shinken_test import *
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.objects.timeperiod import Timeperiod
+
+
+class TestTimeperiodsPerf(ShinkenTest):
+
+    def setUp(self):
+        self.setup_with_file('etc/nagios_1r_1h_1s.cfg')
+
+    def get_timeperiod(self, name, entries, exclude=[]):
+        t = Timeperiod()
+        t.timeperiod_name = name
+        for entry in entries:
+            t.resolve_daterange(t.dateranges, entry)
+        t.exclude = exclude
+        return t
+
+    def bench(self, nb):
+        lunch = self.get_timeperiod('lunch', ['tuesday 12:00-14:00', 'thursday 12:00-14:00'])
+        holidays = self.get_timeperiod('holidays', ['january 1 00:00-24:00', 'may 1 00:00-24:00',
+                                                    'december 25 00:00-24:00', 'day 15 00:00-24:00'])
+        workhours = self.get_timeperiod('workhours', ['monday 08:00-12:00,13:30-18:00',
+                                                      'tuesday 08:00-18:00',
+                                                      'wednesday 08:00-12:00,13:30-18:00',
+                                                      'thursday 08:00-18:00',
+                                                      'friday 08:00-12:00,13:30-17:00',
+                                                      'saturday 09:00-12:00'],
+                                        [holidays, lunch])
+
+        svc = self.sched.services.find_srv_by_name_and_hostname("test_host_0", "test_ok_0")
+        svc.check_period = workhours
+        svc.state_type = 'HARD'
+        now = time.time()
+        t0 = time.time()
+        for i in xrange(nb):
+            # Each check is in its own minute of the next week
+            svc.check_interval = 1 + (i * 7) % 10080
+            svc.next_chk = now - 1
+            svc.checks_in_progress = []
+            svc.in_checking = False
+            svc.actions = []
+            svc.schedule()
+            self.assert_(workhours.is_time_valid(svc.next_chk))
+        t = time.time() - t0
+        print "Checks scheduled: %d in %.2fs (%.0f checks/s)" % (nb, t, nb / t)
+
+        # And the timeperiod alone
+        t0 = time.time()
+        for i in xrange(nb):
+            workhours.get_next_valid_time_from_t(now + i * 61)
+            workhours.get_next_invalid_time_from_t(now + i * 61)
+        t = time.time() - t0
+        print "Next valid and invalid times: %d in %.2fs (%.0f/s)" % (nb, t, nb / t)
+
+    def test_timeperiods_perf(self):
+        self.bench(2000)
+
+    def test_timeperiods_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_timeperiods_perf.py TestTimeperiodsPerf.test_timeperiods_perf_big
+        return
+        self.bench(100000)
+
+
+if __name__ == '__main__':
+    unittest.main()
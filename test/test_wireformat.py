@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the binary frames format between daemons,
+# and the fallback to the old one
+#
+
+import base64
+import cPickle
+import json
+import zlib
+
+from shinken_test import *
+from shinken import wireformat
+from shinken.brok import Brok
+from shinken.http_client import HTTPClient
+
+
+class WireInterface(object):
+    def __init__(self):
+        self.received = None
+
+    def get_objects(self, nb):
+        return [Brok('log', {'log': 'line %d' % i}) for i in xrange(int(nb))]
+    get_objects.encode = 'pickle'
+
+    def put_objects(self, objs):
+        self.received = objs
+        return True
+    put_objects.method = 'post'
+
+
+class TestWireFormat(ShinkenTest):
+
+    def setUp(self):
+        pass
+
+    def test_frames(self):
+        value = {'a': range(2500), 'b': dict((i, str(i)) for i in xrange(2500)), 'c': 'hello', 'd': []}
+        data = wireformat.dumps_args(value)
+        self.assert_(data.startswith(wireformat.MAGIC))
+        self.assert_(wireformat.loads_args(data) == value)
+
+        # Loaded while the data are coming, even in very small pieces
+        d = wireformat.FrameDecoder()
+        for i in xrange(0, len(data), 7):
+            d.feed(data[i:i + 7])
+        self.assert_(d.get_values() == value)
+
+        # A truncated stream is an error
+        d = wireformat.FrameDecoder()
+        d.feed(data[:-3])
+        self.assertRaises(ValueError, d.get_values)
+
+        self.assert_(wireformat.loads(wireformat.dumps([])) == [])
+        self.assert_(wireformat.loads(wireformat.dumps(None)) is None)
+
+    def test_legacy(self):
+        value = range(100)
+        data = wireformat.dumps_legacy(value)
+        # It's the old json/base64/zlib/cPickle format
+        self.assert_(cPickle.loads(zlib.decompress(base64.b64decode(json.loads(data)))) == value)
+        d = wireformat.FrameDecoder()
+        for i in xrange(0, len(data), 3):
+            d.feed(data[i:i + 3])
+        self.assert_(not d.framed)
+        self.assert_(d.get_value() == value)
+
+    def test_http(self):
+        obj = WireInterface()
+        http_daemon, port = start_http_daemon(obj)
+        try:
+            con = HTTPClient(address='127.0.0.1', port=port)
+            # An old client got the old format
+            old = con.get('get_objects', {'nb': 10})
+            old = cPickle.loads(zlib.decompress(base64.b64decode(old)))
+            self.assert_(len(old) == 10)
+            # But we know now the other side can manage frames
+            self.assert_(con.frames)
+            broks = con.get_objects('get_objects', {'nb': 2500})
+            self.assert_(len(broks) == 2500)
+            broks[2499].prepare()
+            self.assert_(broks[2499].data == {'log': 'line 2499'})
+
+            # Post with frames, then with the old format
+            con.post('put_objects', {'objs': broks})
+            self.assert_(len(obj.received) == 2500)
+            con.frames = False
+            con.post('put_objects', {'objs': broks[:10]})
+            self.assert_(len(obj.received) == 10)
+        finally:
+            stop_http_daemon(http_daemon)
+
+
+if __name__ == '__main__':
+    unittest.main()
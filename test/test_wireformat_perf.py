@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the serialize + transfer + deserialize time
+# of broks, with the binary frames and with the old format
+#
+
+import base64
+import cPickle
+import pycurl
+import zlib
+
+from shinken_test import *
+from shinken.brok import Brok
+from shinken.http_client import HTTPClient
+
+time.time = original_time_time
+time.sleep = original_time_sleep
+
+
+class BrokSource(object):
+    def __init__(self):
+        self.broks = []
+
+    def get_bench_broks(self):
+        return self.broks
+    get_bench_broks.encode = 'pickle'
+
+
+class TestWireFormatPerf(ShinkenTest):
+
+    def setUp(self):
+        self.source = BrokSource()
+        self.http_daemon, self.port = start_http_daemon(self.source)
+
+    def tearDown(self):
+        stop_http_daemon(self.http_daemon)
+
+    def bench(self, nb):
+        data = {'host_name': 'host-1', 'service_description': 'service-1',
+                'state': 'OK', 'output': 'OK - all is fine, load is 0.42',
+                'perf_data': 'load1=0.42;5;10;0; load5=0.30;5;10;0;', 'last_chk': 1340000000}
+        self.source.broks = [Brok('service_check_result', data) for i in xrange(nb)]
+        con = HTTPClient(address='127.0.0.1', port=self.port, data_timeout=600)
+
+        # The old way: json/base64/zlib/cPickle
+        t0 = time.time()
+        res = con.get('get_bench_broks', wait='long')
+        res = cPickle.loads(zlib.decompress(base64.b64decode(res)))
+        old_time = time.time() - t0
+        old_size = con.con.getinfo(pycurl.SIZE_DOWNLOAD)
+        self.assert_(len(res) == nb)
+
+        # Binary frames, loaded while they are coming
+        t0 = time.time()
+        res = con.get_objects('get_bench_broks')
+        new_time = time.time() - t0
+        new_size = con.con.getinfo(pycurl.SIZE_DOWNLOAD)
+        self.assert_(len(res) == nb)
+
+        print "Broks: %7d, frames: %.3fs %9d bytes (old format was: %.3fs %9d bytes)" % \
+            (nb, new_time, new_size, old_time, old_size)
+        self.source.broks = []
+
+    def test_wireformat_perf(self):
+        self.bench(10000)
+
+    def test_wireformat_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_wireformat_perf.py TestWireFormatPerf.test_wireformat_perf_big
+        return
+        self.bench(100000)
+
+
+if __name__ == '__main__':
+    unittest.main()
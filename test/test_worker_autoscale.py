@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the number of workers of the pollers that
+# follow the load, and the actions given to the less loaded worker
+#
+
+from shinken_test import *
+# we have an external process, so we must un-fake time functions
+time.time = original_time_time
+time.sleep = original_time_sleep
+from multiprocessing import Manager
+from Queue import Empty
+from shinken.daemons.pollerdaemon import Poller
+
+
+# A scheduler connection that gives its checks by batches of max_actions
+class FakeSchedCon(object):
+    def __init__(self, checks):
+        self.checks = checks
+
+    def get(self, path, args={}, wait='short'):
+        return 'pong'
+
+    def get_objects(self, path, args={}, wait='long'):
+        res = self.checks[:args['max_actions']]
+        del self.checks[:args['max_actions']]
+        return res
+
+
+class TestWorkerAutoscale(ShinkenTest):
+
+    def setUp(self):
+        p = self.poller = Poller('', False, False, False, None, None)
+        p.manager = Manager()
+        p.returns_queue = p.manager.Queue()
+        p.q_by_mod = {'fork': {}}
+        p.min_workers = 1
+        p.max_workers = 3
+        p.processes_by_worker = 2
+        p.max_plugins_output_length = 8192
+        p.use_launcher = False
+        p.worker_max_cpu_load = 1000
+        p.worker_shrink_delay = 0
+        p.poller_tags = ['None']
+        p.reactionner_tags = ['None']
+        p.schedulers = {0: {'actions': {}, 'wait_homerun': {}, 'active': True}}
+
+    def tearDown(self):
+        for w in self.poller.workers.values():
+            w.terminate()
+            w.join(timeout=1)
+        self.poller.manager.shutdown()
+
+    def get_checks(self, nb, command='/bin/sleep 1'):
+        return [Check('scheduled', command, None, time.time()) for i in xrange(nb)]
+
+    def add_actions(self, nb, command='/bin/sleep 1'):
+        self.poller.add_actions(self.get_checks(nb, command), 0)
+
+    def get_returns(self, max_time=10):
+        p = self.poller
+        end = time.time() + max_time
+        while p.schedulers[0]['actions'] and time.time() < end:
+            try:
+                p.manage_action_return(p.returns_queue.get(timeout=0.1))
+            except Empty:
+                pass
+
+    def test_autoscale(self):
+        p = self.poller
+        p.adjust_worker_number_by_load()
+        self.assert_(len(p.workers) == 1)
+        self.assert_(p.get_free_slots() == 2)
+
+        # The scheduler got more checks than we can run: each full batch
+        # adds a worker, but no more than max_workers
+        con = p.schedulers[0]['con'] = FakeSchedCon(self.get_checks(8))
+        p.get_new_actions()
+        first = p.workers.values()[0]
+        self.assert_(first.nb_actions == 2)
+        self.assert_(p.get_free_slots() == 0)
+        p.adjust_worker_number_by_load()
+        self.assert_(len(p.workers) == 2)
+        # Nothing new: no other worker
+        p.adjust_worker_number_by_load()
+        self.assert_(len(p.workers) == 2)
+        p.get_new_actions()
+        p.adjust_worker_number_by_load()
+        self.assert_(len(p.workers) == 3)
+        p.get_new_actions()
+        p.adjust_worker_number_by_load()
+        self.assert_(len(p.workers) == 3)
+        # New actions went to the new workers, not the loaded one
+        self.assert_(first.nb_actions == 2)
+        self.assert_([w.nb_actions for w in p.workers.values()] == [2, 2, 2])
+        self.assert_(len(con.checks) == 2)
+
+        # The scheduler gives its last checks, less than we asked: it
+        # does not need more workers
+        self.get_returns()
+        p.get_new_actions()
+        self.assert_(con.checks == [])
+        self.assert_(p.get_free_slots() == 4)
+        self.assert_(p.full_batches_by_mod == {})
+
+        self.get_returns()
+        self.assert_(len(p.schedulers[0]['wait_homerun']) == 8)
+        self.assert_([w.nb_actions for w in p.workers.values()] == [0, 0, 0])
+
+        # Nothing to do: we go back to min_workers
+        p.adjust_worker_number_by_load()
+        self.assert_(len(p.workers) == 2)
+        p.adjust_worker_number_by_load()
+        self.assert_(len(p.workers) == 1)
+        p.adjust_worker_number_by_load()
+        self.assert_(len(p.workers) == 1)
+        self.assert_(len(p.q_by_mod['fork']) == 1)
+
+    def test_retiring(self):
+        p = self.poller
+        p.min_workers = 2
+        p.adjust_worker_number_by_load()
+        self.assert_(len(p.workers) == 2)
+        p.min_workers = 1
+        # Let them start before we stop one
+        time.sleep(0.5)
+        self.add_actions(1)
+        busy = [w for w in p.workers.values() if w.nb_actions == 1][0]
+        # The idle one is retired at once
+        p.adjust_worker_number_by_load()
+        self.assert_(p.workers.values() == [busy])
+
+        # A retiring worker do not get new actions, and stop only when
+        # it gave back the ones it got
+        p.min_workers = 2
+        p.adjust_worker_number_by_load()
+        p.min_workers = 1
+        busy.retiring = True
+        self.add_actions(1)
+        self.assert_(busy.nb_actions == 1)
+        self.assert_(p.get_free_slots() == 0)
+        p.adjust_worker_number_by_load()
+        self.assert_(busy.id in p.workers)
+        self.get_returns()
+        p.adjust_worker_number_by_load()
+        self.assert_(busy.id not in p.workers)
+        self.assert_(len(p.workers) == 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the worker that wait for its checks
+# with select instead of polling them
+#
+
+import signal
+
+from shinken_test import *
+# we have an external process, so we must un-fake time functions
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.worker import Worker
+from multiprocessing import Queue
+from Queue import Empty
+
+
+class TestWorkerEvents(ShinkenTest):
+
+    def setUp(self):
+        self.to_queue = Queue()
+        self.from_queue = Queue()
+        self.w = Worker(1, self.to_queue, self.from_queue, 10)
+        self.w.i_am_dying = False
+        self.w.checks = []
+        self.w.returns_queue = self.from_queue
+        self.w.s = self.to_queue
+        if self.w.use_events:
+            self.w.init_events()
+
+    def tearDown(self):
+        if self.w.use_events:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            os.close(self.w.wake_r)
+            os.close(self.w.wake_w)
+            os.close(self.w.sigchld_r)
+
+    def add_check(self, command, timeout=10):
+        c = Check('queue', command, None, time.time(), timeout=timeout)
+        self.w.s.put(Message(id=0, type='Do', data=c))
+        self.w.wake()
+
+    # Simulate the do_work loop, until we got nb results
+    def get_results(self, nb, max_time=10):
+        res = []
+        end = time.time() + max_time
+        while len(res) < nb and time.time() < end:
+            self.w.get_new_checks()
+            self.w.launch_new_checks()
+            self.w.wait_for_checks_events()
+            try:
+                while True:
+                    res.append(self.from_queue.get(timeout=0.01))
+            except Empty:
+                pass
+        return res
+
+    def test_results(self):
+        if not self.w.use_events:
+            return
+        t0 = time.time()
+        for i in xrange(5):
+            self.add_check('/bin/echo "OK - fine %d|a=%d"' % (i, i))
+        res = self.get_results(5)
+        # No more polling sleeps, even with a few checks at once
+        self.assert_(time.time() - t0 < 1)
+        self.assert_(len(res) == 5)
+        outputs = sorted(c.output for c in res)
+        self.assert_(outputs == ['OK - fine %d' % i for i in xrange(5)])
+        for c in res:
+            self.assert_(c.status == 'done')
+            self.assert_(c.exit_status == 0)
+        self.assert_(self.w.checks == [])
+        self.assert_(self.w.fd_to_check == {})
+
+    def test_big_output(self):
+        if not self.w.use_events:
+            return
+        # More than a pipe buffer, the plugin must not block on its output
+        self.add_check('/bin/sh -c "head -c 200000 /dev/zero | tr \'\\\\0\' x"')
+        res = self.get_results(1)
+        self.assert_(len(res) == 1)
+        self.assert_(res[0].status == 'done')
+        self.assert_(res[0].output == 'x' * self.w.max_plugins_output_length)
+
+    def test_timeout(self):
+        if not self.w.use_events:
+            return
+        t0 = time.time()
+        self.add_check('/bin/sleep 7', timeout=1)
+        res = self.get_results(1)
+        self.assert_(len(res) == 1)
+        self.assert_(res[0].status == 'timeout')
+        self.assert_(res[0].exit_status == 3)
+        self.assert_(time.time() - t0 < 2)
+
+    def test_son_keeps_outputs(self):
+        if not self.w.use_events:
+            return
+        # The plugin exits at once, but its son keeps its stdout. The
+        # SIGCHLD comes before the 1s of the last look at all the checks,
+        # it must not be forgotten
+        self.w.last_sweep = time.time()
+        t0 = time.time()
+        self.add_check('/bin/sh -c "sleep 6 & echo OK - son in background"', timeout=5)
+        res = self.get_results(1)
+        self.assert_(len(res) == 1)
+        self.assert_(res[0].status == 'done')
+        self.assert_(res[0].output == 'OK - son in background')
+        self.assert_(time.time() - t0 < 3)
+
+    def test_wake(self):
+        if not self.w.use_events:
+            return
+        # Without checks, the worker wait up to 1s, but it is woken
+        # up as soon as the master give it something
+        t0 = time.time()
+        self.w.wait_for_checks_events()
+        self.assert_(time.time() - t0 > 0.5)
+        self.w.wake()
+        t0 = time.time()
+        self.w.wait_for_checks_events()
+        self.assert_(time.time() - t0 < 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
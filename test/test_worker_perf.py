@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2012:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to bench the number of checks by second a worker
+# can run, with the events (select) and with the old polling
+#
+
+from shinken_test import *
+# we have an external process, so we must un-fake time functions
+time.time = original_time_time
+time.sleep = original_time_sleep
+from shinken.worker import Worker
+from multiprocessing import Queue
+
+
+class TestWorkerPerf(ShinkenTest):
+
+    def setUp(self):
+        pass
+
+    def run_checks(self, nb, concurrent, use_events):
+        to_queue = Queue()
+        from_queue = Queue()
+        w = Worker(1, to_queue, from_queue, concurrent)
+        w.use_events = w.use_events and use_events
+        for i in xrange(nb):
+            c = Check('queue', '/bin/true', None, time.time(), timeout=30)
+            to_queue.put(Message(id=0, type='Do', data=c))
+        t0 = time.time()
+        w.start()
+        try:
+            for i in xrange(nb):
+                c = from_queue.get(timeout=120)
+                self.assert_(c.status == 'done')
+            return time.time() - t0
+        finally:
+            w.terminate()
+            w.join()
+
+    def bench(self, nb, concurrent):
+        if os.name == 'nt':
+            return
+        new_time = self.run_checks(nb, concurrent, True)
+        old_time = self.run_checks(nb, concurrent, False)
+        print "Checks: %6d, concurrent: %4d, events: %.2fs (%6.0f checks/s), polling: %.2fs (%6.0f checks/s)" % \
+            (nb, concurrent, new_time, nb / new_time, old_time, nb / old_time)
+
+    def test_worker_perf(self):
+        self.bench(100, 1)
+        self.bench(500, 100)
+
+    def test_worker_perf_big(self):
+        # COMMENT THIS LINE to enable the bench and call
+        # python test_worker_perf.py TestWorkerPerf.test_worker_perf_big
+        return
+        self.bench(1000, 1)
+        self.bench(5000, 100)
+        self.bench(10000, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()